@@ -11,9 +11,12 @@ Screen Translate (Gemini API)
 """
 
 from dataclasses import dataclass
-import base64, io, os, sys, threading, time, json, re
-from typing import Optional, Dict, List
+import base64, io, os, sys, threading, time, json, re, hashlib, sqlite3, heapq, itertools, socket, contextlib, random
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, List, Callable
 import requests
+import numpy as np
 from PIL import Image, ImageEnhance, ImageDraw, ImageFont, ImageFilter
 
 from PySide6.QtCore import Qt, QRect, QTimer, QPoint, QCoreApplication, QThread, Signal, Slot, QSize
@@ -99,7 +102,12 @@ ANN_SIDE_WIDTH_PX  = int(os.environ.get("OST_ANN_SIDE_WIDTH", "420"))
 
 API_MODEL = os.environ.get("GEMINI_MODEL", "gemini-2.5-flash")
 API_VERSION = "v1beta" if "2.5" in API_MODEL else "v1"
-API_ENDPOINT = f"https://generativelanguage.googleapis.com/{API_VERSION}/models/{API_MODEL}:generateContent"
+# OST_API_BASE: 検証用のローカル代替サーバ等に向ける場合のみ指定
+API_HOST = (os.environ.get("OST_API_BASE", "").strip() or "https://generativelanguage.googleapis.com").rstrip("/")
+API_ENDPOINT = f"{API_HOST}/{API_VERSION}/models/{API_MODEL}:generateContent"
+API_STREAM_ENDPOINT = f"{API_HOST}/{API_VERSION}/models/{API_MODEL}:streamGenerateContent?alt=sse"
+# 1: streamGenerateContent(SSE) で受け取り、届いた分の訳文から順に表示する
+OST_STREAM = os.environ.get("OST_STREAM", "0") == "1"
 
 # メイン画面だけを対象にするモード（1で有効）
 OST_PRIMARY_ONLY = os.environ.get("OST_PRIMARY_ONLY", "0") == "1"
@@ -140,6 +148,8 @@ KEEP_SOURCE = os.environ.get("OST_KEEP_SOURCE", "1") == "1"
 OST_RECITATION_AUTO = os.environ.get("OST_RECITATION_AUTO", "1") == "1"
 OST_SLICE_ON_RECITATION = os.environ.get("OST_SLICE_ON_RECITATION", "1") == "1"
 OST_SLICE_PARTS = max(2, int(os.environ.get("OST_SLICE_PARTS", "3")))
+# 分割再翻訳の同時実行数（結果は上から順に結合）
+OST_SLICE_WORKERS = max(1, int(os.environ.get("OST_SLICE_WORKERS", "3")))
 # JA-only再試行を行うか (0: 行わず直接スライス, 1: 行う)。既定は 0
 OST_RECITATION_JA_RETRY = os.environ.get("OST_RECITATION_JA_RETRY", "0") == "1"
 
@@ -153,6 +163,26 @@ EXIT_HOTKEY = os.environ.get("OST_EXIT_HOTKEY", "ctrl+shift+f12").strip().lower(
 CONNECT_TIMEOUT = float(os.environ.get("OST_HTTP_CONNECT_TIMEOUT", "12"))
 READ_TIMEOUT    = float(os.environ.get("OST_HTTP_READ_TIMEOUT", "120"))
 DEBUG           = os.environ.get("OST_DEBUG", "0") == "1"
+# keep-alive 接続プール（TLS ハンドシェイクの使い回し）と事前接続
+OST_HTTP_POOL         = max(1, int(os.environ.get("OST_HTTP_POOL", "8")))           # ホストあたりの最大接続数
+OST_HTTP_PREWARM      = max(0, int(os.environ.get("OST_HTTP_PREWARM", "2")))        # 起動時/アイドル明けに張っておく接続数（0=しない）
+OST_HTTP_IDLE_REWARM  = float(os.environ.get("OST_HTTP_IDLE_REWARM", "45"))         # これ以上アイドルなら張り直す(秒)
+OST_HTTP_WARM_MAX_IDLE= float(os.environ.get("OST_HTTP_WARM_MAX_IDLE", "1800"))     # これ以上使われていなければ張り直しを休む(秒)
+# ヘッジ（遅い応答に 2 本目を重ねる）と、実測に合わせた接続/読み取りタイムアウト
+OST_HEDGE_PCT         = float(os.environ.get("OST_HEDGE_PCT", "0"))                 # 実測のこの百分位を過ぎたら 2 本目を投げる（0=しない。2 本目も課金される）
+OST_HEDGE_MIN_S       = float(os.environ.get("OST_HEDGE_MIN_S", "2.0"))             # これより早くは 2 本目を投げない(秒)
+OST_HTTP_READ_TIMEOUT_MIN = float(os.environ.get("OST_HTTP_READ_TIMEOUT_MIN", "20"))  # 実測から縮めるときの下限(秒)
+# クォータ（契約プランの上限に合わせる）と再試行
+OST_RPM               = max(0, int(os.environ.get("OST_RPM", "0")))                 # 1 分あたりのリクエスト上限（0=制限しない）
+OST_TPM               = max(0, int(os.environ.get("OST_TPM", "0")))                 # 1 分あたりのトークン上限（0=制限しない）
+OST_API_RETRIES       = max(0, int(os.environ.get("OST_API_RETRIES", "3")))         # 通信エラー/429/5xx の再試行回数
+OST_BACKOFF_BASE      = float(os.environ.get("OST_BACKOFF_BASE", "0.8"))            # 指数バックオフの初期値(秒)
+OST_BACKOFF_MAX       = float(os.environ.get("OST_BACKOFF_MAX", "30"))              # 同・上限(秒)
+OST_BREAKER_FAILS     = max(1, int(os.environ.get("OST_BREAKER_FAILS", "5")))       # 連続でこの回数失敗したら送信を止める
+OST_BREAKER_COOLDOWN  = float(os.environ.get("OST_BREAKER_COOLDOWN", "30"))         # 止めておく秒数（明けたら 1 本だけ試す）
+# 複数 API キー（GEMINI_API_KEYS にカンマ/空白区切り）。RPM/TPM/ブレーカーはキーごと
+OST_KEY_POLICY        = os.environ.get("OST_KEY_POLICY", "least").strip().lower()   # least=実行中の少ないキー / rr=順番
+OST_KEY_COOLDOWN      = float(os.environ.get("OST_KEY_COOLDOWN", "300"))            # 403 を返したキーを外しておく秒数
 POLL_ON         = os.environ.get("OST_POLL", "1") == "1"
 
 # GUI モード
@@ -161,73 +191,2957 @@ OST_GUI_MODE = os.environ.get("OST_GUI_MODE", "0") == "1"
 #  既定は 0（無効）。1 にすると GUI モードでもホットキーを登録/ポーリングします。
 OST_GUI_HOTKEYS = os.environ.get("OST_GUI_HOTKEYS", "0") == "1"
 
+# Watch（ROIの変化を検知して自動翻訳）
+OST_WATCH        = os.environ.get("OST_WATCH", "0") == "1"                    # 起動時から有効にするか（Alt+W で切替）
+OST_WATCH_HZ     = max(0.5, float(os.environ.get("OST_WATCH_HZ", "10")))      # サンプリング頻度
+OST_WATCH_STABLE = max(1, int(os.environ.get("OST_WATCH_STABLE", "3")))      # 変化後この枚数だけ静止したら発火（文字送り対策）
+OST_WATCH_DIFF   = float(os.environ.get("OST_WATCH_DIFF", "10"))             # ブロック平均輝度の差（0-255）がこれを超えたら「変化」
+OST_WATCH_HOLD   = float(os.environ.get("OST_WATCH_HOLD", "0.6"))            # 翻訳完了後に基準を取り直す猶予(秒)
+
 # Concat
 CONCAT_MAX     = int(os.environ.get("OST_CONCAT_MAX", "8"))
 CONCAT_GAP_PX  = int(os.environ.get("OST_CONCAT_GAP", "6"))
 CONCAT_MODE_L  = os.environ.get("OST_CONCAT_MODE", "L").upper()  # L or RGB
+# スクロール重なりの除去（直前フレームと重なる行を捨てて継ぎ目なしで連結。ほぼ同一のフレームは追加しない）
+CONCAT_STITCH  = os.environ.get("OST_CONCAT_STITCH", "1") == "1"
+# 複数画像（ドロップ/選択/バッチ）を連結せず、1 リクエストに別々の画像として載せる
+OST_PACK       = os.environ.get("OST_PACK", "0") == "1"                       # ドロップ/選択した複数ファイルを連結ではなくパックで送る
+OST_PACK_MAX   = max(1, int(os.environ.get("OST_PACK_MAX", "8")))             # 1 リクエストに載せる最大枚数
+OST_PACK_MAX_BYTES = int(float(os.environ.get("OST_PACK_MAX_MB", "16")) * 1024 * 1024)  # 送信 JSON の上限（Gemini の inline 上限 20MB より手前）
+
+# 外置きパネル最小サイズ & ドラッグバー高
+PANEL_MIN_W = int(os.environ.get("OST_PANEL_MIN_W", "280"))
+PANEL_MIN_H = int(os.environ.get("OST_PANEL_MIN_H", "160"))
+PANEL_DRAG_BAR_H = int(os.environ.get("OST_PANEL_DRAG_BAR_H", "18"))
+
+# 枠の初期表示（環境変数で制御可能）
+SHOW_MAIN_FRAME_DEFAULT    = os.environ.get("OST_SHOW_MAIN_FRAME", "1") == "1"
+SHOW_SPEAKER_FRAME_DEFAULT = os.environ.get("OST_SHOW_SPEAKER_FRAME", "1") == "1"
+
+# 訳文欄の表示初期値
+SHOW_MSG_DEFAULT = os.environ.get("OST_MSG_VISIBLE", "1") == "1"
+
+# ROI 編集用ハンドル
+HANDLE_SIZE = int(os.environ.get("OST_HANDLE_SIZE", "12"))
+ROI_MIN_W   = int(os.environ.get("OST_ROI_MIN_W", "40"))
+ROI_MIN_H   = int(os.environ.get("OST_ROI_MIN_H", "30"))
+HANDLE_HOT  = int(os.environ.get("OST_HANDLE_HOT", "6"))  # 当たり判定の拡張
+
+# Auto-Edit（直接ドラッグ）
+AUTO_EDIT           = os.environ.get("OST_ROI_AUTO_EDIT", "1") == "1"
+AUTO_EDIT_MOVE      = os.environ.get("OST_ROI_AUTO_MOVE", "0") == "1"  # 内部ドラッグ移動（既定OFF）
+BORDER_MOVE_ENABLE  = os.environ.get("OST_ROI_BORDER_MOVE", "1") == "1"  # 縁での移動（既定ON）
+MOVE_BAND           = int(os.environ.get("OST_MOVE_BAND", "8"))  # 縁の幅(px)
+
+
+# --- Tone preset switching (Lite/Pro) ---
+OST_TONE_PRESET_MODE = os.environ.get("OST_TONE_PRESET_MODE", "lite").strip().lower()
+def _tone_preset_file_for_mode(mode: str) -> str:
+    base_dir = os.path.dirname(os.path.abspath(sys.argv[0]))
+    return os.path.join(base_dir, "ost_tone_presets_v2.json" if (mode or "").strip().lower()=="pro" else "ost_tone_presets.json")
+
+# --- Game-specific preset packs ---
+TONE_GAMES_DIR = os.environ.get("OST_TONE_GAMES_DIR", os.path.join(os.path.dirname(os.path.abspath(sys.argv[0])), "tone_games"))
+def _discover_tone_games() -> list:
+    try:
+        d = TONE_GAMES_DIR
+        if not os.path.isdir(d): return []
+        names = []
+        for name in sorted(os.listdir(d)):
+            p = os.path.join(d, name)
+            if not os.path.isdir(p): continue
+            lite = os.path.join(p, "ost_tone_presets.json")
+            pro  = os.path.join(p, "ost_tone_presets_v2.json")
+            if os.path.exists(lite) or os.path.exists(pro):
+                names.append(name)
+        return names
+    except Exception:
+        return []
+
+def _tone_preset_file_for_scope(mode: str, scope: str, game: str) -> str:
+    base_dir = os.path.dirname(os.path.abspath(sys.argv[0]))
+    if (scope or "").strip().lower()=="game" and (game or "").strip():
+        return os.path.join(TONE_GAMES_DIR, game.strip(), "ost_tone_presets_v2.json" if (mode or "").strip().lower()=="pro" else "ost_tone_presets.json")
+    return _tone_preset_file_for_mode(mode)
+
+TONE_PRESET_FILE = os.path.join(os.path.dirname(os.path.abspath(sys.argv[0])), "ost_tone_presets.json")
+
+TONE_PRESETS_DEFAULT = {
+    "ツンデレのナビゲーション": "ツンデレのナビゲーション",
+    "ミステリアスな女性のナビゲーション": "ミステリアスな女性のナビゲーション",
+    "臆病な女性のナビゲーション": "オドオドした感じの臆病な女性のナビゲーション。"
+}
+
+
+# --- 送信エンコード: 一番小さい表現を選ぶ ---
+# auto（既定）: 可逆のみ。パレットPNG（256 色以内のときだけ）と WebP 可逆のうち小さい方を送る
+#       （どちらも作れなければ PNG）。小さい文字の読み取りを落とさない。予算は見ない。
+# auto + OST_ENCODE_LOSSY=1: 可逆候補（PNG速/パレットPNG/WebP可逆）を安い順に試して予算に収まった時点で採用。
+#       写真的な背景（PNG速で 4bit/px 超）は可逆を打ち切り、高画質 JPEG（4:4:4）→ 縮小 JPEG で予算に収める
+#       （送信量/時間優先。細い文字の OCR 精度は下がり得る）。
+# png/webp/jpeg: 形式を固定（予算は無視）。base64 でさらに約 1.33 倍になる点に注意。
+OST_ENCODE            = os.environ.get("OST_ENCODE", "auto").strip().lower()
+OST_ENCODE_BUDGET     = max(16, int(float(os.environ.get("OST_ENCODE_BUDGET_KB", "256")) * 1024))  # 1枚あたり(バイト)。LOSSY 時のみ
+OST_ENCODE_LOSSY      = os.environ.get("OST_ENCODE_LOSSY", "0") == "1"  # auto で予算に収めるための JPEG/縮小を許す
+OST_JPEG_QUALITY_MIN  = max(50, min(95, int(os.environ.get("OST_JPEG_QUALITY_MIN", "80"))))
+_ENCODE_MIN_SCALE     = 0.7  # 予算のための縮小はここまで（これ以上は文字が潰れる）
+_ENCODE_PHOTO_BPP     = 4.0  # PNG速の bit/px がこれを超えたら可逆候補を打ち切る
+
+
+def _enc_png(im: Image.Image, level: int = 6) -> bytes:
+    buf = io.BytesIO(); im.save(buf, format="PNG", compress_level=level); return buf.getvalue()
+
+
+def _enc_palette(im: Image.Image, colors: int = 0) -> Optional[bytes]:
+    """RGB をパレット化した PNG。colors=0 は 256 色以内のときだけ（= 可逆）。L はそもそも 8bit なので対象外。"""
+    if im.mode != "RGB":
+        return None
+    if colors <= 0:
+        exact = im.getcolors(256)
+        if not exact:
+            return None
+        colors = len(exact)
+    return _enc_png(im.quantize(colors=colors, method=Image.Quantize.MEDIANCUT, dither=Image.Dither.NONE), 9)
+
+
+def _enc_webp_lossless(im: Image.Image) -> bytes:
+    # method=2: これ以上上げても数%しか縮まず時間だけ数倍になる（--bench encode 参照）
+    buf = io.BytesIO(); im.save(buf, format="WEBP", lossless=True, quality=40, method=2); return buf.getvalue()
+
+
+def _enc_jpeg(im: Image.Image, quality: int) -> bytes:
+    if im.mode not in ("L", "RGB"):
+        im = im.convert("RGB")
+    try:
+        buf = io.BytesIO(); im.save(buf, format="JPEG", quality=quality, subsampling=0, optimize=True); return buf.getvalue()
+    except OSError:
+        # optimize は出力を 1 画素 1 バイトのバッファに収める前提で、ノイズの多い画面だと溢れる
+        buf = io.BytesIO(); im.save(buf, format="JPEG", quality=quality, subsampling=0); return buf.getvalue()
+
+
+# (ラベル, MIME, エンコード関数)。auto はこの順（安い→高い）に試す
+_LOSSLESS_ENCODERS = (
+    ("png1",    "image/png",  lambda im: _enc_png(im, 1)),
+    ("palette", "image/png",  _enc_palette),
+    ("webp-ll", "image/webp", _enc_webp_lossless),
+)
+# 既定（可逆のみ）の候補。PNG はどの試料でも WebP 可逆より 1.5〜10 倍大きいので候補にしない（--bench encode）
+_SMALLEST_LOSSLESS = _LOSSLESS_ENCODERS[1:]
+
+
+def _encode_for_api(im: Image.Image, budget: int = OST_ENCODE_BUDGET, mode: str = OST_ENCODE,
+                    lossy: bool = OST_ENCODE_LOSSY) -> tuple:
+    """(データ, MIME, ラベル) を返す。lossy=False の auto は可逆で一番小さいもの"""
+    if im.mode not in ("L", "RGB"):
+        im = im.convert("RGB")
+    if mode == "png":
+        return _enc_png(im), "image/png", "png"
+    if mode == "webp":
+        return _enc_webp_lossless(im), "image/webp", "webp-ll"
+    if mode == "jpeg":
+        return _enc_jpeg(im, 92), "image/jpeg", "jpeg92"
+    if not lossy:
+        best = None
+        for label, mime, fn in _SMALLEST_LOSSLESS:
+            try:
+                data = fn(im)
+            except Exception as e:  # WebP 非対応の Pillow など
+                if DEBUG: print(f"[OST] encode {label} failed:", e)
+                data = None
+            if data is not None and (best is None or len(data) < len(best[0])):
+                best = (data, mime, label)
+        return best or (_enc_png(im), "image/png", "png")
+    best = None
+    for label, mime, fn in _LOSSLESS_ENCODERS:
+        data = fn(im)
+        if data is None:
+            continue
+        if best is None or len(data) < len(best[0]):
+            best = (data, mime, label)
+        if len(data) <= budget:
+            return data, mime, label
+        if label == "png1" and len(data) * 8.0 / (im.width * im.height) > _ENCODE_PHOTO_BPP:
+            break
+    for q in sorted({92, 85, OST_JPEG_QUALITY_MIN}, reverse=True):
+        data = _enc_jpeg(im, q)
+        if len(data) <= budget:
+            return data, "image/jpeg", f"jpeg{q}"
+        if len(data) < len(best[0]):
+            best = (data, "image/jpeg", f"jpeg{q}")
+    # 最後の手段: 予算比の平方根で縮小（下限 _ENCODE_MIN_SCALE）して JPEG
+    scale = max(_ENCODE_MIN_SCALE, (budget / float(len(best[0]))) ** 0.5 * 0.95)
+    small = im.resize((max(1, int(im.width * scale)), max(1, int(im.height * scale))), Image.LANCZOS)
+    data = _enc_jpeg(small, OST_JPEG_QUALITY_MIN)
+    return (data, "image/jpeg", f"jpeg{OST_JPEG_QUALITY_MIN}@{scale:.2f}") if len(data) < len(best[0]) else best
+
+
+# --- 画像処理のプロセスプール（任意）: 重い画像段を別プロセスで回し、UI スレッドと GIL を取り合わない ---
+# 画素は共有メモリで受け渡す（pickle しない）。画像の結果は同じ共有メモリに書き戻してもらう。
+OST_IMAGE_PROCS = max(0, int(os.environ.get("OST_IMAGE_PROCS", "0")))  # 0=従来どおりスレッド内で処理
+_PROC_MIN_PIXELS = 640 * 480  # これ未満は受け渡しの方が高くつくのでその場で処理
+_PROC_POOL = None
+_PROC_LOCK = threading.Lock()
+
+
+def _image_pool():
+    global _PROC_POOL
+    with _PROC_LOCK:
+        if _PROC_POOL is None:
+            import multiprocessing as mp
+            from concurrent.futures import ProcessPoolExecutor
+            # Windows と同じ spawn に揃える（fork だと Qt/スレッドの状態ごと複製される）
+            _PROC_POOL = ProcessPoolExecutor(max_workers=OST_IMAGE_PROCS, mp_context=mp.get_context("spawn"))
+        return _PROC_POOL
+
+
+def _shutdown_image_pool():
+    global _PROC_POOL
+    with _PROC_LOCK:
+        pool, _PROC_POOL = _PROC_POOL, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _proc_stage(shm_name: str, mode: str, size: tuple, nbytes: int, fn, args: tuple) -> tuple:
+    """子プロセス側：共有メモリの画素から画像を作って fn を適用する。
+    結果が画像なら同じ共有メモリへ書き戻して ("shm", mode, size, n)、入りきらなければ ("raw", mode, size, bytes)"""
+    from multiprocessing import shared_memory
+    shm = shared_memory.SharedMemory(name=shm_name)  # 解放（unlink）は作成側の親が行う
+    try:
+        mv = shm.buf[:nbytes]
+        try:
+            im = Image.frombytes(mode, size, mv)
+        finally:
+            mv.release()
+        out = fn(im, *args)
+        if not isinstance(out, Image.Image):
+            return ("obj", out)
+        data = out.tobytes()
+        if len(data) > shm.size:
+            return ("raw", out.mode, out.size, data)
+        shm.buf[:len(data)] = data
+        return ("shm", out.mode, out.size, len(data))
+    finally:
+        shm.close()
+
+
+def _offload(fn, im: Image.Image, *args):
+    """画像段 fn(im, *args)。OST_IMAGE_PROCS>0 かつ大きい画像なら子プロセスで実行する（fn はモジュールレベル関数）"""
+    global OST_IMAGE_PROCS
+    if OST_IMAGE_PROCS <= 0 or im.width * im.height < _PROC_MIN_PIXELS or im.mode not in ("L", "RGB", "RGBA"):
+        return fn(im, *args)
+    from multiprocessing import shared_memory
+    from concurrent.futures.process import BrokenProcessPool
+    data = im.tobytes(); n = len(data)
+    shm = shared_memory.SharedMemory(create=True, size=n)
+    try:
+        shm.buf[:n] = data; del data
+        try:
+            res = _image_pool().submit(_proc_stage, shm.name, im.mode, im.size, n, fn, args).result()
+        except BrokenProcessPool as e:
+            # 子プロセスが落ちた/起動できない環境ではスレッド処理に戻して続ける
+            if DEBUG: print("[OST] image pool unavailable; falling back to threads:", e)
+            OST_IMAGE_PROCS = 0; _shutdown_image_pool()
+            return fn(im, *args)
+        if res[0] == "obj":
+            return res[1]
+        if res[0] == "raw":
+            return Image.frombytes(res[1], res[2], res[3])
+        mv = shm.buf[:res[3]]
+        try:
+            return Image.frombytes(res[1], res[2], mv)
+        finally:
+            mv.release()
+    finally:
+        shm.close(); shm.unlink()
+
+
+def _resize_lanczos(im: Image.Image, size: tuple) -> Image.Image:
+    return im.resize(size, Image.LANCZOS)
+
+
+# --- 送信画像: キャプチャから送信まで PIL 画像のまま運び、エンコード/base64 は 1 ジョブ 1 回だけ作る ---
+class _ApiImage:
+    """PIL 画像 or PNG バイト列のどちらかを持ち、残りは要る時に一度だけ作って覚えておく。
+    リトライ/RECITATION 再送/キャッシュキー計算は同じインスタンスを共有する。"""
+    __slots__ = ("_im", "_png", "_enc", "_b64", "_hash", "_part")
+
+    def __init__(self, im: Optional[Image.Image] = None, png: Optional[bytes] = None):
+        if im is None and png is None:
+            raise ValueError("image or png is required")
+        self._im = im; self._png = png; self._enc = None
+        self._b64 = None; self._hash = None; self._part = None
+
+    @classmethod
+    def of(cls, x) -> Optional["_ApiImage"]:
+        if x is None or isinstance(x, cls):
+            return x
+        if isinstance(x, Image.Image):
+            return cls(im=x)
+        return cls(png=bytes(x))
+
+    @property
+    def image(self) -> Image.Image:
+        if self._im is None:
+            im = Image.open(io.BytesIO(self._png)); im.load()
+            self._im = im
+        return self._im
+
+    @property
+    def size(self) -> tuple:
+        return self.image.size
+
+    @property
+    def png(self) -> bytes:
+        if self._png is None:
+            buf = io.BytesIO(); self._im.save(buf, format="PNG")
+            self._png = buf.getvalue()
+        return self._png
+
+    @property
+    def encoded(self) -> tuple:
+        """送信用 (データ, MIME, ラベル)。形式はバイト予算で選ぶ（_encode_for_api）"""
+        if self._enc is None:
+            t0 = time.perf_counter()
+            self._enc = _offload(_encode_for_api, self.image)
+            if DEBUG:
+                print(f"[OST] encode {self.image.width}x{self.image.height} -> {self._enc[2]} "
+                      f"{len(self._enc[0]) // 1024}KB in {(time.perf_counter() - t0) * 1000:.0f}ms")
+        return self._enc
+
+    @property
+    def b64(self) -> str:
+        if self._b64 is None:
+            self._b64 = base64.b64encode(self.encoded[0]).decode("ascii")
+        return self._b64
+
+    def part(self) -> dict:
+        """Gemini の inline_data パート（同じ dict を再送でも使い回す）"""
+        if self._part is None:
+            self._part = {"inline_data": {"mime_type": self.encoded[1], "data": self.b64}}
+        return self._part
+
+    @property
+    def content_hash(self) -> str:
+        """画素列（mode/サイズ込み）の SHA-256。エンコード差に左右されない。"""
+        if self._hash is None:
+            im = self.image
+            h = hashlib.sha256()
+            h.update(f"{im.mode}:{im.width}x{im.height}:".encode("ascii"))
+            h.update(im.tobytes())
+            self._hash = h.hexdigest()
+        return self._hash
+
+
+# --- 翻訳キャッシュ（内容アドレス） ---
+# キー = 前処理後の画素ハッシュ + モデル/口調/話者/KEEP_SOURCE/プロンプト版。
+# メモリ LRU + sqlite（captures/ 配下）の2層。再起動後もディスク層から復元します。
+OST_CACHE     = os.environ.get("OST_CACHE", "1") == "1"
+OST_CACHE_MAX = max(1, int(os.environ.get("OST_CACHE_MAX", "512")))  # メモリLRUの上限件数
+OST_CACHE_DB  = os.environ.get("OST_CACHE_DB", os.path.join("captures", "ost_cache.sqlite3")).strip()  # 空=ディスク層なし
+OST_CACHE_DB_MAX   = max(1, int(os.environ.get("OST_CACHE_DB_MAX", "20000")))  # ディスク層の上限件数（古い順に削除）
+OST_CACHE_TTL_DAYS = float(os.environ.get("OST_CACHE_TTL_DAYS", "0"))          # これより古い行を削除(日)。0=期限なし
+_CACHE_PRUNE_EVERY = 256  # この件数書くごとに上限/期限を見直す（起動時にも 1 回）
+# プロンプト/スキーマを変えたら上げる（旧キャッシュを無効化するため）
+PROMPT_VERSION = "p1"
+# 近似一致（知覚ハッシュ）: カーソル点滅や 1px の枠ズレでも過去の訳を再利用する。
+# 1語だけ違う台詞も近い値になり得るため既定OFF（距離は小さめから試すこと）。
+OST_NEAR_DUP   = os.environ.get("OST_NEAR_DUP", "0") == "1"
+OST_PHASH_W    = max(8, int(os.environ.get("OST_PHASH_W", "64")))  # dHash の横セル数
+OST_PHASH_H    = max(4, int(os.environ.get("OST_PHASH_H", "16")))  # dHash の縦セル数
+OST_PHASH_DIST = max(0, int(os.environ.get("OST_PHASH_DIST", "6")))  # 許容ハミング距離(bit)
+
+
+def _image_content_hash(img) -> str:
+    """画素列（mode/サイズ込み）の SHA-256。img は PNG バイト列 / PIL 画像 / _ApiImage。"""
+    return _ApiImage.of(img).content_hash
+
+
+def _dhash_bits(img, w: int = OST_PHASH_W, h: int = OST_PHASH_H) -> bytes:
+    """差分ハッシュ（dHash）。(w+1)x h に縮小し、横隣との大小を一括比較してビット列に詰める。"""
+    im = _ApiImage.of(img).image.convert("L").resize((w + 1, h), Image.BOX)
+    a = np.asarray(im, dtype=np.int16)
+    # 平坦な背景のノイズでビットが揺れないよう 2 階調の不感帯を入れる
+    return np.packbits(a[:, 1:] > a[:, :-1] + 2).tobytes()
+
+
+class _PerceptualIndex:
+    """マルチインデックス・ハミング検索。ハッシュをビット交互に (max_dist+1) 分割すると、
+    距離 max_dist 以内の相手とは少なくとも 1 分割が完全一致する（鳩の巣原理）。
+    分割ごとの辞書で候補を引き、候補だけ popcount で確かめるので件数が増えても O(候補数)。"""
+    def __init__(self, max_dist: int = OST_PHASH_DIST):
+        self.max_dist = max(0, int(max_dist))
+        self._m = self.max_dist + 1
+        self._tables: Dict[str, List[Dict[bytes, List[str]]]] = {}  # ctx -> 分割ごとの {部分ビット: [key]}
+        self._vals: Dict[str, int] = {}
+        self._meta: Dict[str, tuple] = {}  # key -> (ctx, ビット列)。remove() 用
+
+    def __len__(self):
+        return len(self._vals)
+
+    def _chunks(self, bits: bytes) -> List[bytes]:
+        arr = np.unpackbits(np.frombuffer(bits, dtype=np.uint8))
+        return [np.packbits(arr[j::self._m]).tobytes() for j in range(self._m)]
+
+    def add(self, ctx: str, bits: bytes, key: str):
+        if key in self._vals: return
+        tabs = self._tables.setdefault(ctx, [dict() for _ in range(self._m)])
+        for tab, ch in zip(tabs, self._chunks(bits)):
+            tab.setdefault(ch, []).append(key)
+        self._vals[key] = int.from_bytes(bits, "big"); self._meta[key] = (ctx, bits)
+
+    def remove(self, key: str):
+        meta = self._meta.pop(key, None)
+        if meta is None: return
+        ctx, bits = meta
+        del self._vals[key]
+        tabs = self._tables[ctx]
+        for tab, ch in zip(tabs, self._chunks(bits)):
+            keys = tab.get(ch)
+            if keys is not None and key in keys:
+                keys.remove(key)
+                if not keys: del tab[ch]
+        if not any(tabs):
+            del self._tables[ctx]
+
+    def nearest(self, ctx: str, bits: bytes):
+        """距離 max_dist 以内で最も近い (key, dist) を返す。無ければ None"""
+        tabs = self._tables.get(ctx)
+        if not tabs: return None
+        v = int.from_bytes(bits, "big")
+        best = None
+        seen = set()
+        for tab, ch in zip(tabs, self._chunks(bits)):
+            for key in tab.get(ch, ()):
+                if key in seen: continue
+                seen.add(key)
+                d = (v ^ self._vals[key]).bit_count()
+                if d <= self.max_dist and (best is None or d < best[1]):
+                    best = (key, d)
+        return best
+
+
+def _is_cacheable_result(text: str) -> bool:
+    """空応答/停止理由などのエラー表示はキャッシュしない"""
+    t = (text or "").strip()
+    return bool(t) and not t.startswith(("(空応答", "(モデルが出力を停止"))
+
+
+class _TranslationCache:
+    """{source, ja} を保持する 2 層キャッシュ（メモリ LRU + sqlite）。
+    同一キーの同時リクエストは single-flight：先行 1 件だけが API を呼び、後続はその完了を待つ。"""
+    def __init__(self, max_items: int = OST_CACHE_MAX, db_path: str = OST_CACHE_DB):
+        self._lock = threading.Lock()
+        self._mem: "OrderedDict[str, dict]" = OrderedDict()
+        self._max = max(1, int(max_items))
+        self._db_path = db_path or ""
+        self._db = None
+        self._inflight: Dict[str, threading.Event] = {}
+        self._near = _PerceptualIndex(); self._near_loaded = False
+        self._puts = 0
+        self.hits = 0; self.misses = 0; self.near_hits = 0
+
+    def _conn(self):
+        # ロック保持中に呼ぶこと。失敗したらディスク層を無効化してメモリのみで続行
+        if self._db is None and self._db_path:
+            try:
+                d = os.path.dirname(self._db_path)
+                if d: os.makedirs(d, exist_ok=True)
+                self._db = sqlite3.connect(self._db_path, check_same_thread=False)
+                self._db.execute("CREATE TABLE IF NOT EXISTS tcache (key TEXT PRIMARY KEY, source TEXT, ja TEXT, ts REAL)")
+                self._db.execute("CREATE TABLE IF NOT EXISTS tnear (key TEXT PRIMARY KEY, ctx TEXT, phash BLOB)")
+                self._db.execute("CREATE INDEX IF NOT EXISTS tcache_ts ON tcache (ts)")
+                self._db.commit()
+                self._prune(self._db)
+            except Exception as e:
+                if DEBUG: print("[OST] cache db disabled:", e)
+                self._db = None; self._db_path = ""
+        return self._db
+
+    def _prune(self, db):
+        # ロック保持中に呼ぶこと。件数上限/期限を超えた古い行（ts = 最後に書いた/ディスクから読んだ時刻）を消し、
+        # 近似一致の索引からも外す。起動時の _load_near もこの件数までしか読まない
+        try:
+            drop = []
+            if OST_CACHE_TTL_DAYS > 0:
+                drop += [r[0] for r in db.execute("SELECT key FROM tcache WHERE ts < ?",
+                                                  (time.time() - OST_CACHE_TTL_DAYS * 86400,))]
+            drop += [r[0] for r in db.execute("SELECT key FROM tcache ORDER BY ts DESC LIMIT -1 OFFSET ?",
+                                              (OST_CACHE_DB_MAX,))]
+            drop = list(dict.fromkeys(drop))
+            if drop:
+                db.executemany("DELETE FROM tcache WHERE key=?", [(k,) for k in drop])
+                for k in drop:
+                    self._near.remove(k)
+            db.execute("DELETE FROM tnear WHERE key NOT IN (SELECT key FROM tcache)")
+            db.commit()
+            if DEBUG and drop: print(f"[OST] cache db pruned {len(drop)} rows")
+        except Exception as e:
+            if DEBUG: print("[OST] cache db prune failed:", e)
+
+    def _remember(self, key: str, val: dict):
+        self._mem[key] = val; self._mem.move_to_end(key)
+        while len(self._mem) > self._max:
+            old, _ = self._mem.popitem(last=False)
+            if not self._db_path:
+                self._near.remove(old)  # ディスク層が無ければ訳はもう引けないので、近似索引からも外す
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            val = self._mem.get(key)
+            if val is not None:
+                self._mem.move_to_end(key); self.hits += 1
+                return dict(val)
+            db = self._conn()
+            if db is not None:
+                try:
+                    row = db.execute("SELECT source, ja FROM tcache WHERE key=?", (key,)).fetchone()
+                except Exception:
+                    row = None
+                if row:
+                    val = {"source": row[0] or "", "ja": row[1] or ""}
+                    self._remember(key, val); self.hits += 1
+                    try:
+                        db.execute("UPDATE tcache SET ts=? WHERE key=?", (time.time(), key)); db.commit()  # 使われた行は残す
+                    except Exception:
+                        pass
+                    return dict(val)
+            self.misses += 1
+            return None
+
+    def put(self, key: str, source: str, ja: str, ctx: str = "", phash: Optional[bytes] = None):
+        val = {"source": source or "", "ja": ja or ""}
+        with self._lock:
+            self._remember(key, val)
+            if phash is not None:
+                self._load_near()
+                self._near.add(ctx, phash, key)
+            db = self._conn()
+            if db is not None:
+                try:
+                    db.execute("INSERT OR REPLACE INTO tcache (key, source, ja, ts) VALUES (?,?,?,?)",
+                               (key, val["source"], val["ja"], time.time()))
+                    if phash is not None:
+                        db.execute("INSERT OR REPLACE INTO tnear (key, ctx, phash) VALUES (?,?,?)",
+                                   (key, ctx, phash))
+                    db.commit()
+                except Exception as e:
+                    if DEBUG: print("[OST] cache db write failed:", e)
+                self._puts += 1
+                if self._puts % _CACHE_PRUNE_EVERY == 0:
+                    self._prune(db)
+
+    def _load_near(self):
+        # ロック保持中に呼ぶこと。ディスク層の知覚ハッシュを一度だけ索引へ読み込む
+        if self._near_loaded: return
+        self._near_loaded = True
+        db = self._conn()
+        if db is None: return
+        try:
+            for key, ctx, blob in db.execute("SELECT key, ctx, phash FROM tnear"):
+                self._near.add(ctx, bytes(blob), key)
+        except Exception as e:
+            if DEBUG: print("[OST] near index load failed:", e)
+
+    def get_near(self, ctx: str, phash: bytes) -> Optional[dict]:
+        """知覚ハッシュが OST_PHASH_DIST 以内の既訳を返す（同一コンテキスト内のみ）"""
+        with self._lock:
+            self._load_near()
+            found = self._near.nearest(ctx, phash)
+        if not found:
+            return None
+        val = self.get(found[0])
+        if val is not None:
+            with self._lock: self.near_hits += 1
+            if DEBUG: print(f"[OST] near-dup hit dist={found[1]} key={found[0][:12]}")
+        return val
+
+    def begin(self, key: str) -> Optional[threading.Event]:
+        """先行なら None（呼び出し側が API を叩き、最後に end()）。後続なら先行の完了イベントを返す"""
+        with self._lock:
+            ev = self._inflight.get(key)
+            if ev is not None:
+                return ev
+            self._inflight[key] = threading.Event()
+            return None
+
+    def end(self, key: str):
+        with self._lock:
+            ev = self._inflight.pop(key, None)
+        if ev is not None: ev.set()
+
+
+# --- HTTP: keep-alive セッション ---
+# --- 中断可能な HTTP: キャンセルされたら通信中のソケットを shutdown し、READ_TIMEOUT を待たずにワーカーを空ける ---
+_HTTP_LOCAL = threading.local()
+_INFLIGHT_LOCK = threading.Lock()
+_INFLIGHT: Dict[int, list] = {}  # id(キャンセルイベント) -> [_AbortScope, ...]
+_ABORT_STATS = {"aborted": 0, "saved_s": 0.0, "unblock_ms": 0.0}  # 中断した件数 / READ_TIMEOUT までの残り合計 / 中断→復帰の合計
+
+
+class _AbortScope:
+    """キャンセルイベント 1 つに紐づく HTTP 呼び出し。使ったソケットを覚えておき、abort() で読み書きを打ち切る"""
+    __slots__ = ("evt", "socks", "t0", "t_abort", "_lock")
+
+    def __init__(self, evt: threading.Event):
+        self.evt = evt; self.socks = set(); self._lock = threading.Lock()
+        self.t0 = time.monotonic(); self.t_abort = None
+
+    def register(self, sock):
+        with self._lock:
+            self.socks.add(sock)
+        if self.evt.is_set():
+            self.abort()  # 接続の直前に取り消された
+
+    def abort(self) -> bool:
+        with self._lock:
+            socks = list(self.socks)
+            if self.t_abort is not None or not socks:
+                return False
+            self.t_abort = time.monotonic()
+        for sock in socks:
+            try:
+                # SSLSocket.shutdown は TLS 状態を触るので、下の TCP ソケットだけを止める（別スレッドの recv が即戻る）
+                socket.socket.shutdown(sock, socket.SHUT_RDWR)
+            except OSError:
+                pass
+        return True
+
+
+def _abort_requests(evt: threading.Event) -> int:
+    """evt に紐づく通信中の HTTP をすべて打ち切る。戻り値は中断した呼び出し数"""
+    with _INFLIGHT_LOCK:
+        scopes = list(_INFLIGHT.get(id(evt), ()))
+    return sum(1 for sc in scopes if sc.abort())
+
+
+def _abort_stats_line() -> str:
+    with _INFLIGHT_LOCK:
+        n, saved, unblock = _ABORT_STATS["aborted"], _ABORT_STATS["saved_s"], _ABORT_STATS["unblock_ms"]
+    return (f"aborted={n} read-timeout-saved<={saved:.0f}s avg-freed-in={unblock / n:.0f}ms" if n
+            else "aborted=0")
+
+
+def _register_socket(sock):
+    if sock is None:
+        return
+    for scope in getattr(_HTTP_LOCAL, "scopes", ()):  # 入れ子（ジョブ全体 + ヘッジの 1 本）なら両方から切れるように
+        scope.register(sock)
+
+
+# --- 実測レイテンシ: (モデル, 送信サイズ帯) ごとの直近の所要時間からヘッジの発火点とタイムアウトを決める ---
+_LAT_WINDOW = 64       # 区分ごとに覚える件数
+_LAT_MIN_SAMPLES = 8   # これ未満の区分は静的な既定値を使う
+
+
+class _LatencyModel:
+    def __init__(self, window: int = _LAT_WINDOW):
+        self._lock = threading.Lock()
+        self._lat: Dict[tuple, deque] = {}
+        self._connect = deque(maxlen=window)
+        self._window = window
+        self.hedged = 0; self.hedge_wins = 0
+
+    @staticmethod
+    def key(body_len: int, model: str = API_MODEL) -> tuple:
+        # 送信サイズは 4 倍刻みの帯（<1KB, <4KB, <16KB, ...）。画像の大きさで応答時間が変わるため
+        return model, min(8, (body_len >> 10).bit_length() // 2)
+
+    def add(self, key: tuple, seconds: float):
+        with self._lock:
+            self._lat.setdefault(key, deque(maxlen=self._window)).append(seconds)
+
+    def add_connect(self, seconds: float):
+        with self._lock:
+            self._connect.append(seconds)
+
+    @staticmethod
+    def _pct(samples, p: float) -> Optional[float]:
+        if len(samples) < _LAT_MIN_SAMPLES:
+            return None
+        xs = sorted(samples)
+        return xs[min(len(xs) - 1, int(len(xs) * p / 100.0))]
+
+    def percentile(self, key: tuple, p: float) -> Optional[float]:
+        with self._lock:
+            return self._pct(list(self._lat.get(key, ())), p)
+
+    def hedge_delay(self, key: tuple) -> Optional[float]:
+        """2 本目を投げるまでの秒数（ヘッジしない/実測が足りないなら None）"""
+        if OST_HEDGE_PCT <= 0:
+            return None
+        q = self.percentile(key, OST_HEDGE_PCT)
+        return None if q is None else max(OST_HEDGE_MIN_S, q)
+
+    def read_timeout(self, key: tuple) -> float:
+        # 非ストリームの Gemini は完了まで何も送ってこないので、読み取り待ち≒全体の所要時間
+        q = self.percentile(key, 99)
+        return READ_TIMEOUT if q is None else min(READ_TIMEOUT, max(OST_HTTP_READ_TIMEOUT_MIN, q * 4))
+
+    def connect_timeout(self) -> float:
+        with self._lock:
+            q = self._pct(list(self._connect), 99)
+        return CONNECT_TIMEOUT if q is None else min(CONNECT_TIMEOUT, max(2.0, q * 4))
+
+    def timeouts(self, key: tuple) -> tuple:
+        return self.connect_timeout(), self.read_timeout(key)
+
+
+_LATENCY = _LatencyModel()
+
+
+# --- クォータ: RPM/TPM のトークンバケット、429 の Retry-After、連続失敗でのサーキットブレーカー ---
+class _HttpStatusError(RuntimeError):
+    """API の 4xx/5xx。メッセージは従来どおり "HTTP {code}: 本文" """
+    def __init__(self, status: int, text: str = "", retry_after: Optional[float] = None):
+        super().__init__(f"HTTP {status}: {text[:800]}")
+        self.status = status; self.retry_after = retry_after
+
+    @classmethod
+    def from_response(cls, resp) -> "_HttpStatusError":
+        return cls(resp.status_code, resp.text, _retry_after_seconds(resp))
+
+
+class _CircuitOpenError(RuntimeError):
+    pass
+
+
+def _retry_after_seconds(resp) -> Optional[float]:
+    """Retry-After（秒数 or HTTP 日付）→ なければ本文の google.rpc.RetryInfo.retryDelay（"27s"）"""
+    h = (resp.headers.get("Retry-After") or "").strip()
+    if h:
+        try:
+            return max(0.0, float(h))
+        except ValueError:
+            try:
+                from email.utils import parsedate_to_datetime
+                import datetime
+                return max(0.0, (parsedate_to_datetime(h) - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+            except Exception:
+                pass
+    try:
+        for d in (resp.json().get("error") or {}).get("details") or []:
+            if str(d.get("@type", "")).endswith("RetryInfo") and str(d.get("retryDelay", "")).endswith("s"):
+                return max(0.0, float(d["retryDelay"][:-1]))
+    except Exception:
+        pass
+    return None
+
+
+def _backoff_delay(attempt: int) -> float:
+    # full jitter: 0〜min(上限, 初期値×2^n) の一様乱数（同時に失敗したワーカーが揃って再送しない）
+    return random.uniform(0, min(OST_BACKOFF_MAX, OST_BACKOFF_BASE * (2 ** attempt)))
+
+
+def _image_tokens(size: tuple) -> int:
+    # Gemini の画像トークン: 両辺 384px 以下は 258、それより大きければ 768px 角のタイルごとに 258
+    w, h = size
+    if w <= 384 and h <= 384:
+        return 258
+    return 258 * (-(-w // 768)) * (-(-h // 768))
+
+
+_PROMPT_TOKENS_EST = 700  # 指示文 + 出力の見込み（応答の usageMetadata で後から精算する）
+
+
+class _TokenBucket:
+    """period 秒あたり limit の枠。一度に使えるのは burst 割合まで、残りは一定速度で補充するので、
+    どの period 秒を切り取っても limit を超えない（サーバ側の集計が固定窓/移動窓のどちらでも安全）"""
+    def __init__(self, limit: float, period: float = 60.0, burst: float = 0.1):
+        self.cap = max(1.0, limit * burst)
+        self.rate = max(limit - self.cap, 1e-9) / period
+        self.level = self.cap; self.t = time.monotonic()
+
+    def _refill(self, now: float):
+        self.level = min(self.cap, self.level + (now - self.t) * self.rate); self.t = now
+
+    def wait_time(self, n: float, now: float) -> float:
+        self._refill(now)
+        n = min(n, self.cap)  # 1 件で枠を超える大物は、満杯になった時点で通す
+        return 0.0 if self.level >= n else (n - self.level) / self.rate
+
+    def take(self, n: float):
+        self.level -= n  # 大物や精算で負になりうる（その分だけ次が待つ）
+
+
+class _RateLimiter:
+    def __init__(self, rpm: int = OST_RPM, tpm: int = OST_TPM, period: float = 60.0,
+                 fails: int = OST_BREAKER_FAILS, cooldown: float = OST_BREAKER_COOLDOWN):
+        self._cv = threading.Condition()
+        self._rpm = _TokenBucket(rpm, period) if rpm > 0 else None
+        self._tpm = _TokenBucket(tpm, period) if tpm > 0 else None
+        self._fails_max = fails; self._cooldown = cooldown
+        self._paused_until = 0.0   # 429 の Retry-After（全ワーカー共通で待つ）
+        self._n429 = 0             # 連続した 429（Retry-After が無いときの待ち時間に使う）
+        self._fails = 0            # 連続失敗（5xx/通信エラー）
+        self._open_until = 0.0     # ブレーカーが開いている期限（0=閉）
+        self._probing = False      # 半開：試しの 1 本が飛んでいる
+        self.stats = {"sent": 0, "waited_s": 0.0, "http429": 0, "tripped": 0, "rejected": 0}
+
+    def _wait_time(self, tokens: float, now: float) -> float:
+        w = self._paused_until - now
+        if self._rpm is not None: w = max(w, self._rpm.wait_time(1, now))
+        if self._tpm is not None: w = max(w, self._tpm.wait_time(tokens, now))
+        return w
+
+    def acquire(self, tokens: float, cancel_evt: Optional[threading.Event] = None):
+        """RPM/TPM の枠が空くまで待って確保する（キャンセルで中断）。ブレーカーが開いていれば待たずに失敗"""
+        t0 = time.monotonic()
+        with self._cv:
+            while True:
+                if cancel_evt is not None and cancel_evt.is_set():
+                    raise RuntimeError("canceled")
+                now = time.monotonic()
+                if self._open_until:
+                    if now < self._open_until:
+                        self.stats["rejected"] += 1
+                        raise _CircuitOpenError(f"API の失敗が続いたため送信を停止中（あと {self._open_until - now:.0f} 秒）")
+                    if self._probing:
+                        self._cv.wait(0.1); continue  # 試しの 1 本の結果待ち
+                w = self._wait_time(tokens, now)
+                if w <= 0:
+                    break
+                self._cv.wait(min(w, 0.1))
+            if self._open_until:
+                self._probing = True
+            if self._rpm is not None: self._rpm.take(1)
+            if self._tpm is not None: self._tpm.take(tokens)
+            self.stats["sent"] += 1; self.stats["waited_s"] += time.monotonic() - t0
+
+    def ready_in(self, tokens: float, now: float) -> tuple:
+        """(あと何秒で送れるか, ブレーカーが開いているか)"""
+        with self._cv:
+            if self._open_until:
+                if now < self._open_until:
+                    return self._open_until - now, True
+                if self._probing:
+                    return 0.1, False
+            return self._wait_time(tokens, now), False
+
+    def try_acquire(self, tokens: float) -> bool:
+        """待たずに取れるときだけ確保する（キープールの振り分けと、ヘッジの 2 本目用）"""
+        with self._cv:
+            now = time.monotonic()
+            if self._open_until and (now < self._open_until or self._probing):
+                return False
+            if self._wait_time(tokens, now) > 0:
+                return False
+            if self._open_until:
+                self._probing = True
+            if self._rpm is not None: self._rpm.take(1)
+            if self._tpm is not None: self._tpm.take(tokens)
+            self.stats["sent"] += 1
+            return True
+
+    def succeeded(self, est_tokens: float, used_tokens: Optional[int] = None):
+        with self._cv:
+            if used_tokens and self._tpm is not None:
+                self._tpm.take(used_tokens - est_tokens)  # 見込みとの差を精算
+            self._fails = 0; self._n429 = 0
+            if self._open_until:
+                if DEBUG: print("[OST] circuit closed")
+                self._open_until = 0.0; self._probing = False
+            self._cv.notify_all()
+
+    def failed(self, status: Optional[int] = None, retry_after: Optional[float] = None):
+        """status=None は通信エラー。429 は全体を Retry-After まで止める（ブレーカーには数えない）"""
+        with self._cv:
+            now = time.monotonic()
+            if status == 429:
+                self._n429 += 1; self.stats["http429"] += 1
+                pause = retry_after if retry_after is not None else min(OST_BACKOFF_MAX, OST_BACKOFF_BASE * 2 ** self._n429)
+                self._paused_until = max(self._paused_until, now + pause)
+                if DEBUG: print(f"[OST] 429: holding all requests for {pause:.1f}s")
+                if self._probing:
+                    self._probing = False
+            else:
+                self._fails += 1
+                if self._probing or (not self._open_until and self._fails >= self._fails_max):
+                    self._open_until = now + self._cooldown; self._probing = False; self.stats["tripped"] += 1
+                    if DEBUG: print(f"[OST] circuit open for {self._cooldown:.0f}s after {self._fails} failures")
+            self._cv.notify_all()
+
+    def release_probe(self):
+        """半開の試し 1 本が成否不明のまま終わった（取り消し等）"""
+        with self._cv:
+            if self._probing:
+                self._probing = False; self._cv.notify_all()
+
+    def stats_line(self) -> str:
+        with self._cv:
+            st = dict(self.stats)
+        return (f"sent={st['sent']} throttled={st['waited_s']:.1f}s 429={st['http429']} "
+                f"breaker-trips={st['tripped']} rejected={st['rejected']}")
+
+
+class _ApiKey:
+    __slots__ = ("key", "limiter", "inflight", "cool_until", "usage")
+
+    def __init__(self, key: str, limiter: _RateLimiter):
+        self.key = key; self.limiter = limiter; self.inflight = 0; self.cool_until = 0.0
+        self.usage = {"requests": 0, "ok": 0, "tokens": 0, "http429": 0, "http403": 0, "errors": 0, "hedged": 0}
+
+    @property
+    def label(self) -> str:
+        return "…" + self.key[-4:]  # ログにキー全体は出さない
+
+
+class _KeyPool:
+    """API キーの束。送信ごとに枠の空いているキーを選ぶ（least: 実行中の少ない順 / rr: 順番）。
+    429 はそのキーだけ Retry-After まで、403 は OST_KEY_COOLDOWN 秒外す（全キーが外れていたら構わず使う）。
+    ※ Gemini のクォータはプロジェクト単位なので、別プロジェクトのキーを束ねたときだけ上限が増える"""
+    def __init__(self, keys: List[str], rpm: int = OST_RPM, tpm: int = OST_TPM, period: float = 60.0,
+                 policy: str = OST_KEY_POLICY):
+        uniq = list(dict.fromkeys(k.strip() for k in keys if k and k.strip()))
+        self._keys = [_ApiKey(k, _RateLimiter(rpm, tpm, period)) for k in uniq]
+        self._policy = policy; self._rr = 0
+        self._cv = threading.Condition()
+
+    @classmethod
+    def from_env(cls, **kw) -> "_KeyPool":
+        keys = re.split(r"[,\s]+", os.environ.get("GEMINI_API_KEYS", ""))
+        keys += [os.environ.get("GEMINI_API_KEY") or "", os.environ.get("GOOGLE_API_KEY") or ""]
+        return cls(keys, **kw)
+
+    def __len__(self):
+        return len(self._keys)
+
+    @property
+    def primary(self) -> Optional[str]:
+        return self._keys[0].key if self._keys else None
+
+    def acquire(self, tokens: float, cancel_evt: Optional[threading.Event] = None) -> _ApiKey:
+        """送れるキーが出るまで待って 1 本確保する（キャンセルで中断）。全キーのブレーカーが開いていれば待たずに失敗"""
+        if not self._keys:
+            raise RuntimeError("APIキー未設定")
+        t0 = time.monotonic()
+        with self._cv:
+            while True:
+                if cancel_evt is not None and cancel_evt.is_set():
+                    raise RuntimeError("canceled")
+                now = time.monotonic()
+                n = len(self._keys)
+                order = [self._keys[(self._rr + i) % n] for i in range(n)]
+                usable = [k for k in order if k.cool_until <= now] or order
+                ready, soonest, all_open = [], None, True
+                for k in usable:
+                    w, is_open = k.limiter.ready_in(tokens, now)
+                    all_open = all_open and is_open
+                    if w <= 0:
+                        ready.append(k)
+                    elif soonest is None or w < soonest:
+                        soonest = w
+                if all_open:
+                    for k in usable: k.limiter.stats["rejected"] += 1
+                    raise _CircuitOpenError(f"API の失敗が続いたため送信を停止中（あと {soonest:.0f} 秒）")
+                if self._policy != "rr":
+                    ready.sort(key=lambda k: k.inflight)  # 安定ソートなので同数なら順番どおり
+                for k in ready:
+                    if k.limiter.try_acquire(tokens):
+                        with k.limiter._cv:
+                            k.limiter.stats["waited_s"] += time.monotonic() - t0
+                        k.inflight += 1
+                        self._rr = (self._keys.index(k) + 1) % n
+                        return k
+                self._cv.wait(min(soonest or 0.1, 0.1))
+
+    def done(self, k: _ApiKey, est_tokens: float, status: Optional[int] = 200, retry_after: Optional[float] = None,
+             used_tokens: Optional[int] = None, canceled: bool = False):
+        """送信結果の報告。status=None は通信エラー"""
+        with self._cv:
+            k.inflight -= 1
+            u = k.usage
+            if canceled:
+                k.limiter.release_probe()
+            elif status is None or status == 429 or status >= 500:
+                u["requests"] += 1; u["http429" if status == 429 else "errors"] += 1
+                k.limiter.failed(status, retry_after)
+            elif status == 403:
+                # キーの無効化/権限不足。しばらく他のキーに回す
+                u["requests"] += 1; u["http403"] += 1
+                k.cool_until = time.monotonic() + OST_KEY_COOLDOWN
+                k.limiter.succeeded(est_tokens)
+                if DEBUG and len(self._keys) > 1: print(f"[OST] key {k.label}: 403; cooling down {OST_KEY_COOLDOWN:.0f}s")
+            else:
+                u["requests"] += 1
+                if status < 400:
+                    u["ok"] += 1; u["tokens"] += used_tokens or int(est_tokens)
+                k.limiter.succeeded(est_tokens, used_tokens if status < 400 else None)
+            self._cv.notify_all()
+
+    def admit_hedge(self, k: _ApiKey, est_tokens: float) -> bool:
+        """ヘッジの 2 本目を同じキーの枠で通すか。通したら 1 リクエストとして数える（2 本目も課金される前提で
+        見込みトークンも計上）。終わったら hedge_done() で実行中から外す"""
+        with self._cv:
+            if not k.limiter.try_acquire(est_tokens):
+                return False
+            k.inflight += 1
+            u = k.usage; u["requests"] += 1; u["hedged"] += 1; u["tokens"] += int(est_tokens)
+            return True
+
+    def hedge_done(self, k: _ApiKey):
+        with self._cv:
+            k.inflight -= 1
+            self._cv.notify_all()
+
+    def stats_line(self) -> str:
+        with self._cv:
+            return " | ".join(
+                f"{k.label}: req={u['requests']} ok={u['ok']} tok={u['tokens']} hedged={u['hedged']} "
+                f"429={u['http429']} 403={u['http403']} "
+                f"err={u['errors']} ({k.limiter.stats_line()})" for k in self._keys for u in (dict(k.usage),)) or "no keys"
+
+
+def _abortable_pool_classes() -> dict:
+    """接続のたび/送信のたびにソケットを現在のスコープへ登録する urllib3 のプール"""
+    from urllib3.connection import HTTPConnection, HTTPSConnection
+    from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+    class _Mixin:
+        def connect(self):
+            t0 = time.monotonic()
+            super().connect()
+            _LATENCY.add_connect(time.monotonic() - t0)  # TCP+TLS の確立時間（接続タイムアウトの実測値）
+            _register_socket(self.sock)
+
+        def request(self, *a, **kw):
+            _register_socket(getattr(self, "sock", None))  # keep-alive で使い回す接続
+            return super().request(*a, **kw)
+
+    class _Conn(_Mixin, HTTPConnection): pass
+    class _TlsConn(_Mixin, HTTPSConnection): pass
+    class _Pool(HTTPConnectionPool): ConnectionCls = _Conn
+    class _TlsPool(HTTPSConnectionPool): ConnectionCls = _TlsConn
+    return {"http": _Pool, "https": _TlsPool}
+
+
+class _HttpPool:
+    """API 用の keep-alive セッション（接続プール）。requests.post の都度ハンドシェイクをやめ、
+    起動時とアイドル明けに HEAD で接続を張っておくことで初回バイトまでの待ちを減らす。"""
+    def __init__(self, host: str = API_HOST, pool_size: int = OST_HTTP_POOL):
+        from requests.adapters import HTTPAdapter
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=max(1, pool_size), max_retries=0)
+        adapter.poolmanager.pool_classes_by_scheme = _abortable_pool_classes()
+        self.session.mount("https://", adapter); self.session.mount("http://", adapter)
+        self._host = host.rstrip("/")
+        self._last_used = time.monotonic()
+        self._last_warm = 0.0
+        self._stop = threading.Event()
+        self._keeper: Optional[threading.Thread] = None
+
+    def post(self, url: str, **kw):
+        self._last_used = time.monotonic()
+        try:
+            return self.session.post(url, **kw)
+        finally:
+            self._last_used = time.monotonic()
+
+    @staticmethod
+    @contextlib.contextmanager
+    def abortable(evt: Optional[threading.Event]):
+        """with 内でこのスレッドが使う接続を evt に紐づける（_abort_requests(evt) で即中断）。
+        ストリーミングは本文を読み終えるまで with の中に置くこと"""
+        if evt is None:
+            yield; return
+        scope = _AbortScope(evt); prev = getattr(_HTTP_LOCAL, "scopes", ())
+        with _INFLIGHT_LOCK:
+            _INFLIGHT.setdefault(id(evt), []).append(scope)
+        _HTTP_LOCAL.scopes = prev + (scope,)
+        try:
+            yield
+        finally:
+            _HTTP_LOCAL.scopes = prev
+            with _INFLIGHT_LOCK:
+                lst = _INFLIGHT.get(id(evt), [])
+                if scope in lst: lst.remove(scope)
+                if not lst: _INFLIGHT.pop(id(evt), None)
+            if scope.t_abort is not None:
+                now = time.monotonic()
+                saved = max(0.0, READ_TIMEOUT - (scope.t_abort - scope.t0))
+                unblock = (now - scope.t_abort) * 1000
+                with _INFLIGHT_LOCK:
+                    _ABORT_STATS["aborted"] += 1; _ABORT_STATS["saved_s"] += saved; _ABORT_STATS["unblock_ms"] += unblock
+                if DEBUG:
+                    print(f"[OST] request aborted after {scope.t_abort - scope.t0:.2f}s "
+                          f"(worker freed in {unblock:.0f}ms; up to {saved:.0f}s of read timeout saved)")
+
+    def post_hedged(self, url: str, body: bytes, headers: dict, cancel_evt: Optional[threading.Event] = None,
+                    latency: Optional[_LatencyModel] = None, admit: Optional[Callable[[], bool]] = None,
+                    hedge_done: Optional[Callable[[], None]] = None):
+        """非ストリームの POST。実測の OST_HEDGE_PCT 百分位を過ぎても返らなければ同じ内容をもう 1 本投げ、
+        先に返った成功応答（5xx 以外）を採って残りは打ち切る。タイムアウトは実測から決める。
+        admit が False を返したら 2 本目は投げない（クォータに余裕がないとき）。
+        hedge_done は admit で通した 2 本目が（勝ち負け/打ち切りに関係なく）終わったときに 1 回呼ばれる"""
+        lat = _LATENCY if latency is None else latency
+        key = lat.key(len(body)); timeout = lat.timeouts(key)
+        delay = lat.hedge_delay(key)
+
+        def once(evt: Optional[threading.Event]):
+            t0 = time.monotonic()
+            with self.abortable(evt):
+                resp = self.post(url, headers=headers, data=body, timeout=timeout)
+            if resp.status_code < 400:
+                lat.add(key, time.monotonic() - t0)
+            return resp
+
+        if delay is None:
+            with self.abortable(cancel_evt):
+                return once(None)
+
+        import queue
+        results = queue.Queue()
+        attempts = []  # [(キャンセルイベント, 開始時刻)]
+
+        def launch():
+            evt = threading.Event(); n = len(attempts); attempts.append((evt, time.monotonic()))
+            def run():
+                try:
+                    with self.abortable(cancel_evt):
+                        results.put((n, once(evt), None))
+                except Exception as e:
+                    results.put((n, None, e))
+                finally:
+                    if n > 0 and hedge_done is not None:
+                        hedge_done()
+            threading.Thread(target=run, name=f"ost-hedge{n}", daemon=True).start()
+
+        launch()
+        hedge_at = attempts[0][1] + delay
+        pending = 1; last_err = None; last_resp = None
+        while pending:
+            wait = max(0.0, hedge_at - time.monotonic()) if hedge_at is not None else None
+            try:
+                n, resp, err = results.get(timeout=wait)
+            except queue.Empty:
+                hedge_at = None
+                if cancel_evt is not None and cancel_evt.is_set():
+                    continue  # 取り消し済み：1 本目の打ち切りを待つだけ
+                if admit is not None and not admit():
+                    if DEBUG: print("[OST] hedge: skipped (no quota headroom)")
+                    continue
+                launch(); pending += 1
+                with lat._lock: lat.hedged += 1
+                if DEBUG: print(f"[OST] hedge: no reply after {delay:.1f}s (p{OST_HEDGE_PCT:g}); sent a 2nd request")
+                continue
+            pending -= 1
+            if err is None and resp.status_code < 500:
+                for i, (evt, t0) in enumerate(attempts):
+                    if i != n and not evt.is_set():
+                        # 負けた方は打ち切る。所要時間は「少なくともここまで」として記録し、裾の重さを忘れない
+                        evt.set(); _abort_requests(evt); lat.add(key, time.monotonic() - t0)
+                if n > 0:
+                    with lat._lock: lat.hedge_wins += 1
+                    if DEBUG: print(f"[OST] hedge: 2nd request won ({time.monotonic() - attempts[0][1]:.1f}s total)")
+                return resp
+            last_err, last_resp = err, resp
+            if len(attempts) == 1:
+                break  # 1 本目が先に失敗：ヘッジせずにそのまま返す（再試行は呼び出し側）
+        if last_resp is not None:
+            return last_resp
+        raise last_err
+
+    def warm(self, conns: int = OST_HTTP_PREWARM):
+        """conns 本の接続を並行して確立し、プールに戻しておく（応答の中身は見ない）"""
+        def _one():
+            try:
+                self.session.head(self._host + "/", timeout=(CONNECT_TIMEOUT, 10)).close()
+            except Exception as e:
+                if DEBUG: print("[OST] prewarm failed:", e)
+        ts = [threading.Thread(target=_one, daemon=True) for _ in range(max(0, conns))]
+        for t in ts: t.start()
+        for t in ts: t.join()
+        self._last_warm = time.monotonic()
+        if DEBUG and ts: print(f"[OST] prewarmed {len(ts)} connection(s) to {self._host}")
+
+    def start(self):
+        """起動直後の事前接続と、アイドル明けの張り直しをバックグラウンドで行う"""
+        if OST_HTTP_PREWARM <= 0 or self._keeper is not None:
+            return
+        def loop():
+            self.warm()
+            while not self._stop.wait(max(5.0, OST_HTTP_IDLE_REWARM / 3)):
+                now = time.monotonic()
+                idle = now - max(self._last_used, self._last_warm)
+                if OST_HTTP_IDLE_REWARM > 0 and idle >= OST_HTTP_IDLE_REWARM and (now - self._last_used) < OST_HTTP_WARM_MAX_IDLE:
+                    self.warm()
+        self._keeper = threading.Thread(target=loop, daemon=True); self._keeper.start()
+
+    def close(self):
+        self._stop.set()
+        try: self.session.close()
+        except Exception: pass
+
+
+# --- ストリーミング: 途中まで届いた JSON から文字列値を取り出す ---
+_JSON_ESC = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+
+class _PartialJsonField:
+    """{"source":"…","ja":"…"} が分割されて届く途中でも、指定キーの文字列値を「届いた所まで」返す。
+    エスケープ途中（\\u12 など）で切れている場合はその手前までを返す。"""
+    def __init__(self, key: str = "ja"):
+        self.key = key
+        self.buf = ""
+
+    def feed(self, chunk: str) -> Optional[str]:
+        self.buf += chunk or ""
+        try:
+            return self.value()
+        except ValueError:
+            return None  # 壊れた \\u エスケープ等。最終結果は通常のパーサに任せる
+
+    @staticmethod
+    def _read_string(s: str, i: int):
+        """開きクォートの次（s[i]）から文字列を読む。戻り値 (値, 閉じクォートの次の位置 or None=未完)"""
+        out = []; n = len(s)
+        while i < n:
+            c = s[i]
+            if c == '"':
+                return "".join(out), i + 1
+            if c != "\\":
+                out.append(c); i += 1; continue
+            if i + 1 >= n:
+                break
+            e = s[i + 1]
+            if e == "u":
+                hx = s[i + 2:i + 6]
+                if len(hx) < 4:
+                    break
+                cp = int(hx, 16)
+                if 0xD800 <= cp < 0xDC00:
+                    # サロゲートペアは後半が届くまで待つ
+                    if len(s) < i + 12:
+                        break
+                    if s[i + 6:i + 8] == "\\u":
+                        lo = int(s[i + 8:i + 12], 16)
+                        out.append(chr(0x10000 + ((cp - 0xD800) << 10) + (lo - 0xDC00))); i += 12; continue
+                out.append(chr(cp)); i += 6; continue
+            out.append(_JSON_ESC.get(e, e)); i += 2
+        return "".join(out), None
+
+    def value(self) -> Optional[str]:
+        s = self.buf
+        i = s.find("{")
+        if i < 0:
+            return None
+        i += 1; n = len(s)
+        while i < n:
+            while i < n and s[i] in " \t\r\n,":
+                i += 1
+            if i >= n or s[i] != '"':
+                return None
+            key, i = self._read_string(s, i + 1)
+            if i is None:
+                return None
+            while i < n and s[i] in " \t\r\n:":
+                i += 1
+            if i >= n:
+                return None
+            if s[i] != '"':
+                return None  # 文字列以外の値は想定外（スキーマ上出ない）
+            val, j = self._read_string(s, i + 1)
+            if key == self.key:
+                return val
+            if j is None:
+                return None
+            i = j
+        return None
+
+
+# --- 連結（Alt+A / 複数画像）: 追記専用キャンバス ---
+_STITCH_COLS     = 64    # 行ハッシュの横セル数
+_STITCH_MIN_BITS = 4     # これ未満しかビットが立たない行（空白/罫線）は投票に使わない
+_STITCH_AGREE    = 0.95  # 重なり部分の行ハッシュのビット一致率がこれ以上なら同じ内容とみなす
+_STITCH_MIN_NEW  = 6     # 重なりを除いて残る行がこれ未満なら「ほぼ同一」として捨てる
+
+
+def _row_bits(im: Image.Image) -> np.ndarray:
+    """行ごとの dHash（H x 64 bool）。横に 65 セルへ平均して隣同士の大小を取るので、
+    前処理のコントラスト LUT がフレームごとに少し違っても（単調変換なので）ほぼ同じビットになる。"""
+    g = im if im.mode == "L" else im.convert("L")
+    a = np.asarray(g.resize((_STITCH_COLS + 1, g.height), Image.BOX), dtype=np.int16)
+    return a[:, 1:] > a[:, :-1] + 2
+
+
+def _scroll_offset(prev: np.ndarray, new: np.ndarray) -> Optional[int]:
+    """new の先頭が prev の何行目から続いているか（下方向スクロール量 d）。見つからなければ None。
+    行ハッシュが一致する行の組 (i, j) ごとに d = i - j へ投票し、票の多い候補を重なり全体のビット一致率で確かめる。"""
+    hp, hn = prev.shape[0], new.shape[0]
+    keys = np.packbits(prev, axis=1)
+    table = {}
+    for i in np.flatnonzero(prev.sum(axis=1) >= _STITCH_MIN_BITS):
+        table.setdefault(keys[i].tobytes(), []).append(int(i))
+    if not table:
+        return None
+    votes = {}
+    nkeys = np.packbits(new, axis=1)
+    for j in np.flatnonzero(new.sum(axis=1) >= _STITCH_MIN_BITS):
+        for i in table.get(nkeys[j].tobytes(), ()):
+            if i >= j:
+                votes[i - j] = votes.get(i - j, 0) + 1
+    best = None
+    for d, n in sorted(votes.items(), key=lambda kv: (-kv[1], kv[0]))[:4]:
+        rows = min(hp - d, hn)
+        if n < max(3, rows // 8):
+            continue
+        agree = 1.0 - np.count_nonzero(prev[d:d + rows] != new[:rows]) / float(rows * prev.shape[1])
+        if agree >= _STITCH_AGREE and (best is None or agree > best[1]):
+            best = (d, agree)
+    return None if best is None else best[0]
+
+
+class _ConcatCanvas:
+    """縦連結のバッファ。1 枚追加するたびに全体を組み直さず、伸長する numpy 配列の末尾へ
+    区切り線とフレームを書き足す（O(フレーム)）。最古の破棄は先頭オフセットをずらすだけ。
+    幅が変わったとき（従来どおり最大幅に拡大縮小して揃える）だけ全体を貼り直す。
+    stitch=True なら直前フレームとのスクロール重なりを除き、区切り線なしで続けて書く。
+    重なりを除いて書いたフレームが先頭になったら（最古の破棄）、欠けた行を戻すためそこから全体を貼り直す。"""
+
+    def __init__(self, mode: str = CONCAT_MODE_L, gap: int = CONCAT_GAP_PX, max_frames: int = CONCAT_MAX,
+                 sep: int = 180, stitch: bool = CONCAT_STITCH):
+        self.mode = "L" if mode == "L" else "RGB"
+        self.gap = max(0, int(gap)); self.max_frames = max(1, int(max_frames)); self.sep = sep
+        self.stitch = stitch
+        self.clear()
+
+    def clear(self):
+        self._frames = []   # 追加順の (元画像, 先頭で捨てる重なり行数)。幅が変わったときの貼り直し用
+        self._spans = []    # 各フレームの (開始行, 高さ)。バッファ上の位置
+        self._buf = None; self._top = 0; self._end = 0; self._w = 0
+        self._last_bits = None  # 直前フレームの行ハッシュ（重なり検出用）
+        self._image = None      # image() の結果（次の変更まで使い回す）
+
+    def __len__(self):
+        return len(self._frames)
+
+    def append(self, im: Image.Image) -> str:
+        """"added" / "stitched"（重なりを除いて追加）/ "duplicate"（ほぼ同一なので追加せず）"""
+        im = im if im.mode == self.mode else im.convert(self.mode)
+        skip = 0; bits = None
+        if self.stitch:
+            bits = _row_bits(im)
+            prev = self._frames[-1][0] if self._frames else None
+            if prev is not None and prev.width == im.width and self._last_bits is not None:
+                d = _scroll_offset(self._last_bits, bits)
+                if d is not None:
+                    skip = prev.height - d
+                    if im.height - skip < _STITCH_MIN_NEW:
+                        return "duplicate"
+        rebuild = False
+        if len(self._frames) >= self.max_frames:
+            self._frames.pop(0); self._spans.pop(0)
+            if not self._spans:
+                self.clear(); skip = 0  # 重なりの相手ごと捨てたので、新しいフレームは全行書く
+            elif self._frames[0][1]:
+                rebuild = True          # 新しい先頭は重なり行を捨てて書いてある → 全行で貼り直す
+            else:
+                self._top = self._spans[0][0]
+        self._last_bits = bits
+        frames = self._frames + [(im, skip)]
+        w = max(f.width for f, _ in frames)
+        if (w != self._w or rebuild) and self._frames:
+            last_bits = self._last_bits
+            self.clear(); self._w = w; self._last_bits = last_bits
+            for i, (f, sk) in enumerate(frames):
+                self._put(f, 0 if i == 0 else sk)  # 先頭は前のフレームが無いので重なりも無い
+        else:
+            self._w = w
+            self._put(im, skip)
+        return "stitched" if skip else "added"
+
+    def _reserve(self, rows: int):
+        if self._buf is not None and self._end + rows <= self._buf.shape[0]:
+            return
+        live = self._end - self._top
+        shape = (max(256, 2 * (live + rows)), self._w) + ((3,) if self.mode == "RGB" else ())
+        buf = np.zeros(shape, np.uint8)
+        if self._buf is not None and live:
+            buf[:live] = self._buf[self._top:self._end]
+        self._spans = [(y - self._top, h) for y, h in self._spans]
+        self._buf = buf; self._top = 0; self._end = live
+
+    def _put(self, im: Image.Image, skip: int = 0):
+        fit = im if im.width == self._w else im.resize((self._w, int(im.height * (self._w / im.width))), Image.BICUBIC)
+        rows = np.asarray(fit)
+        if skip:
+            rows = rows[int(round(skip * fit.height / float(im.height))):]
+        gap = self.gap if self._spans and not skip else 0
+        self._reserve(gap + rows.shape[0])
+        if gap:
+            self._buf[self._end:self._end + gap] = self.sep  # 区切り線は一括代入
+            self._end += gap
+        self._buf[self._end:self._end + rows.shape[0]] = rows
+        self._spans.append((self._end, rows.shape[0])); self._frames.append((im, skip))
+        self._end += rows.shape[0]
+        self._image = None
+
+    def image(self) -> Image.Image:
+        if not self._frames:
+            raise RuntimeError("concat buffer is empty")
+        if self._image is None:
+            self._image = Image.fromarray(self._buf[self._top:self._end].copy(), self.mode)
+        return self._image
+
+
+# --- タイル分割: 行間（空白帯）を探して切る ---
+# 縦長画像（連結/ドロップ）は長辺 OST_MAX_WH を超えても縮小せず、行間で切った複数枚として 1 リクエストに載せる。
+OST_TILE_MAX = max(1, int(os.environ.get("OST_TILE_MAX", "4")))  # 1リクエストに載せる最大枚数（超える分は従来どおり縮小）
+_TILE_MIN_H = 8  # これより薄い切片は作らない(px)
+
+
+def _row_profile(gray: np.ndarray) -> np.ndarray:
+    """行ごとの「インク量」= 横隣との輝度差の総和（文字行は大きく、行間は小さい）。3行の移動平均で均す。"""
+    d = np.abs(np.diff(gray.astype(np.int16), axis=1)).sum(axis=1, dtype=np.int64)
+    return np.convolve(d, np.ones(3) / 3.0, mode="same")
+
+
+def _pick_gutter(prof: np.ndarray, lo: int, hi: int, target: int) -> int:
+    """[lo, hi) で最も静かな行を返す。静かな行が連なる（= 空白帯）ときは target に近い帯の中央。"""
+    lo = max(1, lo); hi = min(len(prof) - 1, hi)
+    if hi <= lo:
+        return int(min(max(target, 1), len(prof) - 1))
+    w = prof[lo:hi]
+    m = w.min()
+    # 背景ノイズの床（下位5%）までは同じ「静か」とみなす。下がり/点だけの行は拾わない程度に狭く
+    quiet = w <= np.percentile(w, 5) + 0.005 * (w.max() - m) + 1e-6
+    cand = np.flatnonzero(quiet)
+    c = int(cand[np.abs(cand + lo - target).argmin()])
+    a = c; b = c
+    while a > 0 and quiet[a - 1]: a -= 1
+    while b + 1 < len(w) and quiet[b + 1]: b += 1
+    return lo + (a + b) // 2
+
+
+def _line_cuts(gray: np.ndarray, parts: int = 0, max_h: int = 0) -> list:
+    """切れ目の行位置 [0, c1, ..., H] を返す。
+    parts>0: 等分位置の ±1/4 切片以内で行間を探す / max_h>0: 各切片が max_h 以下になるよう上から貪欲に切る。"""
+    H = gray.shape[0]
+    prof = _row_profile(gray)
+    cuts = [0]
+    if parts > 0:
+        step = H / float(parts)
+        for i in range(1, parts):
+            t = int(H * i / parts)
+            lo = max(cuts[-1] + _TILE_MIN_H, t - int(step / 4))
+            c = _pick_gutter(prof, lo, t + int(step / 4) + 1, t)
+            if c - cuts[-1] >= _TILE_MIN_H and H - c >= _TILE_MIN_H:
+                cuts.append(c)
+    elif max_h > 0:
+        while H - cuts[-1] > max_h:
+            top = cuts[-1]
+            c = _pick_gutter(prof, top + int(max_h * 0.6), top + max_h + 1, top + max_h)
+            cuts.append(max(c, top + _TILE_MIN_H))
+    cuts.append(H)
+    return cuts
+
+
+# --- OCR 前処理: グレースケール → 明るさ/コントラストを 1 枚の LUT → 3x3 シャープ 1 回 ---
+# ImageEnhance を 3 段つなぐと段ごとに全画素の新画像（+ 黒/灰の退化画像 + SMOOTH 画像）を作るため、同じ結果を 3 パスで出す。
+_PRE_MAIN    = (1.12, 1.32, 1.1)  # 本文: (明るさ, コントラスト, シャープ)
+_PRE_SPEAKER = (1.0, 1.2, 1.0)    # 話者枠: コントラストのみ
+_LUT_RAMP    = Image.frombytes("L", (256, 1), bytes(range(256)))
+
+
+def _enhance_lut(hist: list, brightness: float, contrast: float) -> bytes:
+    """ImageEnhance.Brightness → Contrast と同じ写像を 256 要素の LUT に畳む。
+    各段を 256px のランプに Image.blend で掛けるので丸めも一致する。コントラストの基準（平均）は
+    明るさ適用後の画像の平均 = 元ヒストグラムを LUT で写したものから求める。"""
+    lut1 = _LUT_RAMP if brightness == 1.0 else Image.blend(Image.new("L", (256, 1), 0), _LUT_RAMP, brightness)
+    lut1 = lut1.tobytes()
+    if contrast == 1.0:
+        return lut1
+    n = sum(hist) or 1
+    mean = int(sum(c * lut1[v] for v, c in enumerate(hist)) / n + 0.5)
+    lut2 = Image.blend(Image.new("L", (256, 1), mean), _LUT_RAMP, contrast).tobytes()
+    return bytes(lut2[v] for v in lut1)
+
+
+def _sharpen_kernel(factor: float) -> ImageFilter.Kernel:
+    """Sharpness(f) = f*原画 + (1-f)*SMOOTH を 1 つの 3x3 カーネルに（SMOOTH = [1,1,1,1,5,1,1,1,1]/13）"""
+    k = [(1.0 - factor) / 13.0] * 9
+    k[4] = factor + (1.0 - factor) * 5.0 / 13.0
+    return ImageFilter.Kernel((3, 3), k, scale=1.0)
+
+
+_SHARPEN_ROWS = 64  # int16 の中間配列がキャッシュに収まる程度の行数ずつ処理する
+
+
+def _sharpen_l(g: Image.Image, factor: float) -> Image.Image:
+    """L 画像に Sharpness(factor) 相当を 1 回で掛ける。
+    上のカーネルを展開すると 出力 = c + (f-1)*(9c - 3x3和)/13。3x3和は縦→横の加算で作り、
+    係数は 2^n 倍した整数の掛け算 + シフトで近似（int16 に収まる範囲）。外周 1px は SMOOTH と同じく原画のまま。"""
+    k = (factor - 1.0) / 13.0
+    n = 8
+    while n < 14 and round(abs(k) * (1 << (n + 1))) * 2295 < 32767 - (1 << n):
+        n += 1
+    m = int(round(k * (1 << n)))
+    if m == 0 or abs(m) * 2295 >= 32767 - (1 << n):
+        return g.filter(_sharpen_kernel(factor))  # 係数が大きすぎる/小さすぎるときは Pillow に任せる
+    a = np.asarray(g)
+    H, W = a.shape
+    if H < 3 or W < 3:
+        return g
+    out = a.copy()
+    for y0 in range(1, H - 1, _SHARPEN_ROWS):
+        y1 = min(H - 1, y0 + _SHARPEN_ROWS)
+        c = a[y0 - 1:y1 + 1].astype(np.int16)
+        v = c[:-2] + c[1:-1]; v += c[2:]
+        s = v[:, :-2] + v[:, 1:-1]; s += v[:, 2:]
+        inner = c[1:-1, 1:-1]
+        d = inner * 9; d -= s
+        d *= m; d += 1 << (n - 1); d >>= n
+        d += inner
+        np.clip(d, 0, 255, out=d)
+        out[y0:y1, 1:-1] = d
+    return Image.fromarray(out, "L")
+
+
+def _preprocess_for_ocr(im: Image.Image, params: tuple = _PRE_MAIN) -> Image.Image:
+    """OST_PREPROCESS の共通処理。ImageEnhance 3 段と比べ LUT 部分は完全一致、シャープは丸めの差（±1）だけ。"""
+    brightness, contrast, sharpness = params
+    g = im if im.mode == "L" else im.convert("L")
+    if brightness != 1.0 or contrast != 1.0:
+        g = g.point(_enhance_lut(g.histogram(), brightness, contrast))
+    if sharpness != 1.0:
+        g = _sharpen_l(g, sharpness)
+    return g
+
+
+def _preprocess_legacy(im: Image.Image, params: tuple = _PRE_MAIN) -> Image.Image:
+    """従来の ImageEnhance 連鎖（--bench preprocess の比較用）"""
+    brightness, contrast, sharpness = params
+    im = im.convert("L")
+    if brightness != 1.0: im = ImageEnhance.Brightness(im).enhance(brightness)
+    if contrast != 1.0:   im = ImageEnhance.Contrast(im).enhance(contrast)
+    if sharpness != 1.0:  im = ImageEnhance.Sharpness(im).enhance(sharpness)
+    return im
+
+
+# --- キャプチャ: mss はスレッドごとに 1 つを使い回し、BGRA の生バッファのまま受け渡す ---
+_CAP_LOCAL = threading.local()
+
+
+def _capture_session():
+    """呼び出しスレッド専用の mss（初回だけ生成。Windows の DC などはスレッドに紐づくため共有しない）"""
+    sct = getattr(_CAP_LOCAL, "sct", None)
+    if sct is None:
+        sct = _CAP_LOCAL.sct = mss.mss()
+    return sct
+
+
+def _close_capture_session():
+    sct = getattr(_CAP_LOCAL, "sct", None)
+    if sct is not None:
+        _CAP_LOCAL.sct = None
+        try: sct.close()
+        except Exception: pass
+
+
+class _Frame:
+    """1 回分のキャプチャ（mss の BGRA 生バッファを参照するだけでコピーしない）。
+    PIL 画像が要る段で初めて BGRX → RGB を 1 パスで展開する。box 指定ならその部分だけ。"""
+    __slots__ = ("raw", "width", "height")
+
+    def __init__(self, shot):
+        self.raw = shot.raw; self.width = shot.width; self.height = shot.height
+
+    def array(self) -> np.ndarray:
+        """(H, W, 4) BGRA のビュー"""
+        return np.frombuffer(self.raw, dtype=np.uint8).reshape(self.height, self.width, 4)
+
+    def image(self, box: Optional[tuple] = None) -> Image.Image:
+        if box is None:
+            return Image.frombuffer("RGB", (self.width, self.height), self.raw, "raw", "BGRX", self.width * 4, 1)
+        x0, y0, x1, y1 = (max(0, min(v, lim)) for v, lim in zip(box, (self.width, self.height) * 2))
+        if x1 <= x0 or y1 <= y0:
+            raise ValueError(f"empty crop {box} in {self.width}x{self.height}")
+        # 行ストライドはそのままに先頭をずらして読む（切り出しのための中間コピーなし）
+        view = memoryview(self.raw)[(y0 * self.width + x0) * 4:]
+        return Image.frombuffer("RGB", (x1 - x0, y1 - y0), view, "raw", "BGRX", self.width * 4, 1)
+
+
+def _grab_frame(region: dict) -> _Frame:
+    return _Frame(_capture_session().grab(region))
+
+
+_GRAB_UNION_RATIO = 2.0  # 外接矩形の面積が各領域の合計のこの倍以内なら 1 回の grab にまとめる
+
+
+def _grab_regions(sct, regions: list) -> list:
+    """複数の物理領域を撮り、[(フレーム, 切り出し box or None), ...] を同じ順で返す"""
+    if len(regions) < 2:
+        return [(_Frame(sct.grab(rg)), None) for rg in regions]
+    left = min(rg["left"] for rg in regions); top = min(rg["top"] for rg in regions)
+    right = max(rg["left"] + rg["width"] for rg in regions); bottom = max(rg["top"] + rg["height"] for rg in regions)
+    if (right - left) * (bottom - top) > _GRAB_UNION_RATIO * sum(rg["width"] * rg["height"] for rg in regions):
+        # 離れている（別モニタ等）ときは外接矩形が大きくなりすぎるので個別に撮る（非表示は 1 回のまま）
+        return [(_Frame(sct.grab(rg)), None) for rg in regions]
+    frame = _Frame(sct.grab({"left": left, "top": top, "width": right - left, "height": bottom - top}))
+    return [(frame, (rg["left"] - left, rg["top"] - top, rg["left"] - left + rg["width"], rg["top"] - top + rg["height"]))
+            for rg in regions]
+
+
+# --- ジョブ: 優先度つきキュー + 上限つきワーカー。結果は優先度ごとに投入（キャプチャ）順で届ける ---
+OST_JOB_WORKERS   = max(1, int(os.environ.get("OST_JOB_WORKERS", "2")))    # 同時に API を叩くジョブ数
+OST_JOB_QUEUE_MAX = max(1, int(os.environ.get("OST_JOB_QUEUE_MAX", "8")))  # 未配達ジョブの上限（超えたら受け付けない）
+JOB_INTERACTIVE = 0   # ホットキー/GUI/自動翻訳からのキャプチャ
+JOB_BATCH       = 10  # 画像ファイル/再翻訳など後回しでよいもの
+
+_JOB_LOCAL = threading.local()
+
+
+def _current_job() -> Optional["_Job"]:
+    """このスレッドで実行中のジョブ（ジョブ外なら None）"""
+    return getattr(_JOB_LOCAL, "job", None)
+
+
+def _run_in_job(job, fn, *args):
+    """別スレッド（スライス並列など）でも呼び出し元ジョブのキャンセル/原文を見えるようにして実行"""
+    prev = _current_job(); _JOB_LOCAL.job = job
+    try:
+        return fn(*args)
+    finally:
+        _JOB_LOCAL.job = prev
+
+
+class _Job:
+    __slots__ = ("id", "priority", "fn", "args", "on_done", "cancel_evt", "source", "result", "error", "state", "settled")
+
+    def __init__(self, job_id: int, priority: int, fn, args: tuple, on_done):
+        self.id = job_id; self.priority = priority; self.fn = fn; self.args = args; self.on_done = on_done
+        self.cancel_evt = threading.Event()
+        self.source = ""  # このジョブで読み取った原文（last_source_text の実体）
+        self.result = None; self.error = None
+        self.state = "queued"  # queued / running / done
+        self.settled = False   # 配達の順番待ちを抜けてよい（完了 or 取り消し）
+
+    @property
+    def canceled(self) -> bool:
+        return self.cancel_evt.is_set()
+
+    def cancel(self):
+        """取り消し＋通信中の HTTP の打ち切り（スレッドはすぐ空く）"""
+        self.cancel_evt.set()
+        _abort_requests(self.cancel_evt)
+
+
+class _JobScheduler:
+    """submit した順に番号を振り、優先度→番号の順で OST_JOB_WORKERS 本のワーカーが実行する。
+    on_done(job) は同じ優先度の先行ジョブがすべて終わって（または取り消されて）から番号順に呼ばれる。
+    on_busy(bool) は未配達ジョブが 0↔1 以上に変わったときに呼ばれる。"""
+
+    def __init__(self, workers: int = OST_JOB_WORKERS, max_pending: int = OST_JOB_QUEUE_MAX, on_busy=None):
+        self._cv = threading.Condition()
+        self._deliver_lock = threading.Lock()  # 配達順を保つ（完了の早いワーカーが追い越さない）
+        self._heap = []                         # (priority, id, job)
+        self._order: Dict[int, deque] = {}      # priority -> 未配達ジョブ（投入順）
+        self._jobs: Dict[int, _Job] = {}
+        self._ids = itertools.count(1)
+        self._threads: list = []
+        self._workers = max(1, workers); self._max_pending = max(1, max_pending)
+        self._closed = False
+        self.on_busy = on_busy
+
+    def __len__(self):
+        with self._cv:
+            return len(self._jobs)
+
+    def submit(self, fn, *args, priority: int = JOB_INTERACTIVE, on_done=None) -> Optional[_Job]:
+        """fn(*args) をジョブとして積む。満杯/終了済みなら None"""
+        with self._cv:
+            if self._closed or len(self._jobs) >= self._max_pending:
+                return None
+            job = _Job(next(self._ids), priority, fn, args, on_done)
+            heapq.heappush(self._heap, (priority, job.id, job))
+            self._order.setdefault(priority, deque()).append(job)
+            self._jobs[job.id] = job
+            if len(self._threads) < self._workers:
+                t = threading.Thread(target=self._worker, name=f"ost-job{len(self._threads) + 1}", daemon=True)
+                self._threads.append(t); t.start()
+            self._cv.notify()
+            if len(self._jobs) == 1 and self.on_busy: self.on_busy(True)
+        return job
+
+    def cancel(self, job_id: int) -> bool:
+        """1 件だけ取り消す。待ち行列なら実行されず、実行中なら cancel_evt で中断を促す。後続の配達は待たせない"""
+        with self._cv:
+            job = self._jobs.get(job_id)
+        if job is None:
+            return False
+        job.cancel()
+        self._settle(job)
+        return True
+
+    def cancel_all(self) -> int:
+        with self._cv:
+            jobs = list(self._jobs.values())
+        for job in jobs:
+            job.cancel()
+        for job in jobs:
+            self._settle(job)
+        return len(jobs)
+
+    def is_front(self, job: _Job) -> bool:
+        """いま画面に出してよいジョブか（自分より先に届くべきジョブが残っていない）"""
+        with self._cv:
+            for pri, q in self._order.items():
+                if q and (pri < job.priority or (pri == job.priority and q[0] is not job)):
+                    return False
+            return True
+
+    def close(self):
+        self.cancel_all()
+        with self._cv:
+            self._closed = True; self._cv.notify_all()
+
+    def _worker(self):
+        while True:
+            with self._cv:
+                while not self._heap and not self._closed:
+                    self._cv.wait()
+                if self._closed:
+                    return
+                _pri, _id, job = heapq.heappop(self._heap)
+                if job.canceled:
+                    continue
+                job.state = "running"
+            _JOB_LOCAL.job = job
+            try:
+                job.result = job.fn(*job.args)
+            except Exception as e:
+                job.error = e
+            finally:
+                _JOB_LOCAL.job = None
+                job.state = "done"
+            self._settle(job)
+
+    def _settle(self, job: _Job):
+        with self._deliver_lock:
+            ready = []
+            with self._cv:
+                job.settled = True
+                q = self._order.get(job.priority)
+                while q and q[0].settled:
+                    j = q.popleft(); ready.append(j); self._jobs.pop(j.id, None)
+            for j in ready:
+                if j.on_done is not None and j.state == "done" and not j.canceled:
+                    try:
+                        j.on_done(j)
+                    except Exception as e:
+                        if DEBUG: print("[OST] job delivery failed:", e)
+            with self._cv:
+                if ready and not self._jobs and self.on_busy: self.on_busy(False)
+
+
+# --- Watch: 縮小フレームのブロック平均で変化/静止を判定 ---
+_WATCH_SIG_W = 160  # 署名用の縮小幅(px)。これ以上は間引いて読む
+_WATCH_BLOCK = 8    # 縮小後のブロック(px)
+
+
+def _watch_signature(raw, width: int, height: int, trim: int = 0) -> Optional[np.ndarray]:
+    """mss の BGRA 生バッファから、間引き + ブロック平均の小さな float32 行列を作る（コピーは縮小後のみ）"""
+    a = np.frombuffer(raw, dtype=np.uint8).reshape(height, width, 4)
+    if trim > 0 and height > trim * 4 and width > trim * 4:
+        a = a[trim:-trim, trim:-trim]  # 枠線/編集ハンドルの描画域は見ない
+    k = max(1, a.shape[1] // _WATCH_SIG_W)
+    g = a[::k, ::k, 1].astype(np.float32)  # 緑チャンネル ≒ 輝度
+    hb, wb = g.shape[0] // _WATCH_BLOCK, g.shape[1] // _WATCH_BLOCK
+    if hb == 0 or wb == 0:
+        return g
+    return g[:hb * _WATCH_BLOCK, :wb * _WATCH_BLOCK].reshape(hb, _WATCH_BLOCK, wb, _WATCH_BLOCK).mean(axis=(1, 3))
+
+
+def _watch_changed(a: Optional[np.ndarray], b: Optional[np.ndarray], thresh: float = OST_WATCH_DIFF) -> bool:
+    if a is None or b is None or a.shape != b.shape:
+        return True
+    return bool((np.abs(a - b) > thresh).any())
+
+
+class _RoiWatcher(threading.Thread):
+    """UIスレッド外で ROI を一定間隔でサンプリングし、「変化 → N枚静止」になったら fire() を呼ぶ。
+    region_fn は mss の物理領域（dict）か None を返す。busy_fn が True の間と直後は基準だけ更新する。"""
+    def __init__(self, region_fn, busy_fn, fire, trim: int = 0):
+        super().__init__(daemon=True)
+        self._region_fn = region_fn; self._busy_fn = busy_fn; self._fire = fire; self._trim = trim
+        self._stop_evt = threading.Event()
+
+    def stop(self):
+        self._stop_evt.set()
+
+    def run(self):
+        period = 1.0 / OST_WATCH_HZ
+        base = prev = None; stable = 0; hold_until = 0.0; region_prev = None
+        cpu0 = time.thread_time(); wall0 = time.perf_counter()
+        with mss.mss() as sct:
+            while not self._stop_evt.is_set():
+                t0 = time.perf_counter()
+                try:
+                    region = self._region_fn()
+                    if region:
+                        shot = sct.grab(region)
+                        cur = _watch_signature(shot.raw, shot.width, shot.height, self._trim)
+                        if region != region_prev:
+                            # ROI が動いた/変わった: 発火せず基準を取り直す
+                            region_prev = region; base = None; stable = 0
+                        elif _watch_changed(cur, prev):
+                            stable = 0
+                        else:
+                            stable += 1
+                        prev = cur
+                        if self._busy_fn():
+                            hold_until = time.perf_counter() + OST_WATCH_HOLD
+                        if stable >= OST_WATCH_STABLE:
+                            if base is None or time.perf_counter() < hold_until:
+                                base = cur
+                            elif _watch_changed(cur, base):
+                                base = cur
+                                self._fire()
+                except Exception as e:
+                    if DEBUG: print("[OST] watch sample failed:", e)
+                if DEBUG and (t0 - wall0) >= 10.0:
+                    cpu1 = time.thread_time()
+                    print(f"[OST] watch cpu={100.0 * (cpu1 - cpu0) / (t0 - wall0):.2f}% @ {OST_WATCH_HZ:g}Hz")
+                    cpu0 = cpu1; wall0 = t0
+                self._stop_evt.wait(max(0.0, period - (time.perf_counter() - t0)))
+
+
+# --- 翻訳エンジン（Qt 非依存）: 画像 → 訳文。Overlay/ベンチ/バッチ/負荷試験が同じ経路を通る ---
+@dataclass
+class TranslateOptions:
+    speaker: str = ""
+    tone: str = ""
+    tone_mode: str = "lite"            # "lite" / "pro"（口調プリセットの出し分け）
+    keep_source: bool = KEEP_SOURCE    # {"source","ja"} で原文も受け取る
+    stream: bool = OST_STREAM          # streamGenerateContent で途中経過を on_partial に流す
+
+
+@dataclass
+class TranslationResult:
+    text: str                          # 訳文（空応答/停止理由の説明文もここに入る）
+    source: str = ""                   # 原文（keep_source 時）
+    cached: bool = False
+    seconds: float = 0.0
+    tokens: int = 0                    # usageMetadata.totalTokenCount の合計（キャッシュヒットは 0）
+
+
+_CALL_LOCAL = threading.local()
+
+
+class _EngineCall:
+    """translate() 1 回分の状態。エンジン内部ではスレッドローカル経由で参照する（分割翻訳のワーカーにも引き継ぐ）"""
+    __slots__ = ("options", "cancel_evt", "on_partial", "on_status", "source", "cached", "tokens", "_lock")
+
+    def __init__(self, options: TranslateOptions, cancel_evt: threading.Event, on_partial=None, on_status=None):
+        self.options = options; self.cancel_evt = cancel_evt
+        self.on_partial = on_partial; self.on_status = on_status
+        self.source = ""; self.cached = False; self.tokens = 0
+        self._lock = threading.Lock()
+
+    def add_tokens(self, n: int):
+        # 分割翻訳/パックのワーカーから同時に呼ばれる（+= は読みと書きの間で割り込まれうる）
+        with self._lock:
+            self.tokens += n
+
+
+def _run_in_call(call: Optional[_EngineCall], fn, *args):
+    prev = getattr(_CALL_LOCAL, "call", None)
+    _CALL_LOCAL.call = call
+    try:
+        return fn(*args)
+    finally:
+        _CALL_LOCAL.call = prev
+
+
+def _annotated_path(out_dir: str, include_src: bool, layout: str) -> str:
+    os.makedirs(out_dir, exist_ok=True)
+    ts = time.strftime("%Y%m%d_%H%M%S"); ns = time.time_ns() % 1_000_000_000
+    kind = ("src_ja" if include_src else "ja") + "_" + layout
+    return os.path.join(out_dir, f"annotated_{kind}_{ts}_{ns:09d}.png")
+
+
+class TranslationEngine:
+    """画像翻訳のパイプライン一式（縮小/タイル化 → キャッシュ → キープール/HTTP → JSON 解析 → 併記画像）。
+    translate() はスレッドセーフで、QApplication もディスプレイも要らない。submit() は自前のワーカーで非同期に回す。"""
+    def __init__(self, keys: Optional[_KeyPool] = None, http: Optional[_HttpPool] = None,
+                 cache: Optional["_TranslationCache"] = None, use_cache: bool = OST_CACHE,
+                 workers: int = OST_JOB_WORKERS):
+        self.keys = keys if keys is not None else _KeyPool.from_env()
+        self.http = http if http is not None else _HttpPool()
+        self.tcache = cache if cache is not None else (_TranslationCache() if use_cache else None)
+        self._workers = max(1, workers); self._pool: Optional[ThreadPoolExecutor] = None
+        self._mlock = threading.Lock()
+        self._metrics = {"calls": 0, "ok": 0, "cache_hits": 0, "errors": 0, "canceled": 0}
+        self._lat = deque(maxlen=512)
+
+    def start(self):
+        """接続の事前確立（キーがあるときだけ）"""
+        if self.keys.primary: self.http.start()
+        return self
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+        self.http.close()
+
+    # ---- 公開 API ----
+    def translate(self, image, options: Optional[TranslateOptions] = None, speaker_image=None,
+                  cancel_evt: Optional[threading.Event] = None, on_partial=None, on_status=None) -> TranslationResult:
+        """image/speaker_image は PIL 画像 / PNG バイト列 / _ApiImage。失敗は例外（取り消しは RuntimeError("canceled")）。
+        on_partial(text): ストリーミング中の途中訳 / on_status(text): 再翻訳中などの経過メッセージ"""
+        if not self.keys.primary:
+            raise RuntimeError("APIキー未設定：GEMINI_API_KEY または GOOGLE_API_KEY を設定してください")
+        call = _EngineCall(options or TranslateOptions(), cancel_evt or threading.Event(), on_partial, on_status)
+        t0 = time.perf_counter()
+        with self._mlock: self._metrics["calls"] += 1
+        try:
+            if call.cancel_evt.is_set():
+                raise RuntimeError("canceled")
+            text = _run_in_call(call, self._call_gemini_cached, _ApiImage.of(image), _ApiImage.of(speaker_image))
+        except Exception as e:
+            canceled = str(e) == "canceled" or call.cancel_evt.is_set()
+            with self._mlock: self._metrics["canceled" if canceled else "errors"] += 1
+            raise
+        dt = time.perf_counter() - t0
+        with self._mlock:
+            self._metrics["ok"] += 1; self._metrics["cache_hits"] += int(call.cached)
+            if not call.cached: self._lat.append(dt)
+        return TranslationResult(text=text, source=call.source, cached=call.cached, seconds=dt, tokens=call.tokens)
+
+    def submit(self, image, options: Optional[TranslateOptions] = None, **kw):
+        """translate() をエンジンのワーカーで実行して Future を返す"""
+        if self._pool is None:
+            with self._mlock:
+                if self._pool is None:
+                    self._pool = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix="ost-engine")
+        return self._pool.submit(self.translate, image, options, **kw)
+
+    def translate_many(self, images, options: Optional[TranslateOptions] = None,
+                       cancel_evt: Optional[threading.Event] = None, on_status=None,
+                       max_per_request: int = OST_PACK_MAX) -> List[TranslationResult]:
+        """複数の独立した画像を、別々の inline_data として 1 リクエストに載せて訳す（{index, source, ja} の配列で受ける）。
+        戻り値は images と同じ順。枚数（max_per_request）/送信サイズ（OST_PACK_MAX_BYTES）で自動的に分け、
+        まとめて訳せなかった画像（欠番/停止/解析不能）は 1 枚ずつの経路でやり直す"""
+        if not self.keys.primary:
+            raise RuntimeError("APIキー未設定：GEMINI_API_KEY または GOOGLE_API_KEY を設定してください")
+        imgs = [_ApiImage.of(x) for x in images]
+        opts = options or TranslateOptions()
+        call = _EngineCall(TranslateOptions(**{**opts.__dict__, "stream": False}), cancel_evt or threading.Event(),
+                           None, on_status)
+        with self._mlock: self._metrics["calls"] += len(imgs)
+        try:
+            out = _run_in_call(call, self._translate_packed, imgs, max(1, max_per_request))
+        except Exception as e:
+            canceled = str(e) == "canceled" or call.cancel_evt.is_set()
+            with self._mlock: self._metrics["canceled" if canceled else "errors"] += len(imgs)
+            raise
+        with self._mlock:
+            for r in out:
+                self._metrics["ok"] += 1; self._metrics["cache_hits"] += int(r.cached)
+                if not r.cached: self._lat.append(r.seconds)
+        return out
+
+    def batch_request(self, image, options: Optional[TranslateOptions] = None) -> tuple:
+        """image を Gemini Batch の入力 1 行分にする：(キー, GenerateContentRequest)。送信はしない（APIキー不要）。
+        キーは translate() と同じ翻訳キャッシュのキーなので、batch_result() でそのままキャッシュに入る"""
+        call = _EngineCall(options or TranslateOptions(), threading.Event(), None, None)
+        return _run_in_call(call, self._batch_request, _ApiImage.of(image))
+
+    def batch_result(self, key: str, response: dict, keep_source: bool = KEEP_SOURCE) -> TranslationResult:
+        """Gemini Batch の出力 1 行分（GenerateContentResponse）を訳文にして翻訳キャッシュへ入れる。
+        RECITATION などの停止はその場で再送できないので RuntimeError（対話/--batch の経路なら再翻訳される）"""
+        cands = (response or {}).get("candidates") or []
+        cand = cands[0] if cands else None
+        if not cand:
+            pf = (response or {}).get("promptFeedback") or {}
+            raise RuntimeError(f"空応答: {('blocked:' + str(pf)) if pf else str(response)[:400]}")
+        finish = cand.get("finishReason")
+        if finish and finish != "STOP":
+            raise RuntimeError(f"モデルが出力を停止: finishReason={finish}")
+        src, text = self._parse_reply(cand, keep_source)
+        if self.tcache is not None and _is_cacheable_result(text):
+            self.tcache.put(key, src, text)
+        tokens = int(((response or {}).get("usageMetadata") or {}).get("totalTokenCount") or 0)
+        return TranslationResult(text=text, source=src, tokens=tokens)
+
+    def metrics(self) -> dict:
+        with self._mlock:
+            m = dict(self._metrics); lat = sorted(self._lat)
+        if lat:
+            m["p50_s"] = lat[len(lat) // 2]; m["p95_s"] = lat[min(len(lat) - 1, int(len(lat) * 0.95))]
+        return m
+
+    def stats_line(self) -> str:
+        m = self.metrics()
+        lat = f" p50={m['p50_s']:.2f}s p95={m['p95_s']:.2f}s" if "p50_s" in m else ""
+        return (f"calls={m['calls']} ok={m['ok']} cache-hits={m['cache_hits']} errors={m['errors']} "
+                f"canceled={m['canceled']}{lat} | {self.keys.stats_line()}")
+
+    # ---- 呼び出しごとの状態（translate() の中からだけ参照される） ----
+    @property
+    def _call(self) -> _EngineCall:
+        call = getattr(_CALL_LOCAL, "call", None)
+        if call is None:
+            raise RuntimeError("TranslationEngine の内部処理は translate() の中から呼んでください")
+        return call
+
+    @property
+    def cancel_evt(self) -> threading.Event:
+        return self._call.cancel_evt
+
+    @property
+    def last_source_text(self) -> str:
+        return self._call.source
+
+    @last_source_text.setter
+    def last_source_text(self, v: str):
+        self._call.source = v
+
+    @property
+    def speaker(self) -> str:
+        return self._call.options.speaker
+
+    @property
+    def tone(self) -> str:
+        return self._call.options.tone
+
+    @property
+    def tone_mode(self) -> str:
+        return self._call.options.tone_mode
+
+    def _status(self, text: str):
+        cb = self._call.on_status
+        if cb is not None: cb(text)
+
+    def _partial(self, text: str):
+        cb = self._call.on_partial
+        if cb is not None: cb(text)
+
+    # ---- 送信用の画像 ----
+    # --- 画像を縦に分割して返す（最終手段の回避用。行の途中では切らない／エンコードは送信時） ---
+    def _slice_image_vertical(self, img: "_ApiImage", parts: int = 3) -> list:
+        try:
+            im = img.image
+            if im.mode not in ("L", "RGB"):
+                im = im.convert("RGB")
+            cuts = _line_cuts(np.asarray(im.convert("L")), parts=max(2, int(parts)))
+            return [_ApiImage(im=im.crop((0, top, im.width, bottom))) for top, bottom in zip(cuts, cuts[1:])]
+        except Exception:
+            return [img]
+
+    # --- API送信用にタイル化（縦長は行間で切って複数枚、それ以外は従来の縮小） ---
+    def _tile_image_for_api(self, img: "_ApiImage") -> list:
+        try:
+            lim = int(os.environ.get("OST_MAX_WH", "2048"))
+            if lim <= 0 or OST_TILE_MAX <= 1:
+                return [self._fit_image_for_api(img)]
+            im = img.image
+            w, h = im.size
+            if h <= lim or w >= h:
+                return [self._fit_image_for_api(img)]
+            # 幅は lim まで、高さは最大 OST_TILE_MAX 枚に収まるまで縮める（行間で切るので 2 割の余裕を見る）
+            scale = min(1.0, lim / float(w), OST_TILE_MAX * lim * 0.8 / float(h))
+            if scale < 1.0:
+                im = im.resize((max(1, int(w * scale)), max(1, int(h * scale))), Image.LANCZOS)
+            cuts = _line_cuts(np.asarray(im.convert("L")), max_h=lim)
+            if len(cuts) - 1 > OST_TILE_MAX:
+                return [self._fit_image_for_api(img)]
+            if DEBUG: print(f"[OST] tiled {w}x{h} -> {len(cuts) - 1} tiles at scale {scale:.2f}: {cuts}")
+            return [_ApiImage(im=im.crop((0, top, im.width, bottom))) for top, bottom in zip(cuts, cuts[1:])]
+        except Exception:
+            return [self._fit_image_for_api(img)]
+
+    # --- API送信用に縮小（長辺を制限。収まっていれば同じインスタンスを返し、再エンコードしない） ---
+    def _fit_image_for_api(self, img: "_ApiImage") -> "_ApiImage":
+        try:
+            lim = int(os.environ.get("OST_MAX_WH", "2048"))  # 長辺の上限。既定 2048px
+            if lim <= 0:
+                return img
+            w, h = img.size
+            m = max(w, h)
+            if m <= lim:
+                return img
+            scale = lim / float(m)
+            new_size = (max(1, int(w * scale)), max(1, int(h * scale)))
+            return _ApiImage(im=_offload(_resize_lanczos, img.image, new_size))
+        except Exception:
+            return img
+
+    def _extract_source_ja(self, raw_text: str):
+        """
+        モデル出力の揺れ（```json フェンス、前後の説明文、JSONの前後ゴミ）に強いパーサ。
+        戻り値: (source, ja) どちらも str（見つからなければ ""）
+        """
+        import re, json
+
+        # Defensive: ensure raw_text is a string to avoid regex TypeError
+        if not isinstance(raw_text, str):
+            try:
+                raw_text = str(raw_text)
+            except Exception:
+                raw_text = ""
+
+        if not raw_text:
+            return "", ""
+
+        s = raw_text.strip()
+        # 追加: JSON抽出の強化（どこに出ても拾う）
+        try:
+            import json, re as _re2
+            # ```json ... ``` / ``` ... ``` ブロックを先に試す
+            for _m in _re2.finditer(r'```(?:json)?\s*(.*?)\s*```', s, _re2.DOTALL | _re2.IGNORECASE):
+                _blk = (_m.group(1) or "").strip()
+                if _blk:
+                    try:
+                        _obj = json.loads(_blk)
+                        _src = _obj.get("source") if isinstance(_obj, dict) else ""
+                        _ja  = _obj.get("ja")     if isinstance(_obj, dict) else ""
+                        if isinstance(_src, str) and isinstance(_ja, str):
+                            return _src, _ja
+                    except Exception:
+                        pass
+            # { ... } 断片を順に試す
+            for _m in _re2.finditer(r'\{.*?\}', s, _re2.DOTALL):
+                _frag = (_m.group(0) or "").strip()
+                if _frag:
+                    try:
+                        _obj = json.loads(_frag)
+                        _src = _obj.get("source") if isinstance(_obj, dict) else ""
+                        _ja  = _obj.get("ja")     if isinstance(_obj, dict) else ""
+                        if isinstance(_src, str) and isinstance(_ja, str):
+                            return _src, _ja
+                    except Exception:
+                        pass
+        except Exception:
+            pass
+
+
+        # 1) ```json ... ``` を除去
+        if s.startswith("```"):
+            lines = s.splitlines()
+            if lines and lines[0].startswith("```"):
+                lines = lines[1:]
+            if lines and lines[-1].strip().startswith("```"):
+                lines = lines[:-1]
+            s = "\n".join(lines).strip()
+
+        # 2) そのまま / { ... } だけを抜き出して JSON として読む
+        candidates = [s]
+        if "{" in s and "}" in s:
+            candidates.append(s[s.find("{"): s.rfind("}") + 1])
+
+        for cand in candidates:
+            try:
+                obj = json.loads(cand)
+                src = obj.get("source") or ""
+                ja  = obj.get("ja") or ""
+                if isinstance(src, str) and isinstance(ja, str):
+                    return src, ja
+            except Exception:
+                pass
+
+        # 3) 正規表現で "source":"...","ja":"..." をゆるく抽出（' も許容）
+        m = re.search(
+            r'''source\s*:\s*(?P<q1>["'])(?P<src>.*?)(?P=q1)\s*,\s*ja\s*:\s*(?P<q2>["'])(?P<ja>.*?)(?P=q2)''',
+            s, re.IGNORECASE | re.DOTALL
+        )
+        if m:
+            def unescape(t: str) -> str:
+                try:
+                    return bytes(t, "utf-8").decode("unicode_escape")
+                except Exception:
+                    return t
+            return unescape(m.group("src")), unescape(m.group("ja"))
+
+        # 4) どうしてもダメなら全文を「訳文」として返す（後方互換）
+        return "", s
+
+    # ---- 翻訳キャッシュ（_call_gemini_rest_with_retry の前段） ----
+    def _cache_context(self, speaker_img) -> str:
+        """画像本体以外のキー要素（近似一致もこの単位で区切る）"""
+        parts = [
+            PROMPT_VERSION, API_MODEL, "src+ja" if self._call.options.keep_source else "ja",
+            getattr(self, "tone_mode", "lite") or "lite", self.tone or "", self.speaker or "",
+            os.environ.get("OST_MAX_WH", "2048"), str(OST_TILE_MAX), f"{OST_ENCODE}:{OST_ENCODE_BUDGET}:{int(OST_ENCODE_LOSSY)}",
+            _image_content_hash(speaker_img) if speaker_img is not None else "-",
+        ]
+        return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+    def _cache_key(self, main_img, speaker_img, ctx: Optional[str] = None) -> str:
+        ctx = ctx or self._cache_context(speaker_img)
+        return hashlib.sha256((ctx + ":" + _image_content_hash(main_img)).encode("ascii")).hexdigest()
+
+    def _call_gemini_cached(self, main_img, speaker_img) -> str:
+        """ヒット時は HTTP を省略して {source, ja} を返す（last_source_text も復元）。
+        同じ内容の同時リクエストは先行 1 件の結果を待って共有する。"""
+        main_img, speaker_img = _ApiImage.of(main_img), _ApiImage.of(speaker_img)
+        cache = self.tcache
+        if cache is None:
+            return self._call_gemini_rest_with_retry(main_img, speaker_img)
+        try:
+            ctx = self._cache_context(speaker_img)
+            key = self._cache_key(main_img, speaker_img, ctx)
+            phash = _dhash_bits(main_img) if OST_NEAR_DUP else None
+        except Exception as e:
+            if DEBUG: print("[OST] cache key failed:", e)
+            return self._call_gemini_rest_with_retry(main_img, speaker_img)
+
+        while True:
+            hit = cache.get(key)
+            if hit is None and phash is not None:
+                hit = cache.get_near(ctx, phash)
+            if hit is not None:
+                if DEBUG: print(f"[OST] cache hit {key[:12]}")
+                self.last_source_text = hit["source"]; self._call.cached = True
+                return hit["ja"]
+            ev = cache.begin(key)
+            if ev is None:
+                break
+            # 先行リクエストの完了待ち（失敗していたら次のループで自分が先行になる）
+            while not ev.wait(0.1):
+                if self.cancel_evt.is_set():
+                    raise RuntimeError("canceled")
+
+        try:
+            text = self._call_gemini_rest_with_retry(main_img, speaker_img)
+            if _is_cacheable_result(text):
+                cache.put(key, getattr(self, "last_source_text", ""), text, ctx, phash)
+            return text
+        finally:
+            cache.end(key)
+
+    # ---- REST（リトライ & JSON保存） ----
+    def _call_gemini_rest_with_retry(self, main_img, speaker_img) -> str:
+        # タイル/縮小結果と送信 JSON は再試行をまたいで使い回す（1ジョブ 1 回だけエンコード）
+        memo = {}
+        return self._retry_call(self._call_gemini_rest_once, _ApiImage.of(main_img), _ApiImage.of(speaker_img), memo)
+
+    def _retry_call(self, fn, *args):
+        """ネットワーク例外/HTTP 429・5xx をジッター付き指数バックオフで再試行（キャンセルで即中断）。
+        429 の Retry-After はキーごとの _RateLimiter が全ワーカー共通で待つので、ここでは重ならないよう少しずらすだけ。
+        403 はキーが複数あれば別のキーで再送する"""
+        for attempt in range(OST_API_RETRIES + 1):
+            # ★ここでキャンセルなら即中断
+            if self.cancel_evt.is_set():
+                raise RuntimeError("canceled")
+            try:
+                return fn(*args)
+            except (requests.RequestException, _HttpStatusError) as e:
+                if self.cancel_evt.is_set():
+                    # abortable で接続を切られた分は ConnectionError などで上がってくる。呼び出し側には取り消しとして返す
+                    raise RuntimeError("canceled") from e
+                status = getattr(e, "status", None)
+                retryable = status is None or status == 429 or status >= 500 or (status == 403 and len(self.keys) > 1)
+                if not retryable or attempt >= OST_API_RETRIES:
+                    raise
+                delay = random.uniform(0, OST_BACKOFF_BASE) if status in (429, 403) else _backoff_delay(attempt)
+                if DEBUG: print(f"[OST] {'HTTP %d' % status if status else 'network error'}; retry {attempt + 1}/{OST_API_RETRIES} in {delay:.1f}s")
+                if self.cancel_evt.wait(delay):
+                    raise RuntimeError("canceled")
+        return ""
+
+    def _post_stream(self, body: bytes, headers: dict):
+        """streamGenerateContent(SSE) で受信し、ja が届いた分だけ on_partial に先出しする。
+        戻り値は generateContent と同じ形 (data, cand) に畳んだもの（以降の RECITATION 処理は共通）。"""
+        resp = self.http.post(API_STREAM_ENDPOINT, headers=headers, data=body,
+                              timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), stream=True)
+        try:
+            if resp.status_code >= 400:
+                raise _HttpStatusError.from_response(resp)
+            parser = _PartialJsonField("ja")
+            texts = []; finish = None; last = {}; cand_meta = {}; shown = ""
+            for line in resp.iter_lines():
+                if self.cancel_evt.is_set():
+                    raise RuntimeError("canceled")
+                if not line or not line.startswith(b"data:"):
+                    continue
+                try:
+                    chunk = json.loads(line[5:].strip().decode("utf-8"))
+                except Exception:
+                    continue
+                last = chunk
+                cands = chunk.get("candidates") or []
+                if not cands:
+                    continue
+                c0 = cands[0]
+                cand_meta.update({k: v for k, v in c0.items() if k != "content"})
+                finish = c0.get("finishReason") or finish
+                for p in (c0.get("content") or {}).get("parts") or []:
+                    if isinstance(p, dict) and p.get("text"):
+                        texts.append(p["text"])
+                        partial = parser.feed(p["text"])
+                        if partial and partial.strip() and partial != shown and not self.cancel_evt.is_set():
+                            shown = partial
+                            self._partial(partial)
+        finally:
+            resp.close()
+        if not texts and not cand_meta:
+            return last, None
+        cand = dict(cand_meta); cand["content"] = {"parts": [{"text": "".join(texts)}], "role": "model"}
+        if finish: cand["finishReason"] = finish
+        data = {k: v for k, v in last.items() if k != "candidates"}; data["candidates"] = [cand]
+        return data, cand
+
+    def _post_generate(self, body: bytes, tokens: int, stream: bool = False) -> tuple:
+        """generateContent を 1 回送って (data, 先頭候補 or None)。枠の空いているキーを確保してから送る（429 を食らう前にこちらで待つ）"""
+        key = self.keys.acquire(tokens, self.cancel_evt)
+        headers = {"x-goog-api-key": key.key, "Content-Type": "application/json; charset=utf-8"}
+        try:
+            # キャンセル（Alt+X / ジョブ取り消し）で接続ごと打ち切れるようにしておく
+            if stream:
+                with self.http.abortable(self.cancel_evt):
+                    data, cand = self._post_stream(body, headers)
+            else:
+                # 非ストリームは遅い応答にもう 1 本重ねる（タイムアウトも実測から）
+                resp = self.http.post_hedged(API_ENDPOINT, body, headers, self.cancel_evt,
+                                             admit=lambda: self.keys.admit_hedge(key, tokens),
+                                             hedge_done=lambda: self.keys.hedge_done(key))
+                if resp.status_code >= 400:
+                    raise _HttpStatusError.from_response(resp)
+                data = resp.json()
+                cands = data.get("candidates") or []
+                cand = cands[0] if cands else None
+        except (_HttpStatusError, requests.RequestException) as e:
+            # 4xx（429/403 以外）はこちらの要求の問題で、キー/API は生きている扱い
+            self.keys.done(key, tokens, getattr(e, "status", None), getattr(e, "retry_after", None),
+                           canceled=self.cancel_evt.is_set())
+            raise
+        except BaseException:
+            self.keys.done(key, tokens, canceled=True)
+            raise
+        used = ((data or {}).get("usageMetadata") or {}).get("totalTokenCount")
+        self.keys.done(key, tokens, used_tokens=used)
+        self._call.add_tokens(int(used or 0))
+        return data, cand
+
+    # ---- Gemini Batch（入力行の生成） ----
+    def _batch_request(self, img: "_ApiImage") -> tuple:
+        key = self._cache_key(img, None)
+        return key, self._build_payload(bool(self._call.options.keep_source), self._tile_image_for_api(img))
+
+    # ---- パック（複数画像 → 1 リクエスト） ----
+    def _translate_packed(self, imgs: list, max_n: int) -> List[TranslationResult]:
+        results: List[Optional[TranslationResult]] = [None] * len(imgs)
+        cache = self.tcache
+        ctx = self._cache_context(None)
+        pending = []
+        for i, img in enumerate(imgs):
+            hit = cache.get(self._cache_key(img, None, ctx)) if cache is not None else None
+            if hit is not None:
+                results[i] = TranslationResult(text=hit["ja"], source=hit["source"], cached=True)
+            else:
+                pending.append(i)
+        # タイル分割が要る縦長画像はパックに入れず、後段の 1 枚ずつの経路（タイル送信）に回す
+        fitted = {}
+        for i in pending:
+            tiles = self._tile_image_for_api(imgs[i])
+            if len(tiles) == 1:
+                fitted[i] = tiles[0]
+        # 枚数と送信サイズ（base64 込み）で詰める。1 枚で上限を超えるものは単独で送る
+        groups, cur, cur_bytes = [], [], 0
+        for i in fitted:
+            n = len(fitted[i].b64) + 64
+            if cur and (len(cur) >= max_n or cur_bytes + n > OST_PACK_MAX_BYTES):
+                groups.append(cur); cur, cur_bytes = [], 0
+            cur.append(i); cur_bytes += n
+        if cur:
+            groups.append(cur)
+        if DEBUG and groups: print(f"[OST] pack: {len(pending)} images -> {len(groups)} requests {[len(g) for g in groups]}")
+
+        def send(g: list) -> dict:
+            # 失敗したグループの画像だけを 1 枚ずつの経路に回す（ほかのグループで取れた訳は捨てない）
+            try:
+                return self._send_pack(g, fitted)
+            except Exception as e:
+                if self.cancel_evt.is_set():
+                    raise RuntimeError("canceled")
+                if DEBUG: print(f"[OST] pack: request for images {[i + 1 for i in g]} failed ({e}); sending them one by one")
+                return {}
+
+        got: Dict[int, tuple] = {}  # 画像番号 -> (source, ja, 秒, トークン)
+        call = self._call
+        if len(groups) > 1:
+            pool = ThreadPoolExecutor(max_workers=min(self._workers, len(groups)), thread_name_prefix="ost-pack")
+            try:
+                futs = [pool.submit(_run_in_call, call, send, g) for g in groups]
+                for f in futs:
+                    got.update(f.result())
+            finally:
+                pool.shutdown(wait=False, cancel_futures=True)
+        elif groups:
+            got.update(send(groups[0]))
+
+        for i in pending:
+            if i in got:
+                src, ja, sec, tok = got[i]
+                results[i] = TranslationResult(text=ja, source=src, seconds=sec, tokens=tok)
+                if cache is not None and _is_cacheable_result(ja):
+                    cache.put(self._cache_key(imgs[i], None, ctx), src, ja, ctx)
+                continue
+            # パックで取れなかった分は 1 枚ずつ（RECITATION の回避などは単発の経路に任せる）
+            if DEBUG: print(f"[OST] pack: image #{i + 1} falls back to a single request")
+            call.source = ""; tok0 = call.tokens; t0 = time.perf_counter()
+            text = self._call_gemini_cached(imgs[i], None)
+            results[i] = TranslationResult(text=text, source=call.source, cached=call.cached,
+                                           seconds=time.perf_counter() - t0, tokens=call.tokens - tok0)
+            call.cached = False
+        return results
+
+    def _pack_payload(self, imgs: list) -> dict:
+        keep_source = self._call.options.keep_source
+        n = len(imgs)
+        item = '{"index":番号,"source":"読み取った原文","ja":"自然な日本語訳"}' if keep_source else '{"index":番号,"ja":"自然な日本語訳"}'
+        prompt = (
+            "あなたはゲームUI/台詞の実務翻訳者です。"
+            f"以下の {n} 枚の画像はそれぞれ独立したスクリーンショットで、各画像の直前に [番号] を付けています。"
+            "画像ごとにテキストを正確に読み取り、日本語へ翻訳してください。" + self._persona_text() +
+            " 画像どうしの内容を混ぜないこと。原文の改行は可能な限り `ja` でも維持してください。"
+            f" 出力は番号順の JSON 配列のみ： [{item}, ...]（{n} 要素）。"
+            "文字が見つからない画像は source を空文字、ja を「（文字が見つかりません）」にしてください。"
+        )
+        parts = [{"text": prompt}]
+        for k, img in enumerate(imgs, 1):
+            parts.append({"text": f"[{k}]"})
+            parts.append(img.part())
+        props = {"index": {"type": "integer"}, "ja": {"type": "string"}}
+        required = ["index", "ja"]
+        if keep_source:
+            props["source"] = {"type": "string"}; required.insert(1, "source")
+        return {
+            "systemInstruction": {"role": "system", "parts": [{"text":
+                "あなたは複数の画像からテキストを抽出して日本語へ翻訳するエージェント。常に JSON 配列のみを返答する。"
+                "前置き・後置き・説明・コードフェンスは禁止。"}]},
+            "contents": [{"role": "user", "parts": parts}],
+            "generationConfig": {
+                "candidateCount": 1, "temperature": 0.2, "responseMimeType": "application/json",
+                "responseSchema": {"type": "array", "items": {"type": "object", "properties": props, "required": required}},
+            },
+            "safetySettings": [{"category": c, "threshold": "BLOCK_NONE"} for c in (
+                "HARM_CATEGORY_DANGEROUS_CONTENT", "HARM_CATEGORY_HARASSMENT",
+                "HARM_CATEGORY_HATE_SPEECH", "HARM_CATEGORY_SEXUALLY_EXPLICIT")],
+        }
+
+    def _send_pack(self, idxs: list, fitted: dict) -> Dict[int, tuple]:
+        """idxs の画像を 1 リクエストで訳して {画像番号: (source, ja, 秒, トークン)}。大きすぎる/まとめて停止したら半分に割る"""
+        if self.cancel_evt.is_set():
+            raise RuntimeError("canceled")
+        imgs = [fitted[i] for i in idxs]
+        body = json.dumps(self._pack_payload(imgs), ensure_ascii=False).encode("utf-8")
+
+        def split() -> Dict[int, tuple]:
+            half = len(idxs) // 2
+            if DEBUG: print(f"[OST] pack: splitting {len(idxs)} -> {half}+{len(idxs) - half}")
+            out = self._send_pack(idxs[:half], fitted); out.update(self._send_pack(idxs[half:], fitted))
+            return out
+
+        if len(body) > OST_PACK_MAX_BYTES and len(idxs) > 1:
+            return split()
+        tokens = sum(_image_tokens(img.size) for img in imgs) + _PROMPT_TOKENS_EST * len(imgs)
+        t0 = time.perf_counter()
+        try:
+            data, cand = self._retry_call(self._post_generate, body, tokens)
+        except _HttpStatusError as e:
+            # 送信サイズ超過（413 / 400 "payload size exceeds"）は割って送り直す
+            if len(idxs) > 1 and (e.status == 413 or (e.status == 400 and "size" in str(e).lower())):
+                return split()
+            raise
+        # グループは並列に走るので、使用量は call.tokens の差分ではなく応答から取る
+        sec = time.perf_counter() - t0; used = int(((data or {}).get("usageMetadata") or {}).get("totalTokenCount") or 0)
+        if not cand or cand.get("finishReason") not in (None, "STOP"):
+            return split() if len(idxs) > 1 else {}
+        raw = "".join(p.get("text", "") for p in ((cand.get("content") or {}).get("parts") or []) if isinstance(p, dict))
+        try:
+            arr = json.loads(raw.strip() or "[]")
+        except ValueError:
+            return split() if len(idxs) > 1 else {}
+        out = {}
+        for obj in arr if isinstance(arr, list) else []:
+            try:
+                k = int(obj.get("index"))
+            except (AttributeError, TypeError, ValueError):
+                continue
+            if 1 <= k <= len(idxs) and isinstance(obj.get("ja"), str):
+                ja = obj["ja"].strip() or "（文字が見つかりません）"
+                out[idxs[k - 1]] = ((obj.get("source") or "").strip(), ja, sec, used // len(idxs))
+        return out
+
+    def _persona_text(self) -> str:
+        persona = []
+        if self.speaker: persona.append(f"話者名は「{self.speaker}」。")
+        if self.tone:    persona.append(f"口調/文体は「{self.tone}」。")
+        return " ".join(persona) if persona else "話者/口調は特に指定なし。"
+
+    def _call_gemini_rest_once(self, main_img: "_ApiImage", speaker_img: Optional["_ApiImage"], memo: Optional[dict] = None) -> str:
+        # --- Strict JSON 出力 & 画像最適化（縦長の本文は行間で切って複数枚に） ---
+        memo = {} if memo is None else memo
+        main_img = _ApiImage.of(main_img)
+        if "tiles" not in memo:
+            memo["tiles"] = self._tile_image_for_api(main_img)
+            memo["speaker"] = self._fit_image_for_api(_ApiImage.of(speaker_img)) if speaker_img is not None else None
+        main_tiles = memo["tiles"]; speaker_img = memo["speaker"]
+
+        bodies = memo.setdefault("bodies", {})  # (request_source, 画像列) -> 送信 JSON。リトライ/再送ではシリアライズもやり直さない
+
+        def request_once(request_source: bool, imgs: list, stream: bool = False):
+            bkey = (request_source, tuple(id(img) for img in imgs))
+            body = bodies.get(bkey)
+            if body is None:
+                body = bodies[bkey] = json.dumps(self._build_payload(request_source, imgs, speaker_img),
+                                                 ensure_ascii=False).encode("utf-8")
+            tokens = sum(_image_tokens(img.size) for img in imgs) + _PROMPT_TOKENS_EST
+            if speaker_img is not None:
+                tokens += _image_tokens(speaker_img.size)
+            return self._post_generate(body, tokens, stream)
+
+        def slice_ja(cand2) -> str:
+            parts_out2 = (cand2.get("content") or {}).get("parts") or []
+            raw2 = ""
+            for p2 in parts_out2:
+                if isinstance(p2, dict) and "text" in p2 and p2["text"]:
+                    raw2 += p2["text"]
+            raw2 = (raw2 or "").strip()
+            try:
+                obj2 = json.loads(raw2) if raw2 else {}
+                if isinstance(obj2, dict) and "ja" in obj2:
+                    return (obj2.get("ja") or "").strip()
+                return ""
+            except Exception:
+                return raw2
+
+        def translate_slices() -> list:
+            """スライスを並行に『訳文のみ』で翻訳し、上から順の訳文リストを返す（空訳は除外）"""
+            from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+            if "slices" not in memo:
+                # 送信前に最適化（縦長ならさらにタイル化、それ以外は長辺を縮小）
+                memo["slices"] = [self._tile_image_for_api(sub) for sub in self._slice_image_vertical(main_img, OST_SLICE_PARTS)]
+            subs = memo["slices"]
+            got = memo.setdefault("slice_ja", {})  # 訳せたスライス。外側の _retry_call でやり直すときは送り直さない
+            def one(k, tiles):
+                if k in got:
+                    return got[k]
+                if self.cancel_evt.is_set():
+                    raise RuntimeError("canceled")
+                # 再試行は _call_gemini_rest_once を包む _retry_call の 1 段だけ（ここでも包むと最大 (N+1)^2 回送る）
+                _data2, cand2 = request_once(False, tiles)
+                got[k] = slice_ja(cand2) if cand2 else ""
+                return got[k]
+            pool = ThreadPoolExecutor(max_workers=min(OST_SLICE_WORKERS, len(subs)), thread_name_prefix="ost-slice")
+            call = self._call
+            try:
+                futs = [pool.submit(_run_in_call, call, one, k, sub) for k, sub in enumerate(subs)]
+                pending = set(futs)
+                while pending:
+                    done, pending = wait(pending, timeout=0.1, return_when=FIRST_EXCEPTION)
+                    if self.cancel_evt.is_set():
+                        raise RuntimeError("canceled")
+                    for f in done:
+                        if f.exception() is not None:
+                            raise f.exception()
+                return [j for j in (f.result() for f in futs) if j]
+            finally:
+                pool.shutdown(wait=False, cancel_futures=True)
+
+        # 1st attempt: request_source = options.keep_source
+        request_source = bool(self._call.options.keep_source)
+        data, cand = request_once(request_source, main_tiles, stream=self._call.options.stream)
+
+        # エラー/停止理由
+        if not cand:
+            pf = data.get("promptFeedback") or {}
+            return f"(空応答: {('blocked:'+str(pf)) if pf else str(data)[:400]})"
+
+        finish = cand.get("finishReason")
+
+        # RECITATION: もう一度、『訳文のみ』で再試行
+        if finish == "RECITATION" and request_source:
+            if OST_RECITATION_AUTO and OST_RECITATION_JA_RETRY:
+                self._status("（有名/既知の本文と判定され出力が停止されたため、訳文のみで再翻訳しています…）")
+                if DEBUG: print("[OST] recitation detected; retry with JA-only schema")
+                request_source = False
+                data, cand = request_once(request_source, main_tiles, stream=self._call.options.stream)
+                finish = cand.get("finishReason")
+            elif OST_SLICE_ON_RECITATION:
+                self._status("（有名/既知の本文と判定されたため、画像を分割して再翻訳しています…）")
+                if DEBUG: print("[OST] recitation detected; skip JA-only retry; slicing image")
+                ja_all = translate_slices()
+                if ja_all:
+                    self.last_source_text = ""
+                    return "".join(ja_all)
+                    
+        if finish and finish != "STOP":
+            # 最終手段: JA-onlyでさらにRECITATIONなら、画像を縦に分割して並行翻訳（意訳）
+            if finish == "RECITATION" and not request_source and OST_SLICE_ON_RECITATION:
+                self._status("（依然として出力が停止されたため、画像を分割して再翻訳しています…）")
+                if DEBUG: print("[OST] recitation again; slicing image and concatenating JA")
+                ja_all = translate_slices()
+                if ja_all:
+                    self.last_source_text = ""
+                    return "\n".join(ja_all)
+            # ここまで来たら素直に停止理由を返す
+            return f"(モデルが出力を停止: finishReason={finish} details={str(cand)[:300]})"
+
+        src, text = self._parse_reply(cand, request_source)
+        self.last_source_text = src
+        return text
+
+    def _build_payload(self, request_source: bool, imgs: list, speaker_img: Optional["_ApiImage"] = None) -> dict:
+        """request_source=True: {"source","ja"} / False: {"ja"} only。imgs は本文画像（上から順のタイル）"""
+        persona_str = self._persona_text()
+
+        constraint_text = (
+             " 出力は必ず1行のJSONのみ。前置き/後置き/解説/理由/箇条書き/Markdown/コードフェンス/引用符は禁止。"
+        ) if getattr(self, 'tone_mode', 'lite') == 'pro' else ""
+        if len(imgs) > 1:
+            constraint_text += f" 本文の画像は縦長の1枚を行間で上から順に{len(imgs)}枚へ分割したものです。続けて1つの文章として読んでください。"
+        hint_ref = "2枚目の画像" if len(imgs) == 1 else "「話者のヒント」の後の画像"
+
+        parts = []
+        if request_source:
+            prompt = (
+              "あなたはゲームUI/台詞の実務翻訳者です。画像からテキストを正確に読み取り、日本語に翻訳してください。"
+              + persona_str + constraint_text +
+              " 原文の改行（行区切り）は可能な限り維持し、同じ箇所で `ja` にも改行を入れてください。"
+              " 出力は必ず次のJSON文字列のみ："
+              ' {\"source\":\"OCRで認識した原文（読み取れた言語のまま）\",\"ja\":\"自然な日本語訳\"}  '
+              "。他の文字や説明は一切不要。読み取れない場合は source は空文字、ja は「（文字が見つかりません）」にしてください。"
+              f" {hint_ref}があれば話者のヒントとして参照してください。"
+            )
+        else:
+            prompt = (
+              "あなたはゲームUI/台詞の実務翻訳者です。画像から読めるテキストを正確に日本語へ翻訳してください。"
+              + persona_str + constraint_text +
+              " 原文の改行（行区切り）は可能な限り維持し、同じ箇所で `ja` にも改行を入れてください。"
+              " 出力は必ず次のJSON文字列のみ： {\"ja\":\"自然な日本語訳\"} 。他の文字や説明は一切不要。"
+            )
+        parts.append({ "text": prompt })
+        for img in imgs:
+            parts.append(img.part())  # base64 は画像ごとに 1 回だけ
+        if speaker_img is not None:
+            parts.append({ "text":"以下は話者のヒント（名前枠/立ち絵など）です。" })
+            parts.append(speaker_img.part())
+
+        if request_source:
+            sys_text = (
+                'あなたは画像からテキストを抽出して日本語へ翻訳するエージェント。'
+                '常に JSON のみを返答： {\"source\":\"原文\",\"ja\":\"日本語訳\"}。'
+                '前置き・後置き・説明・コードフェンスは禁止。キーは source と ja だけ。'
+            )
+            resp_schema = {
+                "type":"object",
+                "properties":{
+                    "source":{"type":"string"},
+                    "ja":{"type":"string"}
+                },
+                "required":["source","ja"]
+            }
+        else:
+            sys_text = (
+                'あなたは画像からテキストを読み取り日本語へ翻訳するエージェント。'
+                '常に JSON のみを返答： {\"ja\":\"日本語訳\"}。'
+                '前置きや後置き、コードフェンスは禁止。キーは ja のみ。'
+            )
+            resp_schema = {
+                "type":"object",
+                "properties":{"ja":{"type":"string"}},
+                "required":["ja"]
+            }
+
+        gen_cfg = {
+            "candidateCount": 1,
+            "temperature": 0.2,
+            "responseMimeType": "application/json",
+            "responseSchema": resp_schema
+        }
+        payload = {
+            "systemInstruction": {"role":"system","parts":[{"text": sys_text}]},
+            "contents": [{"role":"user","parts": parts}],
+            "generationConfig": gen_cfg,
+            "safetySettings": [
+                {"category":"HARM_CATEGORY_DANGEROUS_CONTENT","threshold":"BLOCK_NONE"},
+                {"category":"HARM_CATEGORY_HARASSMENT","threshold":"BLOCK_NONE"},
+                {"category":"HARM_CATEGORY_HATE_SPEECH","threshold":"BLOCK_NONE"},
+                {"category":"HARM_CATEGORY_SEXUALLY_EXPLICIT","threshold":"BLOCK_NONE"}
+            ],
+        }
+        return payload
+
+    def _parse_reply(self, cand: dict, request_source: bool) -> tuple:
+        """STOP で終わった候補から (原文, 表示する訳文)"""
+        # 本文取り出し
+        parts_out = (cand.get("content") or {}).get("parts") or []
+        raw = ""
+        for p in parts_out:
+            if isinstance(p, dict) and "text" in p and p["text"]:
+                raw += p["text"]
+        raw = (raw or "").strip()
+
+        # JSON parse
+        try:
+            obj = json.loads(raw) if raw else {}
+        except Exception:
+            obj = {}
+
+        if request_source:
+            # {"source","ja"} 期待
+            src = ""
+            ja = ""
+            if isinstance(obj, dict):
+                src = obj.get("source") or ""
+                ja  = obj.get("ja") or ""
+            else:
+                # 後方互換：旧パーサで救済
+                src, ja = self._extract_source_ja(raw)
+            src = (src or "").strip()
+            ja = (ja or "").strip()
+            if ja: return src, ja
+            if src: return src, src
+            return src, "（文字が見つかりません）"
+        else:
+            # {"ja"} 期待
+            if isinstance(obj, dict) and "ja" in obj:
+                ja = (obj.get("ja") or "").strip()
+                return "", ja if ja else "（文字が見つかりません）"
+            # JSONで無ければ raw テキストを返す
+            return "", raw if raw else "（文字が見つかりません）"
+
+    # ---- 訳文併記画像（保存） ----
+    def _find_ja_font(self, pt: int):
+        # よくある日本語フォントの探索（見つからなければデフォルト）
+        candidates = [
+            r"C:\Windows\Fonts\meiryo.ttc",
+            r"C:\Windows\Fonts\YuGothM.ttc",
+            r"C:\Windows\Fonts\msgothic.ttc",
+            "/System/Library/Fonts/Hiragino Sans W5.ttc",
+            "/Library/Fonts/Arial Unicode.ttf",
+            "/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc",
+            "/usr/share/fonts/truetype/noto/NotoSansJP-Regular.ttf",
+        ]
+        for p in candidates:
+            try:
+                if os.path.exists(p):
+                    return ImageFont.truetype(p, pt)
+            except Exception:
+                continue
+        return ImageFont.load_default()
+
+    def _wrap_lines(self, text: str, draw, font, max_w: int):
+        """
+        折り返しの厳密版:
+        - 改行は \n に正規化（\r\n / \r -> \n）
+        - 幅は textlength() を優先、無い環境は bbox の (right-left)
+        - 英文はスペース優先、CJK/長語は文字単位で折返し
+        """
+        import re  # モジュール先頭にあるなら不要
+
+        # normalize newlines
+        if text is None:
+            text = ""
+        else:
+            try:
+                text = str(text).replace("\r\n", "\n").replace("\r", "\n")
+            except Exception:
+                text = ""
+
+        def text_width(s: str) -> int:
+            try:
+                return draw.textlength(s, font=font)  # Pillow>=9
+            except Exception:
+                l, t, r, b = draw.textbbox((0, 0), s, font=font)
+                return r - l
+
+        lines = []
+        for para in text.splitlines():
+            # defensive: ensure each line is str
+            if not isinstance(para, str):
+                try:
+                    para = str(para)
+                except Exception:
+                    para = ""
+            if not para:
+                lines.append("")
+                continue
+
+            use_words = bool(re.search(r"[A-Za-z]", para) and " " in para)
+            tokens = para.split(" ") if use_words else list(para)
+
+            buf = ""
+            for t in tokens:
+                cand = buf + (" " if use_words and buf else "") + t
+                w = text_width(cand)
+                if w <= max_w or not buf:
+                    buf = cand
+                else:
+                    lines.append(buf)
+                    buf = t
+            if buf:
+                lines.append(buf)
+
+        return lines
+
+    def save_annotated(self, main_img, ja_text: str, src_text: str, include_source: bool,
+                       font_pt: int = DEFAULT_FONT_PT, out_path: Optional[str] = None) -> str:
+        """
+        captures/ に訳文（＋原文）を併記した画像を保存してパスを返す。font_pt は表示中の訳文欄の文字サイズ。
+        out_path を渡せばそこへ保存する（バッチ用）。
+        右帯(side)で表示しきれない場合は自動で bottom 方式にフォールバック。
+        折り返しは Pillow の textlength/bbox を使って正確に判定する。
+        """
+        from PIL import Image, ImageDraw
+
+        base = _ApiImage.of(main_img).image.convert("RGB")
+        W, H = base.size
+
+        layout = (ANN_LAYOUT or "auto").lower()
+        if layout not in ("auto","side","bottom"):
+            layout = "auto"
+        if layout == "auto":
+            ratio = H / max(1, W)
+            layout = "side" if ratio >= ANN_SIDE_THRESHOLD else "bottom"
+
+        # fonts
+        font_ja  = self._find_ja_font(ANN_FONT_JA_PT  if ANN_FONT_JA_PT  > 0 else max(14, font_pt + 2))
+        font_src = self._find_ja_font(ANN_FONT_SRC_PT if ANN_FONT_SRC_PT > 0 else max(12, font_pt))
+
+        # probe context for metrics
+        probe = Image.new("RGB", (10, 10))
+        d0 = ImageDraw.Draw(probe)
+
+        def _h(bb): return (bb[3]-bb[1]) if bb else 0
+        h_label_ja  = _h(d0.textbbox((0,0), "訳文", font=font_ja))
+        h_label_src = _h(d0.textbbox((0,0), "原文", font=font_src))
+        h_ja_line   = _h(d0.textbbox((0,0), "あAg", font=font_ja))
+        h_src_line  = _h(d0.textbbox((0,0), "あAg", font=font_src))
+
+        include_src_flag = include_source and bool((src_text or "").strip())
+
+        # helper for text width
+        def _tw(s, f): 
+            try:
+                return d0.textlength(s, font=f)
+            except Exception:
+                l,t,r,b = d0.textbbox((0,0), s, font=f); return r-l
+
+        def _wrap(text, f, max_w):
+            # robust wrapping with binary-search fallback
+            if text is None:
+                text = ""
+            try:
+            # 改行を \n に正規化（Windowsの \r\n / 古い \r を \n に）
+                text = str(text).replace("\r\n", "\n").replace("\r", "\n")
+            except Exception:
+                text = ""
+
+            out = []
+            for para in text.split("\n"):
+                if not para:
+                    out.append("")
+                    continue
+                i, n = 0, len(para)
+                while i < n:
+                    j = i + 1
+                    last_space = -1
+                    while j <= n:
+                        seg = para[i:j]
+                        w = _tw(seg, f)
+                        if w <= max_w:
+                            if seg and seg[-1].isspace():
+                                last_space = j - 1
+                            j += 1
+                        else:
+                            break
+                    if j > n and _tw(para[i:j], f) <= max_w:
+                        out.append(para[i:j]); i = j; continue
+                    if last_space > i:
+                        out.append(para[i:last_space].rstrip()); i = last_space + 1; continue
+                    # force break by binary-search
+                    lo, hi, best = i+1, n, i+1
+                    while lo <= hi:
+                        mid = (lo+hi)//2
+                        if _tw(para[i:mid], f) <= max_w:
+                            best = mid; lo = mid+1
+                        else:
+                            hi = mid-1
+                    out.append(para[i:best]); i = best
+            return out
 
-# 外置きパネル最小サイズ & ドラッグバー高
-PANEL_MIN_W = int(os.environ.get("OST_PANEL_MIN_W", "280"))
-PANEL_MIN_H = int(os.environ.get("OST_PANEL_MIN_H", "160"))
-PANEL_DRAG_BAR_H = int(os.environ.get("OST_PANEL_DRAG_BAR_H", "18"))
+        # ---- side layout (with overflow check) ----
+        if layout == "side":
+            side_w = max(120, ANN_SIDE_WIDTH_PX)
+            margin = ANN_MARGIN_PX
+            pad    = ANN_PAD_PX
+            gap    = ANN_GAP_PX
+            text_w = side_w - margin*2
 
-# 枠の初期表示（環境変数で制御可能）
-SHOW_MAIN_FRAME_DEFAULT    = os.environ.get("OST_SHOW_MAIN_FRAME", "1") == "1"
-SHOW_SPEAKER_FRAME_DEFAULT = os.environ.get("OST_SHOW_SPEAKER_FRAME", "1") == "1"
+            lines_src = _wrap(src_text or "", font_src, text_w) if include_src_flag else []
+            lines_ja  = _wrap(ja_text  or "", font_ja,  text_w)
 
-# 訳文欄の表示初期値
-SHOW_MSG_DEFAULT = os.environ.get("OST_MSG_VISIBLE", "1") == "1"
+            need_h = pad
+            if include_src_flag:
+                need_h += h_label_src + 6 + (len(lines_src) * (h_src_line + 2) - 2 if lines_src else 0) + gap
+            need_h += h_label_ja + 6 + (len(lines_ja) * (h_ja_line + 2) - 2 if lines_ja else 0) + pad
 
-# ROI 編集用ハンドル
-HANDLE_SIZE = int(os.environ.get("OST_HANDLE_SIZE", "12"))
-ROI_MIN_W   = int(os.environ.get("OST_ROI_MIN_W", "40"))
-ROI_MIN_H   = int(os.environ.get("OST_ROI_MIN_H", "30"))
-HANDLE_HOT  = int(os.environ.get("OST_HANDLE_HOT", "6"))  # 当たり判定の拡張
+            # フィットしなければ bottom に退避
+            if need_h > H:
+                layout = "bottom"
+            else:
+                canvas = Image.new("RGB", (W + side_w, H), (0,0,0))
+                canvas.paste(base, (0,0))
+                band = Image.new("RGBA", (side_w, H), (0,0,0,ANN_ALPHA))
+                canvas.paste(band, (W, 0), band)
 
-# Auto-Edit（直接ドラッグ）
-AUTO_EDIT           = os.environ.get("OST_ROI_AUTO_EDIT", "1") == "1"
-AUTO_EDIT_MOVE      = os.environ.get("OST_ROI_AUTO_MOVE", "0") == "1"  # 内部ドラッグ移動（既定OFF）
-BORDER_MOVE_ENABLE  = os.environ.get("OST_ROI_BORDER_MOVE", "1") == "1"  # 縁での移動（既定ON）
-MOVE_BAND           = int(os.environ.get("OST_MOVE_BAND", "8"))  # 縁の幅(px)
+                d = ImageDraw.Draw(canvas)
+                x = W + margin
+                y = pad
 
+                if include_src_flag:
+                    d.text((x, y), "原文", font=font_src, fill=(180,180,180)); y += h_label_src + 6
+                    for line in lines_src:
+                        d.text((x, y), line, font=font_src, fill=(210,210,210)); y += h_src_line + 2
+                    y += gap
 
-# --- Tone preset switching (Lite/Pro) ---
-OST_TONE_PRESET_MODE = os.environ.get("OST_TONE_PRESET_MODE", "lite").strip().lower()
-def _tone_preset_file_for_mode(mode: str) -> str:
-    base_dir = os.path.dirname(os.path.abspath(sys.argv[0]))
-    return os.path.join(base_dir, "ost_tone_presets_v2.json" if (mode or "").strip().lower()=="pro" else "ost_tone_presets.json")
+                d.text((x, y), "訳文", font=font_ja, fill=(235,235,235)); y += h_label_ja + 6
+                for line in lines_ja:
+                    d.text((x, y), line, font=font_ja, fill=(245,245,245)); y += h_ja_line + 2
 
-# --- Game-specific preset packs ---
-TONE_GAMES_DIR = os.environ.get("OST_TONE_GAMES_DIR", os.path.join(os.path.dirname(os.path.abspath(sys.argv[0])), "tone_games"))
-def _discover_tone_games() -> list:
-    try:
-        d = TONE_GAMES_DIR
-        if not os.path.isdir(d): return []
-        names = []
-        for name in sorted(os.listdir(d)):
-            p = os.path.join(d, name)
-            if not os.path.isdir(p): continue
-            lite = os.path.join(p, "ost_tone_presets.json")
-            pro  = os.path.join(p, "ost_tone_presets_v2.json")
-            if os.path.exists(lite) or os.path.exists(pro):
-                names.append(name)
-        return names
-    except Exception:
-        return []
+                out_path = out_path or _annotated_path("captures", include_src_flag, "side")
+                canvas.save(out_path, "PNG")
+                return out_path
 
-def _tone_preset_file_for_scope(mode: str, scope: str, game: str) -> str:
-    base_dir = os.path.dirname(os.path.abspath(sys.argv[0]))
-    if (scope or "").strip().lower()=="game" and (game or "").strip():
-        return os.path.join(TONE_GAMES_DIR, game.strip(), "ost_tone_presets_v2.json" if (mode or "").strip().lower()=="pro" else "ost_tone_presets.json")
-    return _tone_preset_file_for_mode(mode)
+        # ---- bottom layout (default or fallback) ----
+        margin = ANN_MARGIN_PX
+        pad    = ANN_PAD_PX
+        gap    = ANN_GAP_PX
+        text_w = W - margin*2
 
-TONE_PRESET_FILE = os.path.join(os.path.dirname(os.path.abspath(sys.argv[0])), "ost_tone_presets.json")
+        lines_src = _wrap(src_text or "", font_src, text_w) if include_src_flag else []
+        lines_ja  = _wrap(ja_text  or "", font_ja,  text_w)
 
-TONE_PRESETS_DEFAULT = {
-    "ツンデレのナビゲーション": "ツンデレのナビゲーション",
-    "ミステリアスな女性のナビゲーション": "ミステリアスな女性のナビゲーション",
-    "臆病な女性のナビゲーション": "オドオドした感じの臆病な女性のナビゲーション。"
-}
+        h_src = (len(lines_src) * (h_src_line + 2) - 2) if include_src_flag and lines_src else 0
+        h_ja  = (len(lines_ja)  * (h_ja_line  + 2) - 2) if lines_ja else 0
+
+        area_h = pad + (h_label_src + 6 + h_src + gap if include_src_flag else 0) + h_label_ja + 6 + h_ja + pad
+
+        canvas = Image.new("RGB", (W, H + area_h), (0,0,0))
+        canvas.paste(base, (0,0))
+        band = Image.new("RGBA", (W, area_h), (0,0,0,ANN_ALPHA))
+        canvas.paste(band, (0, H), band)
+
+        d = ImageDraw.Draw(canvas)
+        y = H + pad
+
+        if include_src_flag:
+            d.text((margin, y), "原文", font=font_src, fill=(180,180,180)); y += h_label_src + 6
+            for line in lines_src:
+                d.text((margin, y), line, font=font_src, fill=(210,210,210)); y += h_src_line + 2
+            y += gap
+
+        d.text((margin, y), "訳文", font=font_ja, fill=(235,235,235)); y += h_label_ja + 6
+        for line in lines_ja:
+            d.text((margin, y), line, font=font_ja, fill=(245,245,245)); y += h_ja_line + 2
+
+        out_path = out_path or _annotated_path("captures", include_src_flag, "bottom")
+        canvas.save(out_path, "PNG")
+        return out_path
 
 
 @dataclass
@@ -587,8 +3501,12 @@ class ControlPanel(QWidget):
         self.cb_speaker_show.toggled.connect(lambda v: overlay._hk(lambda: overlay._set_speaker_frame_visible(v)))
         self.cb_main_edit.toggled.connect(lambda v: overlay._hk(lambda: overlay._set_edit_main(v)))
         self.cb_speaker_edit.toggled.connect(lambda v: overlay._hk(lambda: overlay._set_edit_speaker(v)))
+        self.cb_watch = QCheckBox("自動翻訳 (Alt+W)")
+        self.cb_watch.setChecked(OST_WATCH)
+        self.cb_watch.toggled.connect(lambda v: overlay._hk(lambda: overlay._set_watch(v)))
         h1.addWidget(self.cb_main_show); h1.addWidget(self.cb_speaker_show)
         h1.addWidget(self.cb_main_edit); h1.addWidget(self.cb_speaker_edit)
+        h1.addWidget(self.cb_watch)
         lay.addLayout(h1)
 
         # 下段：訳文欄表示トグル/連結枚数/追従
@@ -616,8 +3534,7 @@ class ControlPanel(QWidget):
         self._apply_compact_style()
 
     def set_busy(self, b: bool):
-        self.btn_t.setDisabled(b); self.btn_c.setDisabled(b); self.btn_ca.setDisabled(b)
-        self.btn_cd.setDisabled(False)
+        # 翻訳/範囲/連結は応答待ちの間も受け付ける（ジョブとして順に処理）
         if hasattr(self, "btn_cancel"):
             self.btn_cancel.setEnabled(b)  # 応答中のみキャンセル可能
 
@@ -629,6 +3546,9 @@ class ControlPanel(QWidget):
         self.cb_main_show.setChecked(show_main); self.cb_speaker_show.setChecked(show_speaker)
         self.cb_main_show.blockSignals(False); self.cb_speaker_show.blockSignals(False)
 
+    def set_watch_state(self, on: bool):
+        self.cb_watch.blockSignals(True); self.cb_watch.setChecked(on); self.cb_watch.blockSignals(False)
+
     def set_edit_state(self, edit_main: bool, edit_speaker: bool):
         self.cb_main_edit.blockSignals(True); self.cb_speaker_edit.blockSignals(True)
         self.cb_main_edit.setChecked(edit_main); self.cb_speaker_edit.setChecked(edit_speaker)
@@ -659,26 +3579,6 @@ class ControlPanel(QWidget):
             e.ignore()
 
 class Overlay(QWidget):
-    # --- 画像を縦に分割してPNG配列で返す（最終手段の回避用） ---
-    def _slice_png_vertical(self, png_bytes: bytes, parts: int = 3) -> list[bytes]:
-        try:
-            from PIL import Image
-            import io
-            im = Image.open(io.BytesIO(png_bytes)).convert("RGB")
-            W, H = im.size
-            parts = max(2, int(parts))
-            slice_h = max(8, H // parts)
-            outs = []
-            top = 0
-            for i in range(parts):
-                bottom = H if i == parts-1 else min(H, top + slice_h)
-                crop = im.crop((0, top, W, bottom))
-                buf = io.BytesIO(); crop.save(buf, format="PNG"); outs.append(buf.getvalue())
-                top = bottom
-            return outs
-        except Exception:
-            return [png_bytes]
-
     def _text_width_px(self, draw, s, font):
         try:
             return draw.textlength(s, font=font)
@@ -689,28 +3589,6 @@ class Overlay(QWidget):
             except Exception:
                 return len(s) * 10
 
-    # --- API送信用にPNGを最適化（長辺を制限して再エンコード） ---
-    def _optimize_png_for_api(self, png_bytes: bytes) -> bytes:
-        try:
-            from PIL import Image
-            import io, os
-            lim = int(os.environ.get("OST_MAX_WH", "2048"))  # 長辺の上限。既定 2048px
-            if lim <= 0:
-                return png_bytes
-            im = Image.open(io.BytesIO(png_bytes))
-            w, h = im.size
-            m = max(w, h)
-            if m <= lim:
-                return png_bytes
-            scale = lim / float(m)
-            new_size = (max(1, int(w * scale)), max(1, int(h * scale)))
-            im = im.resize(new_size, Image.LANCZOS)
-            buf = io.BytesIO()
-            im.save(buf, format="PNG")
-            return buf.getvalue()
-        except Exception:
-            return png_bytes
-
     # --- ユーティリティ：パス配列を更新日時でソート（古い→新しい） ---
     def _sort_paths_by_mtime(self, paths, reverse: bool = False):
         try:
@@ -725,6 +3603,7 @@ class Overlay(QWidget):
     sig_apply_text = Signal(str)
     sig_set_busy   = Signal(bool)
     sig_concat_cnt = Signal(int)
+    sig_watch_fire = Signal()
 
     BORDER_COLOR = MAIN_BORDER_COLOR; BORDER_WIDTH = BORDER_WIDTH_PX
     SPEAKER_COLOR = SPEAKER_BORDER_COLOR
@@ -764,111 +3643,38 @@ class Overlay(QWidget):
         except Exception as e:
             if DEBUG: print("[OST] save tone presets failed:", e)
     
-    def _extract_source_ja(self, raw_text: str):
-        """
-        モデル出力の揺れ（```json フェンス、前後の説明文、JSONの前後ゴミ）に強いパーサ。
-        戻り値: (source, ja) どちらも str（見つからなければ ""）
-        """
-        import re, json
-
-        # Defensive: ensure raw_text is a string to avoid regex TypeError
-        if not isinstance(raw_text, str):
-            try:
-                raw_text = str(raw_text)
-            except Exception:
-                raw_text = ""
-
-        if not raw_text:
-            return "", ""
-
-        s = raw_text.strip()
-        # 追加: JSON抽出の強化（どこに出ても拾う）
-        try:
-            import json, re as _re2
-            # ```json ... ``` / ``` ... ``` ブロックを先に試す
-            for _m in _re2.finditer(r'```(?:json)?\s*(.*?)\s*```', s, _re2.DOTALL | _re2.IGNORECASE):
-                _blk = (_m.group(1) or "").strip()
-                if _blk:
-                    try:
-                        _obj = json.loads(_blk)
-                        _src = _obj.get("source") if isinstance(_obj, dict) else ""
-                        _ja  = _obj.get("ja")     if isinstance(_obj, dict) else ""
-                        if isinstance(_src, str) and isinstance(_ja, str):
-                            return _src, _ja
-                    except Exception:
-                        pass
-            # { ... } 断片を順に試す
-            for _m in _re2.finditer(r'\{.*?\}', s, _re2.DOTALL):
-                _frag = (_m.group(0) or "").strip()
-                if _frag:
-                    try:
-                        _obj = json.loads(_frag)
-                        _src = _obj.get("source") if isinstance(_obj, dict) else ""
-                        _ja  = _obj.get("ja")     if isinstance(_obj, dict) else ""
-                        if isinstance(_src, str) and isinstance(_ja, str):
-                            return _src, _ja
-                    except Exception:
-                        pass
-        except Exception:
-            pass
-
-
-        # 1) ```json ... ``` を除去
-        if s.startswith("```"):
-            lines = s.splitlines()
-            if lines and lines[0].startswith("```"):
-                lines = lines[1:]
-            if lines and lines[-1].strip().startswith("```"):
-                lines = lines[:-1]
-            s = "\n".join(lines).strip()
-
-        # 2) そのまま / { ... } だけを抜き出して JSON として読む
-        candidates = [s]
-        if "{" in s and "}" in s:
-            candidates.append(s[s.find("{"): s.rfind("}") + 1])
+    def trigger_cancel(self):
+        """待ち/実行中の翻訳ジョブをすべて取り消す（以後に返ってきた結果は無視）"""
+        self.jobs.cancel_all()  # 未配達が 0 になった時点で busy も落ちる
+        self.sig_apply_text.emit("（キャンセルしました）")
 
-        for cand in candidates:
-            try:
-                obj = json.loads(cand)
-                src = obj.get("source") or ""
-                ja  = obj.get("ja") or ""
-                if isinstance(src, str) and isinstance(ja, str):
-                    return src, ja
-            except Exception:
-                pass
+    # ---- ジョブごとの状態（ジョブのスレッドからは実行中ジョブのもの、UI からは最後に届いた結果のもの） ----
+    @property
+    def cancel_evt(self) -> threading.Event:
+        job = _current_job()
+        return job.cancel_evt if job is not None else self._cancel_evt
 
-        # 3) 正規表現で "source":"...","ja":"..." をゆるく抽出（' も許容）
-        m = re.search(
-            r'''source\s*:\s*(?P<q1>["'])(?P<src>.*?)(?P=q1)\s*,\s*ja\s*:\s*(?P<q2>["'])(?P<ja>.*?)(?P=q2)''',
-            s, re.IGNORECASE | re.DOTALL
-        )
-        if m:
-            def unescape(t: str) -> str:
-                try:
-                    return bytes(t, "utf-8").decode("unicode_escape")
-                except Exception:
-                    return t
-            return unescape(m.group("src")), unescape(m.group("ja"))
+    @property
+    def last_source_text(self) -> str:
+        job = _current_job()
+        return job.source if job is not None else self._last_source_text
+
+    @last_source_text.setter
+    def last_source_text(self, v: str):
+        job = _current_job()
+        if job is not None: job.source = v
+        else: self._last_source_text = v
 
-        # 4) どうしてもダメなら全文を「訳文」として返す（後方互換）
-        return "", s
 
-    def trigger_cancel(self):
-        """API呼び出し中の翻訳を論理キャンセル（以後の結果は無視）"""
-        # イベントを立てて、以後に返ってきたレスポンスは無視
-        self.cancel_evt.set()
-        # UIは即時にキャンセル表示・busy解除
-        self.sig_apply_text.emit("（キャンセルしました）")
-        self.sig_set_busy.emit(False)
-        
     def __init__(self):
         # Tone preset mode/scope
         self.tone_mode  = OST_TONE_PRESET_MODE or "lite"
         self.tone_scope = os.environ.get("OST_TONE_SCOPE","default").strip().lower() or "default"
         self.tone_game  = os.environ.get("OST_TONE_GAME","").strip()
         super().__init__(None, Qt.FramelessWindowHint | Qt.WindowStaysOnTopHint | Qt.Tool)
-        self.cancel_evt = threading.Event()
-        self.active_job_id = 0  # 実行中ジョブの連番
+        self._cancel_evt = threading.Event()  # ジョブ外から API を呼ぶとき用
+        self._last_source_text = ""
+        self.jobs = _JobScheduler(on_busy=self.sig_set_busy.emit)
         self.setAttribute(Qt.WA_TranslucentBackground, True); self.setMouseTracking(True)
 
         self.virtual_geom = self._virtual_geometry(); self.setGeometry(self.virtual_geom)
@@ -878,7 +3684,9 @@ class Overlay(QWidget):
 
         self._drag_start = QPoint(); self._drag_rect = QRect()
 
-        self.api_key: Optional[str] = (os.environ.get("GEMINI_API_KEY") or os.environ.get("GOOGLE_API_KEY"))
+        # 翻訳パイプライン（キープール/HTTP/キャッシュ込み）。Overlay は撮影と表示だけを受け持つ
+        self.engine = TranslationEngine().start()
+        self.api_key: Optional[str] = self.engine.keys.primary
 
         self.timer = QTimer(self); self.timer.timeout.connect(self._tick); self.timer.start(60)
 
@@ -934,7 +3742,10 @@ class Overlay(QWidget):
             self.ctrl_panel.show()
 
         # Concat buffer
-        self._concat_list: List[Image.Image] = []
+        self._concat = _ConcatCanvas()
+        self._concat_armed = False  # Alt+A を受け付けた（レーン側の追加完了前でも True）
+        # 画像レーン：撮影後の展開/前処理/連結を UI スレッド外で順番どおりに処理する
+        self._img_lane = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ost-img")
 
         # hotkeys
         self._install_hotkeys()
@@ -943,6 +3754,13 @@ class Overlay(QWidget):
         self.sig_apply_text.connect(self._on_apply_text)
         self.sig_set_busy.connect(self._on_set_busy)
         self.sig_concat_cnt.connect(self._on_concat_cnt_changed)
+        self.sig_watch_fire.connect(self._on_watch_fire)
+
+        # Watch（自動翻訳）
+        self._watcher: Optional[_RoiWatcher] = None
+        self._watch_region: Optional[dict] = None
+        self._watch_monitors = None
+        if OST_WATCH: self._set_watch(True)
 
         # poll
         self._prev: Dict[str,bool] = {}
@@ -967,30 +3785,6 @@ class Overlay(QWidget):
         self._hotkeys_off = False
         self._install_hotkeys()
         if DEBUG: print("[OST] hotkeys resumed")
-    def _apply_busy_hotkeys(self, busy: bool):
-        """
-        応答中(busy=True)はキャンセル(Alt+X)以外のホットキーを無効化し、
-        終了ホットキー(EXIT_HOTKEY)は従来どおり有効にします。
-        応答終了(busy=False)で通常のホットキーを再登録します。
-        """
-        try:
-            keyboard.unhook_all(); keyboard.clear_all_hotkeys()
-        except Exception:
-            pass
-        if busy:
-            try:
-                keyboard.add_hotkey('alt+x', lambda: self._hk(self.trigger_cancel))
-                # 終了ホットキーは許可しておく
-                keyboard.add_hotkey(EXIT_HOTKEY, lambda: self._hk(self._quit))
-                if DEBUG: print("[OST] busy hotkeys: only Cancel/Exit enabled")
-            except Exception as e:
-                if DEBUG: print("[OST] busy hotkeys failed:", e)
-        else:
-            # 通常ホットキーに戻す
-            self._install_hotkeys()
-            if DEBUG: print("[OST] hotkeys restored (non-busy)")
-
-
     def _install_hotkeys(self):
         if self._hotkeys_off: return
         try:
@@ -1023,6 +3817,7 @@ class Overlay(QWidget):
                 # Concat
                 keyboard.add_hotkey('alt+a', lambda: self._hk(self._concat_append))
                 keyboard.add_hotkey('alt+d', lambda: self._hk(self._concat_clear))
+                keyboard.add_hotkey('alt+w', lambda: self._hk(self._toggle_watch))
             keyboard.add_hotkey('alt+o', lambda: self._hk(self._open_images_and_translate))
             keyboard.add_hotkey('alt+shift+r', lambda: self._hk(self._retry_from_last_saved))
 
@@ -1106,7 +3901,7 @@ class Overlay(QWidget):
 
         # ヘルプ/状態
         header = "ALT+T:翻訳  ALT+C:範囲  R:Reader"
-        mode_text = f"  F5:CAPTURE={'FULL' if OST_CAPTURE_FULL else 'EXCLUDE'}  F6:HIDE={'ON' if OST_HIDE_ON_CAPTURE else 'OFF'}  F7:MSG={'OUT' if self.msg_outside else 'IN'}  ALT+Z:訳文欄表示={'ON' if self.show_msg else 'OFF'}  Exit:{EXIT_HOTKEY}"
+        mode_text = f"  F5:CAPTURE={'FULL' if OST_CAPTURE_FULL else 'EXCLUDE'}  F6:HIDE={'ON' if OST_HIDE_ON_CAPTURE else 'OFF'}  F7:MSG={'OUT' if self.msg_outside else 'IN'}  ALT+Z:訳文欄表示={'ON' if self.show_msg else 'OFF'}  ALT+W:自動={'ON' if self._watcher else 'OFF'}  Exit:{EXIT_HOTKEY}"
         gui_text = "  [GUI]" if self.gui_mode else ""
         hk_text = "  HK:GUI=ON" if self.gui_mode and self.gui_hotkeys else ""
         busy_text = f"    進行状況: 翻訳中{'.' * self.state.dots}" if self.state.busy else ""
@@ -1166,12 +3961,7 @@ class Overlay(QWidget):
 
     @Slot(bool)
     def _on_set_busy(self, b: bool):
-        self.state.busy = b
-        # 応答中はキャンセル以外のホットキーを無効化
-        try:
-            self._apply_busy_hotkeys(b)
-        except Exception:
-            pass
+        self.state.busy = b  # 未配達のジョブがある（翻訳中もホットキーはそのまま使える）
         if b:
             self.state.dots = 0
             if self.msg_outside and self.show_msg: self.msg_panel.set_text("翻訳中")
@@ -1554,314 +4344,85 @@ class Overlay(QWidget):
 
     # ---- Concat（連結） ----
     def _concat_append(self):
-        if self.state.busy or self._exiting: return
+        if self._exiting: return
+        t0 = time.perf_counter()
+        try:
+            shot, _ = self._snap_ui_thread(speaker=False)
+        except Exception as e:
+            self.sig_apply_text.emit(f"(連結追加に失敗: {e})"); return
+        self._concat_armed = True
+        self._img_lane.submit(self._concat_develop_append, self._concat, shot)
+        if DEBUG: print(f"[OST] ui stall (concat): {(time.perf_counter() - t0) * 1000:.1f}ms")
+
+    def _concat_develop_append(self, canvas: "_ConcatCanvas", shot):
+        """画像レーン側：展開/前処理 → 継ぎ足し判定 → プレビュー保存（canvas は Alt+A 時点の連結）"""
         try:
-            png = self._grab_roi_png_ui_thread()
-            im = Image.open(io.BytesIO(png))
-            im = im.convert(CONCAT_MODE_L) if CONCAT_MODE_L in ("L","RGB") else im.convert("L")
-            if len(self._concat_list) >= CONCAT_MAX: self._concat_list.pop(0)
-            self._concat_list.append(im)
-            self.sig_apply_text.emit(f"(連結に追加: {len(self._concat_list)}枚)")
-            self.sig_concat_cnt.emit(len(self._concat_list))
+            res = canvas.append(self._develop_shot(shot))
+            if res == "duplicate":
+                self.sig_apply_text.emit(f"(連結: 直前とほぼ同じ画面のため追加しません／{len(canvas)}枚)"); return
+            note = "／重なりを除いて継ぎ足し" if res == "stitched" else ""
+            self.sig_apply_text.emit(f"(連結に追加: {len(canvas)}枚{note})")
+            self.sig_concat_cnt.emit(len(canvas))
             if DEBUG or OST_SAVE_CAPTURE:
                 os.makedirs("captures", exist_ok=True)
-                self._save_concat_preview("captures/concat_current.png")
+                self._save_concat_preview("captures/concat_current.png", canvas)
         except Exception as e:
             self.sig_apply_text.emit(f"(連結追加に失敗: {e})")
 
     def _concat_clear(self):
-        self._concat_list.clear()
+        self._concat_armed = False
+        self._img_lane.submit(self._concat_clear_lane, self._concat)  # 処理待ちの Alt+A より後に消す
         self.sig_apply_text.emit("(連結をクリア)")
-        self.sig_concat_cnt.emit(0)
-        try:
-            p = "captures/concat_current.png"
-            if os.path.exists(p): os.remove(p)
-        except Exception: pass
-
-    def _save_concat_preview(self, path: str):
-        if not self._concat_list: return
-        png = self._build_concat_png()
-        with open(path, "wb") as f: f.write(png)
-
-    def _build_concat_png(self) -> bytes:
-        if not self._concat_list: raise RuntimeError("concat buffer is empty")
-        W = max(im.width for im in self._concat_list)
-        converted = []
-        for im in self._concat_list:
-            if im.width != W:
-                H = int(im.height * (W / im.width))
-                converted.append(im.resize((W, H), Image.BICUBIC))
-            else:
-                converted.append(im.copy())
-        total_h = sum(im.height for im in converted) + CONCAT_GAP_PX * (len(converted)-1)
-        mode = "L" if CONCAT_MODE_L == "L" else "RGB"
-        bg = 0 if mode == "L" else (0,0,0)
-        canvas = Image.new(mode, (W, total_h), bg)
-        y = 0
-        sep_color = 180 if mode == "L" else (180,180,180)
-        for i, im in enumerate(converted):
-            canvas.paste(im, (0, y)); y += im.height
-            if i != len(converted)-1 and CONCAT_GAP_PX > 0:
-                for yy in range(CONCAT_GAP_PX):
-                    for xx in range(W): canvas.putpixel((xx, y+yy), sep_color)
-                y += CONCAT_GAP_PX
-        buf = io.BytesIO(); canvas.save(buf, format="PNG"); return buf.getvalue()
-# ---- 訳文併記画像（保存） ----
-    def _find_ja_font(self, pt: int):
-        # よくある日本語フォントの探索（見つからなければデフォルト）
-        candidates = [
-            r"C:\Windows\Fonts\meiryo.ttc",
-            r"C:\Windows\Fonts\YuGothM.ttc",
-            r"C:\Windows\Fonts\msgothic.ttc",
-            "/System/Library/Fonts/Hiragino Sans W5.ttc",
-            "/Library/Fonts/Arial Unicode.ttf",
-            "/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc",
-            "/usr/share/fonts/truetype/noto/NotoSansJP-Regular.ttf",
-        ]
-        for p in candidates:
-            try:
-                if os.path.exists(p):
-                    return ImageFont.truetype(p, pt)
-            except Exception:
-                continue
-        return ImageFont.load_default()
-
-    def _wrap_lines(self, text: str, draw, font, max_w: int):
-        """
-        折り返しの厳密版:
-        - 改行は \n に正規化（\r\n / \r -> \n）
-        - 幅は textlength() を優先、無い環境は bbox の (right-left)
-        - 英文はスペース優先、CJK/長語は文字単位で折返し
-        """
-        import re  # モジュール先頭にあるなら不要
-
-        # normalize newlines
-        if text is None:
-            text = ""
-        else:
-            try:
-                text = str(text).replace("\r\n", "\n").replace("\r", "\n")
-            except Exception:
-                text = ""
-
-        def text_width(s: str) -> int:
-            try:
-                return draw.textlength(s, font=font)  # Pillow>=9
-            except Exception:
-                l, t, r, b = draw.textbbox((0, 0), s, font=font)
-                return r - l
-
-        lines = []
-        for para in text.splitlines():
-            # defensive: ensure each line is str
-            if not isinstance(para, str):
-                try:
-                    para = str(para)
-                except Exception:
-                    para = ""
-            if not para:
-                lines.append("")
-                continue
-
-            use_words = bool(re.search(r"[A-Za-z]", para) and " " in para)
-            tokens = para.split(" ") if use_words else list(para)
-
-            buf = ""
-            for t in tokens:
-                cand = buf + (" " if use_words and buf else "") + t
-                w = text_width(cand)
-                if w <= max_w or not buf:
-                    buf = cand
-                else:
-                    lines.append(buf)
-                    buf = t
-            if buf:
-                lines.append(buf)
-
-        return lines
-
-    def _build_and_save_annotated(self, main_img_png: bytes, ja_text: str, src_text: str, include_source: bool) -> str:
-        """
-        右帯(side)で表示しきれない場合は自動で bottom 方式にフォールバック。
-        折り返しは Pillow の textlength/bbox を使って正確に判定する。
-        """
-        from PIL import Image, ImageDraw
-        import io, os, time
-
-        base = Image.open(io.BytesIO(main_img_png)).convert("RGB")
-        W, H = base.size
-
-        layout = (ANN_LAYOUT or "auto").lower()
-        if layout not in ("auto","side","bottom"):
-            layout = "auto"
-        if layout == "auto":
-            ratio = H / max(1, W)
-            layout = "side" if ratio >= ANN_SIDE_THRESHOLD else "bottom"
-
-        # fonts
-        font_ja  = self._find_ja_font(ANN_FONT_JA_PT  if ANN_FONT_JA_PT  > 0 else max(14, self.font_pt + 2))
-        font_src = self._find_ja_font(ANN_FONT_SRC_PT if ANN_FONT_SRC_PT > 0 else max(12, self.font_pt))
-
-        # probe context for metrics
-        probe = Image.new("RGB", (10, 10))
-        d0 = ImageDraw.Draw(probe)
-
-        def _h(bb): return (bb[3]-bb[1]) if bb else 0
-        h_label_ja  = _h(d0.textbbox((0,0), "訳文", font=font_ja))
-        h_label_src = _h(d0.textbbox((0,0), "原文", font=font_src))
-        h_ja_line   = _h(d0.textbbox((0,0), "あAg", font=font_ja))
-        h_src_line  = _h(d0.textbbox((0,0), "あAg", font=font_src))
-
-        include_src_flag = include_source and bool((src_text or "").strip())
-
-        # helper for text width
-        def _tw(s, f): 
-            try:
-                return d0.textlength(s, font=f)
-            except Exception:
-                l,t,r,b = d0.textbbox((0,0), s, font=f); return r-l
-
-        def _wrap(text, f, max_w):
-            # robust wrapping with binary-search fallback
-            if text is None:
-                text = ""
-            try:
-            # 改行を \n に正規化（Windowsの \r\n / 古い \r を \n に）
-                text = str(text).replace("\r\n", "\n").replace("\r", "\n")
-            except Exception:
-                text = ""
-
-            out = []
-            for para in text.split("\n"):
-                if not para:
-                    out.append("")
-                    continue
-                i, n = 0, len(para)
-                while i < n:
-                    j = i + 1
-                    last_space = -1
-                    while j <= n:
-                        seg = para[i:j]
-                        w = _tw(seg, f)
-                        if w <= max_w:
-                            if seg and seg[-1].isspace():
-                                last_space = j - 1
-                            j += 1
-                        else:
-                            break
-                    if j > n and _tw(para[i:j], f) <= max_w:
-                        out.append(para[i:j]); i = j; continue
-                    if last_space > i:
-                        out.append(para[i:last_space].rstrip()); i = last_space + 1; continue
-                    # force break by binary-search
-                    lo, hi, best = i+1, n, i+1
-                    while lo <= hi:
-                        mid = (lo+hi)//2
-                        if _tw(para[i:mid], f) <= max_w:
-                            best = mid; lo = mid+1
-                        else:
-                            hi = mid-1
-                    out.append(para[i:best]); i = best
-            return out
-
-        # ---- side layout (with overflow check) ----
-        if layout == "side":
-            side_w = max(120, ANN_SIDE_WIDTH_PX)
-            margin = ANN_MARGIN_PX
-            pad    = ANN_PAD_PX
-            gap    = ANN_GAP_PX
-            text_w = side_w - margin*2
-
-            lines_src = _wrap(src_text or "", font_src, text_w) if include_src_flag else []
-            lines_ja  = _wrap(ja_text  or "", font_ja,  text_w)
-
-            need_h = pad
-            if include_src_flag:
-                need_h += h_label_src + 6 + (len(lines_src) * (h_src_line + 2) - 2 if lines_src else 0) + gap
-            need_h += h_label_ja + 6 + (len(lines_ja) * (h_ja_line + 2) - 2 if lines_ja else 0) + pad
-
-            # フィットしなければ bottom に退避
-            if need_h > H:
-                layout = "bottom"
-            else:
-                canvas = Image.new("RGB", (W + side_w, H), (0,0,0))
-                canvas.paste(base, (0,0))
-                band = Image.new("RGBA", (side_w, H), (0,0,0,ANN_ALPHA))
-                canvas.paste(band, (W, 0), band)
-
-                d = ImageDraw.Draw(canvas)
-                x = W + margin
-                y = pad
-
-                if include_src_flag:
-                    d.text((x, y), "原文", font=font_src, fill=(180,180,180)); y += h_label_src + 6
-                    for line in lines_src:
-                        d.text((x, y), line, font=font_src, fill=(210,210,210)); y += h_src_line + 2
-                    y += gap
-
-                d.text((x, y), "訳文", font=font_ja, fill=(235,235,235)); y += h_label_ja + 6
-                for line in lines_ja:
-                    d.text((x, y), line, font=font_ja, fill=(245,245,245)); y += h_ja_line + 2
-
-                os.makedirs("captures", exist_ok=True)
-                ts = time.strftime("%Y%m%d_%H%M%S"); ns = time.time_ns() % 1_000_000_000
-                kind = ("src_ja" if include_src_flag else "ja") + "_side"
-                out_path = os.path.join("captures", f"annotated_{kind}_{ts}_{ns:09d}.png")
-                canvas.save(out_path, "PNG")
-                return out_path
-
-        # ---- bottom layout (default or fallback) ----
-        margin = ANN_MARGIN_PX
-        pad    = ANN_PAD_PX
-        gap    = ANN_GAP_PX
-        text_w = W - margin*2
-
-        lines_src = _wrap(src_text or "", font_src, text_w) if include_src_flag else []
-        lines_ja  = _wrap(ja_text  or "", font_ja,  text_w)
-
-        h_src = (len(lines_src) * (h_src_line + 2) - 2) if include_src_flag and lines_src else 0
-        h_ja  = (len(lines_ja)  * (h_ja_line  + 2) - 2) if lines_ja else 0
-
-        area_h = pad + (h_label_src + 6 + h_src + gap if include_src_flag else 0) + h_label_ja + 6 + h_ja + pad
-
-        canvas = Image.new("RGB", (W, H + area_h), (0,0,0))
-        canvas.paste(base, (0,0))
-        band = Image.new("RGBA", (W, area_h), (0,0,0,ANN_ALPHA))
-        canvas.paste(band, (0, H), band)
-
-        d = ImageDraw.Draw(canvas)
-        y = H + pad
-
-        if include_src_flag:
-            d.text((margin, y), "原文", font=font_src, fill=(180,180,180)); y += h_label_src + 6
-            for line in lines_src:
-                d.text((margin, y), line, font=font_src, fill=(210,210,210)); y += h_src_line + 2
-            y += gap
-
-        d.text((margin, y), "訳文", font=font_ja, fill=(235,235,235)); y += h_label_ja + 6
-        for line in lines_ja:
-            d.text((margin, y), line, font=font_ja, fill=(245,245,245)); y += h_ja_line + 2
+        self.sig_concat_cnt.emit(0)
 
-        os.makedirs("captures", exist_ok=True)
-        ts = time.strftime("%Y%m%d_%H%M%S"); ns = time.time_ns() % 1_000_000_000
-        kind = ("src_ja" if include_src_flag else "ja") + "_bottom"
-        out_path = os.path.join("captures", f"annotated_{kind}_{ts}_{ns:09d}.png")
-        canvas.save(out_path, "PNG")
-        return out_path
+    def _concat_clear_lane(self, canvas: "_ConcatCanvas"):
+        canvas.clear()
+        try:
+            p = "captures/concat_current.png"
+            if os.path.exists(p): os.remove(p)
+        except Exception: pass
 
+    def _concat_detach(self) -> "_ConcatCanvas":
+        """翻訳に回す連結を切り離し、次の Alt+A 用に空の連結を用意する（UI スレッド）"""
+        canvas, self._concat, self._concat_armed = self._concat, _ConcatCanvas(), False
+        self._img_lane.submit(self._concat_archive_preview)  # 切り離した分の追加処理が済んでから
+        self.sig_concat_cnt.emit(0)
+        return canvas
 
+    def _concat_archive_preview(self):
+        # concat_current.png のリネーム保存（既存実装）
+        try:
+            p = "captures/concat_current.png"
+            if os.path.exists(p):
+                os.makedirs("captures", exist_ok=True)
+                ts = time.strftime("%Y%m%d_%H%M%S"); ns = time.time_ns() % 1_000_000_000
+                newp = os.path.join("captures", f"concat_{ts}_{ns:09d}.png")
+                try: os.replace(p, newp)
+                except Exception:
+                    import shutil; shutil.copy2(p, newp); os.remove(p)
+        except Exception as ee:
+            if DEBUG: print("[OST] concat rename failed:", ee)
+
+    def _save_concat_preview(self, path: str, canvas: Optional["_ConcatCanvas"] = None):
+        canvas = self._concat if canvas is None else canvas
+        if not canvas: return
+        # プレビューは確認用なので速さ優先の圧縮で
+        canvas.image().save(path, format="PNG", compress_level=1)
+
+    def _build_concat_image(self) -> Image.Image:
+        return self._concat.image()
     def save_annotated_image(self, include_source: bool = False):
         # 直近の翻訳に使った画像＋訳文（＋原文）で併記画像を保存
-        if not getattr(self, "_last_main_img_png", None):
+        if getattr(self, "_last_main_img", None) is None:
             # 直近のROIを取り直して代用（厳密に同一でなくてOKなら）
             try:
-                self._last_main_img_png = self._grab_roi_png_ui_thread()
+                self._last_main_img = _ApiImage(im=self._grab_roi_image_ui_thread())
             except Exception:
                 self.sig_apply_text.emit("(保存失敗: 直近の画像が見つかりません)"); return
         ja = self.state.translated_text or ""
         src = getattr(self, "last_source_text", "")
         try:
-            path = self._build_and_save_annotated(self._last_main_img_png, ja, src, include_source)
+            path = self.engine.save_annotated(self._last_main_img, ja, src, include_source, font_pt=self.font_pt)
             self.sig_apply_text.emit(f"(画像を保存しました: {os.path.basename(path)})")
         except Exception as e:
             self.sig_apply_text.emit(f"(保存に失敗: {e})")
@@ -1903,116 +4464,74 @@ class Overlay(QWidget):
             paths = self._sort_paths_by_mtime(list(paths), reverse=False)
         except Exception:
             pass
-        if self.state.busy or self._exiting:
-            self.sig_apply_text.emit("(実行中のため受け付けません)")
+        if self._exiting:
             return
         try:
-            from PIL import Image, ImageEnhance
-            import io, os
-            imgs = []
+            from PIL import Image
+            import os
+            imgs = []; names = []
             for fp in paths:
                 if not os.path.exists(fp):
                     continue
                 im = Image.open(fp)
                 im = im.convert("RGB")
                 if OST_PREPROCESS:
-                    im = im.convert("L")
-                    im = ImageEnhance.Brightness(im).enhance(1.12)
-                    im = ImageEnhance.Contrast(im).enhance(1.32)
-                    im = ImageEnhance.Sharpness(im).enhance(1.1)
+                    im = _preprocess_for_ocr(im)
                 elif CONCAT_MODE_L in ("L","RGB"):
                     im = im.convert(CONCAT_MODE_L)
-                imgs.append(im)
+                imgs.append(im); names.append(os.path.basename(fp))
             if not imgs:
                 self.sig_apply_text.emit("(有効な画像が見つかりません)")
                 return
 
-            # 1枚→そのまま / 複数→縦連結
+            # OST_PACK=1：連結せず、別々の画像として 1 リクエストに載せて 1 枚ずつ訳す
+            if OST_PACK and len(imgs) > 1:
+                if not self.api_key:
+                    self.sig_apply_text.emit("（APIキー未設定：GEMINI_API_KEY または GOOGLE_API_KEY を設定してください）")
+                    return
+                if self._submit_translation(self._job_translate_packed, [_ApiImage(im=im) for im in imgs], names,
+                                            priority=JOB_BATCH) is not None:
+                    self.sig_apply_text.emit(f"(画像 {len(imgs)} 枚をまとめて翻訳)")
+                return
+
+            # 1枚→そのまま / 複数→縦連結（PNG 化は送信時に 1 回だけ）
             if len(imgs) == 1:
-                buf = io.BytesIO()
-                imgs[0].save(buf, format="PNG")
-                main_png = buf.getvalue()
+                main_im = imgs[0]
             else:
-                W = max(im.width for im in imgs)
-                converted = []
+                canvas = _ConcatCanvas(max_frames=len(imgs))
                 for im in imgs:
-                    if im.width != W:
-                        H = int(im.height * (W / im.width))
-                        converted.append(im.resize((W, H), Image.BICUBIC))
-                    else:
-                        converted.append(im.copy())
-                total_h = sum(im.height for im in converted) + CONCAT_GAP_PX * (len(converted) - 1)
-                mode = "L" if CONCAT_MODE_L == "L" else "RGB"
-                bg = 0 if mode == "L" else (0, 0, 0)
-                canvas = Image.new(mode, (W, total_h), bg)
-                y = 0
-                sep_color = 180 if mode == "L" else (180, 180, 180)
-                for i, im in enumerate(converted):
-                    canvas.paste(im, (0, y)); y += im.height
-                    if i != len(converted) - 1 and CONCAT_GAP_PX > 0:
-                        for yy in range(CONCAT_GAP_PX):
-                            for xx in range(W):
-                                canvas.putpixel((xx, y + yy), sep_color)
-                        y += CONCAT_GAP_PX
-                buf = io.BytesIO()
-                canvas.save(buf, format="PNG")
-                main_png = buf.getvalue()
-
-            self._start_translation_with_images(main_png, None, note="(画像から翻訳)")
+                    canvas.append(im)
+                main_im = canvas.image()
+
+            self._start_translation_with_images(main_im, None, note="(画像から翻訳)")
         except Exception as e:
             self.sig_apply_text.emit(f"(画像読み込みに失敗: {e})")
 
     # ---- 直渡し画像で翻訳（キャプチャを使わず） ----
-    def _start_translation_with_images(self, main_img_png: bytes, speaker_img_png: Optional[bytes], note: str = "") -> None:
-        if self.state.busy or self._exiting:
-            return
+    def _start_translation_with_images(self, main_img, speaker_img=None, note: str = "",
+                                       priority: int = JOB_BATCH) -> Optional[_Job]:
+        """main_img/speaker_img は PNG バイト列 / PIL 画像 / _ApiImage のいずれでもよい。
+        画像ファイル/再翻訳は後回しでよいので既定はバッチ優先度（キャプチャが先に処理される）"""
+        if self._exiting:
+            return None
         if not self.api_key:
             self.sig_apply_text.emit("（APIキー未設定：GEMINI_API_KEY または GOOGLE_API_KEY を設定してください）")
-            return
-
-        self.cancel_evt.clear()
-        self.active_job_id += 1
-        job_id = self.active_job_id
-        self.sig_set_busy.emit(True)
-        self._last_main_img_png = main_img_png  # 注釈保存で使用
-
-        def worker(mi, si, jid):
-            try:
-                if self.cancel_evt.is_set() or jid != self.active_job_id:
-                    return
-                text = self._call_gemini_rest_with_retry(mi, si)
-                if self.cancel_evt.is_set() or jid != self.active_job_id:
-                    return
-                self.sig_apply_text.emit(text if text else "（文字が見つかりません）")
-                if OST_SAVE_ANNOTATED:
-                    try:
-                        self._build_and_save_annotated(self._last_main_img_png, text, getattr(self, "last_source_text", ""), OST_ANN_INCLUDE_SRC)
-                    except Exception as e:
-                        if DEBUG:
-                            print("[OST] annotated save failed:", e)
-                            import traceback
-                            print(traceback.format_exc(limit=2))
-                        import traceback
-                        self.sig_apply_text.emit(f"（翻訳に失敗しました: {e}\\n{traceback.format_exc(limit=2)}）")
-            finally:
-                self._concat_list.clear()
-                self.sig_concat_cnt.emit(0)
-                self.sig_set_busy.emit(False)
-
-        import threading
-        threading.Thread(target=worker, args=(main_img_png, speaker_img_png, job_id), daemon=True).start()
-        if note:
+            return None
+        job = self._submit_translation(self._job_translate, _ApiImage.of(main_img), _ApiImage.of(speaker_img),
+                                       priority=priority)
+        if job is not None and note:
             self.sig_apply_text.emit(note)
+        return job
 
     # ---- 直近の保存ファイルから再翻訳 ----
     def _retry_from_last_saved(self):
-        if self.state.busy or self._exiting:
+        if self._exiting:
             return
         cap_dir = "captures"
         try:
             latest_main = None; latest_mtime = -1.0
             latest_concat = None; latest_concat_mtime = -1.0
-            import os, io, re
+            import os, re
             if os.path.isdir(cap_dir):
                 for fn in os.listdir(cap_dir):
                     fp = os.path.join(cap_dir, fn)
@@ -2053,86 +4572,140 @@ class Overlay(QWidget):
             self.sig_apply_text.emit(f"(再翻訳に失敗: {e})")
     # ---- 翻訳 ----
     def trigger_translate(self):
-        if self.state.busy or self._exiting: return
+        if self._exiting: return
         if not self.api_key:
             self.sig_apply_text.emit("（APIキー未設定：GEMINI_API_KEY または GOOGLE_API_KEY を設定してください）"); return
 
-        # ★ ジョブ開始：キャンセル状態をクリア＆ジョブID採番
-        self.cancel_evt.clear()
-        self.active_job_id += 1
-        job_id = self.active_job_id
-
-        self.sig_set_busy.emit(True)
+        # UI スレッドでは撮影（非表示→grab→復帰）だけ。展開/前処理/連結画像/エンコードはジョブ側
+        t0 = time.perf_counter()
         try:
-            use_concat = bool(self._concat_list)
-            main_img = self._build_concat_png() if self._concat_list else self._grab_roi_png_ui_thread()
-            # 直近の送信用画像を保持（注釈保存に使用）
-            self._last_main_img_png = main_img
-            sp_img = self._grab_speaker_roi_png_ui_thread() if self.speaker_roi else None
-            if (OST_SAVE_CAPTURE or DEBUG) and not use_concat:
-                os.makedirs("captures", exist_ok=True)
-                ts = time.strftime("%Y%m%d_%H%M%S"); ns = time.time_ns() % 1_000_000_000
-                with open(os.path.join("captures", f"used_main_{ts}_{ns:09d}.png"), "wb") as f: f.write(main_img)
-                if sp_img:
-                    with open(os.path.join("captures", f"used_speaker_{ts}_{ns:09d}.png"), "wb") as f: f.write(sp_img)
+            use_concat = self._concat_armed
+            main_shot, sp_shot = self._snap_ui_thread(main=not use_concat)
         except Exception as e:
-            self.sig_set_busy.emit(False); self.sig_apply_text.emit(f"(キャプチャ失敗: {e})"); return
-
-        def worker(mi, si, jid):
+            self.sig_apply_text.emit(f"(キャプチャ失敗: {e})"); return
+        # 前のジョブが翻訳中でもキューに積む（結果はキャプチャ順に表示）
+        job = self._submit_translation(self._job_translate_shots, main_shot, sp_shot,
+                                       self._concat if use_concat else None)
+        # 連結は受け付けられたときだけ切り離す（待ちが一杯で断られたら Alt+A の分をそのまま残す）。
+        # どちらも UI スレッドなので、その間に Alt+A が割り込むことはない
+        if job is not None and use_concat:
+            self._concat_detach()
+        if DEBUG: print(f"[OST] ui stall (translate): {(time.perf_counter() - t0) * 1000:.1f}ms")
+
+    def _submit_translation(self, fn, *args, priority: int = JOB_INTERACTIVE) -> Optional[_Job]:
+        job = self.jobs.submit(fn, *args, priority=priority, on_done=self._deliver_translation)
+        if job is None:
+            self.sig_apply_text.emit(f"(待ちが {OST_JOB_QUEUE_MAX} 件あるため受け付けません)")
+        elif DEBUG:
+            print(f"[OST] job #{job.id} queued (priority={priority}, pending={len(self.jobs)})")
+        return job
+
+    def _job_translate_shots(self, main_shot, sp_shot, canvas) -> tuple:
+        mi, si = self._develop_for_send(main_shot, sp_shot, canvas)
+        return self._job_translate(mi, si)
+
+    def _job_translate(self, mi: "_ApiImage", si: Optional["_ApiImage"]) -> tuple:
+        """ジョブ本体：(訳文, 送信した本文画像, 注釈保存のエラー or None)"""
+        res = self.engine.translate(mi, self._translate_options(), speaker_image=si, cancel_evt=self.cancel_evt,
+                                    on_partial=self._on_partial_text, on_status=self.sig_apply_text.emit)
+        text = res.text; self.last_source_text = res.source
+        ann_err = None
+        # 自動保存（環境変数で有効化）。描画は重いのでジョブ側で
+        if OST_SAVE_ANNOTATED and not self.cancel_evt.is_set():
             try:
-                # ★ 送信用直前にもキャンセル確認
-                if self.cancel_evt.is_set() or jid != self.active_job_id:
-                    return
-                text = self._call_gemini_rest_with_retry(mi, si)
-
-                # ★ 応答後（UIに反映する前）にキャンセル/ジョブ不一致を確認
-                if self.cancel_evt.is_set() or jid != self.active_job_id:
-                    return
-
-                self.sig_apply_text.emit(text if text else "（文字が見つかりません）")
-                # 自動保存（環境変数で有効化）
-                if OST_SAVE_ANNOTATED:
-                    try:
-                        self._build_and_save_annotated(self._last_main_img_png, text, getattr(self, "last_source_text", ""), OST_ANN_INCLUDE_SRC)
-                    except Exception as e:
-                        if DEBUG:
-                            print("[OST] annotated save failed:", e)
-                            import traceback
-                            print(traceback.format_exc(limit=2))
-                         # ユーザーにも通知
-                        import traceback
-                        self.sig_apply_text.emit(f"（翻訳に失敗しました: {e}\n{traceback.format_exc(limit=2)}）")
-            finally:
-                # 連結バッファのクリアとカウンタ更新
-                self._concat_list.clear()
-                self.sig_concat_cnt.emit(0)
-                # concat_current.png のリネーム保存（既存実装）
-                try:
-                    p = "captures/concat_current.png"
-                    if os.path.exists(p):
-                        os.makedirs("captures", exist_ok=True)
-                        ts = time.strftime("%Y%m%d_%H%M%S"); ns = time.time_ns() % 1_000_000_000
-                        newp = os.path.join("captures", f"concat_{ts}_{ns:09d}.png")
-                        try: os.replace(p, newp)
-                        except Exception:
-                            import shutil; shutil.copy2(p, newp); os.remove(p)
-                except Exception as ee:
-                    if DEBUG: print("[OST] concat rename failed:", ee)
-
-                # ★busyは「キャンセル済みでも」必ず落とす
-                self.sig_set_busy.emit(False)
-
-        threading.Thread(target=worker, args=(main_img, sp_img, job_id), daemon=True).start()
+                self.engine.save_annotated(mi, text, res.source, OST_ANN_INCLUDE_SRC, font_pt=self.font_pt)
+            except Exception as e:
+                if DEBUG:
+                    print("[OST] annotated save failed:", e)
+                import traceback
+                ann_err = f"{e}\n{traceback.format_exc(limit=2)}"
+        return text, mi, ann_err
+
+    def _job_translate_packed(self, imgs: list, names: list) -> tuple:
+        """ジョブ本体（OST_PACK）：ファイルごとの訳を【ファイル名】見出し付きで並べる"""
+        results = self.engine.translate_many(imgs, self._translate_options(), cancel_evt=self.cancel_evt,
+                                             on_status=self.sig_apply_text.emit)
+        text = "\n\n".join(f"【{n}】\n{r.text}" for n, r in zip(names, results))
+        self.last_source_text = "\n\n".join(f"【{n}】\n{r.source}" for n, r in zip(names, results) if r.source)
+        ann_err = None
+        if OST_SAVE_ANNOTATED and not self.cancel_evt.is_set():
+            try:
+                for mi, r in zip(imgs, results):
+                    self.engine.save_annotated(mi, r.text, r.source, OST_ANN_INCLUDE_SRC, font_pt=self.font_pt)
+            except Exception as e:
+                if DEBUG:
+                    print("[OST] annotated save failed:", e)
+                ann_err = str(e)
+        # 訳文が 1 枚の画像に対応しないので送信画像は残さない（手動の注釈保存は ROI を撮り直す）
+        return text, None, ann_err
+
+    def _deliver_translation(self, job: _Job):
+        """同じ優先度の先行ジョブが届いた後に、キャプチャ順で呼ばれる"""
+        if job.error is not None:
+            if str(job.error) != "canceled":
+                self.sig_apply_text.emit(f"（翻訳に失敗しました: {job.error}）")
+            return
+        text, mi, ann_err = job.result
+        # 直近の送信用画像/原文を保持（注釈保存・原文コピーに使用）
+        self._last_main_img = mi; self._last_source_text = job.source
+        self.sig_apply_text.emit(text if text else "（文字が見つかりません）")
+        if ann_err:
+            # ユーザーにも通知
+            self.sig_apply_text.emit(f"（翻訳に失敗しました: {ann_err}）")
+
+    def _develop_for_send(self, main_shot, sp_shot, canvas: Optional["_ConcatCanvas"] = None) -> tuple:
+        """ジョブ側：撮影済みショット（または切り離した連結）を送信用の (_ApiImage, _ApiImage|None) にする"""
+        if canvas is not None:
+            # 画像レーン経由で組むので、先に押された Alt+A の追加処理を待ってから連結する
+            main_im = self._img_lane.submit(canvas.image).result()
+        else:
+            main_im = self._develop_shot(main_shot)
+        # PIL 画像のまま渡す（PNG/base64 化は送信時に 1 回だけ）
+        main_img = _ApiImage(im=main_im)
+        sp_img = _ApiImage.of(self._develop_shot(sp_shot))
+        if (OST_SAVE_CAPTURE or DEBUG) and canvas is None:
+            os.makedirs("captures", exist_ok=True)
+            ts = time.strftime("%Y%m%d_%H%M%S"); ns = time.time_ns() % 1_000_000_000
+            with open(os.path.join("captures", f"used_main_{ts}_{ns:09d}.png"), "wb") as f: f.write(main_img.png)
+            if sp_img is not None:
+                with open(os.path.join("captures", f"used_speaker_{ts}_{ns:09d}.png"), "wb") as f: f.write(sp_img.png)
+        return main_img, sp_img
 
     # ---- キャプチャ ----
-    def _grab_roi_png_ui_thread(self) -> bytes:
+    def _capture_rect(self) -> QRect:
+        """キャプチャ対象（CAPTURE=EXCLUDE なら訳文欄より上だけ）"""
         roi = QRect(self.state.roi)
         if OST_CAPTURE_FULL:
-            cap = QRect(roi)
-        else:
-            text_rect = self._text_rect_inside_roi(roi)
-            cap = QRect(roi.left(), roi.top(), roi.width(), max(1, text_rect.top() - 6 - roi.top()))
+            return roi
+        text_rect = self._text_rect_inside_roi(roi)
+        return QRect(roi.left(), roi.top(), roi.width(), max(1, text_rect.top() - 6 - roi.top()))
+
+    def _physical_scale(self, r: QRect, monitors) -> tuple:
+        """Qt 論理座標 → mss 物理ピクセルの (倍率X, 倍率Y, 原点X, 原点Y)"""
+        if OST_PRIMARY_ONLY:
+            # メイン画面（Qt 論理座標）→ mss の物理ピクセルへ変換
+            ps_geo = QGuiApplication.primaryScreen().geometry()
+            idx = max(1, min(OST_MON_INDEX, len(monitors) - 1))
+            mon = monitors[idx]  # 物理px: left/top/width/height
+            # 論理(DIP)→物理(px)の倍率（X/Y で別々に算出）
+            return mon["width"] / ps_geo.width(), mon["height"] / ps_geo.height(), mon["left"], mon["top"]
+        # 従来の全画面モード（混在DPI環境ではズレる可能性あり）
+        scale = self._screen_scale_for_point(self.mapToGlobal(r.center()))
+        return scale, scale, 0, 0
+
+    def _physical_region(self, r: QRect, monitors) -> dict:
+        """Qt 論理座標の矩形 → mss の物理ピクセル領域（monitors は sct.monitors）"""
+        sx, sy, ox, oy = self._physical_scale(r, monitors)
+        return {
+            "left":   ox + int(r.left() * sx),
+            "top":    oy + int(r.top()  * sy),
+            "width":  max(1, int(r.width()  * sx)),
+            "height": max(1, int(r.height() * sy)),
+        }
 
+    # ---- キャプチャ（オーバーレイの非表示/復帰は 1 トランザクションにつき 1 回） ----
+    def _capture_rects_ui_thread(self, rects) -> list:
+        """論理座標の矩形群を 1 回の非表示で撮り、同じ順の [(フレーム, 切り出し box), ...] で返す（展開はしない）"""
         # オーバーレイ等を一時的に透明化
         old_opacity = None; panel_old_opacity = None; msg_old_opacity = None
         if OST_HIDE_ON_CAPTURE or self.msg_outside:
@@ -2144,367 +4717,115 @@ class Overlay(QWidget):
             QGuiApplication.processEvents(); QThread.msleep(16)
 
         try:
-            with mss.mss() as sct:
-                if OST_PRIMARY_ONLY:
-                    # メイン画面（Qt 論理座標）→ mss の物理ピクセルへ変換
-                    ps = QGuiApplication.primaryScreen()
-                    ps_geo = ps.geometry()
-                    idx = max(1, min(OST_MON_INDEX, len(sct.monitors) - 1))
-                    mon = sct.monitors[idx]  # 物理px: left/top/width/height
-
-                    # 論理(DIP)→物理(px)の倍率（X/Y で別々に算出）
-                    scale_x = mon["width"]  / ps_geo.width()
-                    scale_y = mon["height"] / ps_geo.height()
-
-                    region = {
-                        "left":   mon["left"] + int(cap.left()   * scale_x),
-                        "top":    mon["top"]  + int(cap.top()    * scale_y),
-                        "width":  max(1, int(cap.width()  * scale_x)),
-                        "height": max(1, int(cap.height() * scale_y)),
-                    }
-                else:
-                    # 従来の全画面モード（混在DPI環境ではズレる可能性あり）
-                    global_center = self.mapToGlobal(cap.center())
-                    scale = self._screen_scale_for_point(global_center)
-                    region = {
-                        "left":   int(cap.left()   * scale),
-                        "top":    int(cap.top()    * scale),
-                        "width":  max(1, int(cap.width()  * scale)),
-                        "height": max(1, int(cap.height() * scale)),
-                    }
-
-                shot = sct.grab(region)
-                img = Image.frombytes("RGB", (shot.width, shot.height), shot.rgb)
-
+            sct = _capture_session()
+            return _grab_regions(sct, [self._physical_region(r, sct.monitors) for r in rects])
         finally:
             if old_opacity is not None: self.setWindowOpacity(old_opacity)
             if panel_old_opacity is not None and self.ctrl_panel: self.ctrl_panel.setWindowOpacity(panel_old_opacity)
             if msg_old_opacity is not None and self.msg_panel: self.msg_panel.setWindowOpacity(msg_old_opacity)
             QGuiApplication.processEvents()
 
+    def _main_capture_plan(self) -> tuple:
+        """(キャプチャ矩形, 展開後の画像に掛ける仕上げ)。仕上げは撮影時点の設定で固定してワーカーへ渡す"""
+        return self._capture_rect(), self._finish_main_capture
+
+    def _snap_ui_thread(self, main: bool = True, speaker: bool = True) -> tuple:
+        """撮影だけを行い (本体, 話者) の未展開ショットを返す（対象外/未設定は None）。
+        本体と話者枠は同じ瞬間の 1 フレームから切り出す（非表示/復帰も 1 回）"""
+        plans = [self._main_capture_plan()] if main else []
+        r = QRect(self.speaker_roi) if speaker and self.speaker_roi else QRect()
+        if not r.isNull():
+            plans.append((r, self._finish_speaker_capture))
+        if not plans:
+            return None, None
+        shots = [(frame, box, finish) for (frame, box), (_rect, finish)
+                 in zip(self._capture_rects_ui_thread([rect for rect, _ in plans]), plans)]
+        return (shots[0] if main else None), (shots[-1] if not r.isNull() else None)
+
+    @staticmethod
+    def _develop_shot(shot) -> Optional[Image.Image]:
+        """未展開ショット → 仕上げ済み PIL 画像（BGRA 展開・前処理・デバッグ保存。どのスレッドでも可）"""
+        if shot is None:
+            return None
+        frame, box, finish = shot
+        return finish(frame.image(box))
+
+    def _finish_main_capture(self, img: Image.Image) -> Image.Image:
         if OST_PREPROCESS:
-            img = img.convert("L")
-            img = ImageEnhance.Brightness(img).enhance(1.12)
-            img = ImageEnhance.Contrast(img).enhance(1.32)
-            img = ImageEnhance.Sharpness(img).enhance(1.1)
+            img = _offload(_preprocess_for_ocr, img)
 
         if OST_SAVE_CAPTURE or DEBUG:
             os.makedirs("captures", exist_ok=True)
             img.save(os.path.join("captures", "last_main.png"), "PNG")
 
-        buf = io.BytesIO()
-        img.save(buf, format="PNG")
-        return buf.getvalue()
-    def _grab_speaker_roi_png_ui_thread(self) -> Optional[bytes]:
-        r = QRect(self.speaker_roi)
-        if r.isNull():
-            return None
-
-        old_opacity = None; panel_old_opacity = None; msg_old_opacity = None
-        if OST_HIDE_ON_CAPTURE or self.msg_outside:
-            old_opacity = self.windowOpacity(); self.setWindowOpacity(0.0)
-            if self.ctrl_panel and self.ctrl_panel.isVisible():
-                panel_old_opacity = self.ctrl_panel.windowOpacity(); self.ctrl_panel.setWindowOpacity(0.0)
-            if self.msg_panel and self.msg_panel.isVisible():
-                msg_old_opacity = self.msg_panel.windowOpacity(); self.msg_panel.setWindowOpacity(0.0)
-            QGuiApplication.processEvents(); QThread.msleep(16)
-
-        try:
-            with mss.mss() as sct:
-                if OST_PRIMARY_ONLY:
-                    ps = QGuiApplication.primaryScreen()
-                    ps_geo = ps.geometry()
-                    idx = max(1, min(OST_MON_INDEX, len(sct.monitors) - 1))
-                    mon = sct.monitors[idx]
-                    scale_x = mon["width"]  / ps_geo.width()
-                    scale_y = mon["height"] / ps_geo.height()
-                    region = {
-                        "left":   mon["left"] + int(r.left()   * scale_x),
-                        "top":    mon["top"]  + int(r.top()    * scale_y),
-                        "width":  max(1, int(r.width()  * scale_x)),
-                        "height": max(1, int(r.height() * scale_y)),
-                    }
-                else:
-                    global_center = self.mapToGlobal(r.center())
-                    scale = self._screen_scale_for_point(global_center)
-                    region = {
-                        "left":   int(r.left()   * scale),
-                        "top":    int(r.top()    * scale),
-                        "width":  max(1, int(r.width()  * scale)),
-                        "height": max(1, int(r.height() * scale)),
-                    }
-
-                shot = sct.grab(region)
-                img = Image.frombytes("RGB", (shot.width, shot.height), shot.rgb)
-
-        finally:
-            if old_opacity is not None: self.setWindowOpacity(old_opacity)
-            if panel_old_opacity is not None and self.ctrl_panel: self.ctrl_panel.setWindowOpacity(panel_old_opacity)
-            if msg_old_opacity is not None and self.msg_panel: self.msg_panel.setWindowOpacity(msg_old_opacity)
-            QGuiApplication.processEvents()
+        return img
 
+    def _finish_speaker_capture(self, img: Image.Image) -> Image.Image:
         if OST_PREPROCESS:
-            img = img.convert("L")
-            img = ImageEnhance.Contrast(img).enhance(1.2)
+            img = _offload(_preprocess_for_ocr, img, _PRE_SPEAKER)
 
         if OST_SAVE_CAPTURE or DEBUG:
             os.makedirs("captures", exist_ok=True)
             img.save(os.path.join("captures", "last_speaker.png"), "PNG")
 
-        buf = io.BytesIO()
-        img.save(buf, format="PNG")
-        return buf.getvalue()
-
-    # ---- REST（リトライ & JSON保存） ----
-    def _call_gemini_rest_with_retry(self, main_img_png: bytes, speaker_img_png: Optional[bytes]) -> str:
-        backoffs = [0.8, 2.0]
-        last = None
-        for attempt in range(1, 1+len(backoffs)+1):
-            # ★ここでキャンセルなら即中断
-            if self.cancel_evt.is_set():
-                raise RuntimeError("canceled")
-            try:
-                return self._call_gemini_rest_once(main_img_png, speaker_img_png)
-            except requests.RequestException as e:
-                last = e
-                if attempt <= len(backoffs) and not self.cancel_evt.is_set():
-                    if DEBUG: print(f"[OST] network error; retry in {backoffs[attempt-1]}s: {e}")
-                    time.sleep(backoffs[attempt-1])
-                else:
-                    raise
-            except RuntimeError as e:
-                last = e
-                if "HTTP 5" in str(e) and attempt <= len(backoffs) and not self.cancel_evt.is_set():
-                    if DEBUG: print(f"[OST] server 5xx; retry in {backoffs[attempt-1]}s")
-                    time.sleep(backoffs[attempt-1])
-                else:
-                    raise
-        if last: raise last
-        return ""
-
-    
-    def _call_gemini_rest_once(self, main_img_png: bytes, speaker_img_png: Optional[bytes]) -> str:
-        # --- Strict JSON 出力 & 画像最適化 ---
-        main_img_png = self._optimize_png_for_api(main_img_png)
-        if speaker_img_png:
-            speaker_img_png = self._optimize_png_for_api(speaker_img_png)
-
-        def build_payload(request_source: bool, img_png: bytes):
-            """request_source=True: {"source","ja"} / False: {"ja"} only"""
-            persona = []
-            if self.speaker: persona.append(f"話者名は「{self.speaker}」。")
-            if self.tone:    persona.append(f"口調/文体は「{self.tone}」。")
-            persona_str = " ".join(persona) if persona else "話者/口調は特に指定なし。"
-
-            constraint_text = (
-                 " 出力は必ず1行のJSONのみ。前置き/後置き/解説/理由/箇条書き/Markdown/コードフェンス/引用符は禁止。"
-            ) if getattr(self, 'tone_mode', 'lite') == 'pro' else ""
-
-            parts = []
-            if KEEP_SOURCE and request_source:
-                prompt = (
-                  "あなたはゲームUI/台詞の実務翻訳者です。画像からテキストを正確に読み取り、日本語に翻訳してください。"
-                  + persona_str + constraint_text +
-                  " 原文の改行（行区切り）は可能な限り維持し、同じ箇所で `ja` にも改行を入れてください。"
-                  " 出力は必ず次のJSON文字列のみ："
-                  ' {\"source\":\"OCRで認識した原文（読み取れた言語のまま）\",\"ja\":\"自然な日本語訳\"}  '
-                  "。他の文字や説明は一切不要。読み取れない場合は source は空文字、ja は「（文字が見つかりません）」にしてください。"
-                  " 2枚目の画像があれば話者のヒントとして参照してください。"
-                )
-            else:
-                prompt = (
-                  "あなたはゲームUI/台詞の実務翻訳者です。画像から読めるテキストを正確に日本語へ翻訳してください。"
-                  + persona_str + constraint_text +
-                  " 原文の改行（行区切り）は可能な限り維持し、同じ箇所で `ja` にも改行を入れてください。"
-                  " 出力は必ず次のJSON文字列のみ： {\"ja\":\"自然な日本語訳\"} 。他の文字や説明は一切不要。"
-                )
-            parts.append({ "text": prompt })
-            parts.append({ "inline_data": { "mime_type":"image/png", "data": base64.b64encode(img_png).decode("ascii") } })
-            if speaker_img_png:
-                parts.append({ "text":"以下は話者のヒント（名前枠/立ち絵など）です。" })
-                parts.append({ "inline_data": { "mime_type": "image/png", "data": base64.b64encode(speaker_img_png).decode("ascii") } })
-
-            if KEEP_SOURCE and request_source:
-                sys_text = (
-                    'あなたは画像からテキストを抽出して日本語へ翻訳するエージェント。'
-                    '常に JSON のみを返答： {\"source\":\"原文\",\"ja\":\"日本語訳\"}。'
-                    '前置き・後置き・説明・コードフェンスは禁止。キーは source と ja だけ。'
-                )
-                resp_schema = {
-                    "type":"object",
-                    "properties":{
-                        "source":{"type":"string"},
-                        "ja":{"type":"string"}
-                    },
-                    "required":["source","ja"]
-                }
-            else:
-                sys_text = (
-                    'あなたは画像からテキストを読み取り日本語へ翻訳するエージェント。'
-                    '常に JSON のみを返答： {\"ja\":\"日本語訳\"}。'
-                    '前置きや後置き、コードフェンスは禁止。キーは ja のみ。'
-                )
-                resp_schema = {
-                    "type":"object",
-                    "properties":{"ja":{"type":"string"}},
-                    "required":["ja"]
-                }
-
-            gen_cfg = {
-                "candidateCount": 1,
-                "temperature": 0.2,
-                "responseMimeType": "application/json",
-                "responseSchema": resp_schema
-            }
-            payload = {
-                "systemInstruction": {"role":"system","parts":[{"text": sys_text}]},
-                "contents": [{"role":"user","parts": parts}],
-                "generationConfig": gen_cfg,
-                "safetySettings": [
-                    {"category":"HARM_CATEGORY_DANGEROUS_CONTENT","threshold":"BLOCK_NONE"},
-                    {"category":"HARM_CATEGORY_HARASSMENT","threshold":"BLOCK_NONE"},
-                    {"category":"HARM_CATEGORY_HATE_SPEECH","threshold":"BLOCK_NONE"},
-                    {"category":"HARM_CATEGORY_SEXUALLY_EXPLICIT","threshold":"BLOCK_NONE"}
-                ],
-            }
-            return payload
-
-        headers = {"x-goog-api-key": (self.api_key or ""), "Content-Type":"application/json; charset=utf-8"}
+        return img
 
-        def request_once(request_source: bool, img_png: bytes):
-            payload = build_payload(request_source, img_png)
-            resp = requests.post(API_ENDPOINT, headers=headers, json=payload, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
-            if resp.status_code >= 400: 
-                raise RuntimeError(f"HTTP {resp.status_code}: {resp.text[:800]}")
-            data = resp.json()
-            cands = data.get("candidates") or []
-            cand = cands[0] if cands else None
-            return data, cand
+    def _grab_roi_image_ui_thread(self) -> Image.Image:
+        """撮影から仕上げまでをその場で行う同期版（注釈保存の取り直し用）"""
+        return self._develop_shot(self._snap_ui_thread(speaker=False)[0])
 
-        # 1st attempt: request_source = KEEP_SOURCE
-        request_source = bool(KEEP_SOURCE)
-        data, cand = request_once(request_source, main_img_png)
+    def _translate_options(self) -> TranslateOptions:
+        return TranslateOptions(speaker=self.speaker or "", tone=self.tone or "",
+                                tone_mode=getattr(self, "tone_mode", "lite") or "lite")
 
-        # エラー/停止理由
-        if not cand:
-            pf = data.get("promptFeedback") or {}
-            return f"(空応答: {('blocked:'+str(pf)) if pf else str(data)[:400]})"
+    def _may_show_partial(self) -> bool:
+        """先出しは、先に届くべきジョブが残っていないときだけ（後のキャプチャの途中経過で上書きしない）"""
+        job = _current_job()
+        return job is None or self.jobs.is_front(job)
 
-        finish = cand.get("finishReason")
+    def _on_partial_text(self, text: str):
+        if self._may_show_partial():
+            self.sig_apply_text.emit(text)
 
-        # RECITATION: もう一度、『訳文のみ』で再試行
-        if finish == "RECITATION" and request_source:
-            if OST_RECITATION_AUTO and OST_RECITATION_JA_RETRY:
-                self.sig_apply_text.emit("（有名/既知の本文と判定され出力が停止されたため、訳文のみで再翻訳しています…）")
-                if DEBUG: print("[OST] recitation detected; retry with JA-only schema")
-                request_source = False
-                data, cand = request_once(request_source, main_img_png)
-                finish = cand.get("finishReason")
-            elif OST_SLICE_ON_RECITATION:
-                self.sig_apply_text.emit("（有名/既知の本文と判定されたため、画像を分割して再翻訳しています…）")
-                if DEBUG: print("[OST] recitation detected; skip JA-only retry; slicing image")
-                ja_all = []
-                for sub_png in self._slice_png_vertical(main_img_png, OST_SLICE_PARTS):
-                    try:
-                        sub_png_opt = self._optimize_png_for_api(sub_png)
-                    except Exception:
-                        sub_png_opt = sub_png
-                    data2, cand2 = request_once(False, sub_png_opt)
-                    if not cand2:
-                        continue
-                    parts_out2 = (cand2.get("content") or {}).get("parts") or []
-                    raw2 = ""
-                    for p2 in parts_out2:
-                        if isinstance(p2, dict) and "text" in p2 and p2["text"]:
-                            raw2 += p2["text"]
-                    raw2 = (raw2 or "").strip()
-                    try:
-                        obj2 = json.loads(raw2) if raw2 else {}
-                        if isinstance(obj2, dict) and "ja" in obj2:
-                            j = (obj2.get("ja") or "").strip()
-                            if j:
-                                ja_all.append(j)
-                    except Exception:
-                        if raw2:
-                            ja_all.append(raw2)
-                if ja_all:
-                    self.last_source_text = ""
-                    return "".join(ja_all)
-                    
-        if finish and finish != "STOP":
-            # 最終手段: JA-onlyでさらにRECITATIONなら、画像を縦に分割して逐次翻訳（意訳）
-            if finish == "RECITATION" and not request_source and OST_SLICE_ON_RECITATION:
-                self.sig_apply_text.emit("（依然として出力が停止されたため、画像を分割して再翻訳しています…）")
-                if DEBUG: print("[OST] recitation again; slicing image and concatenating JA")
-                ja_all = []
-                for sub_png in self._slice_png_vertical(main_img_png, OST_SLICE_PARTS):
-                    # 送信前に最適化（長辺を縮小）— _optimize_png_for_api が無ければ sub_png のままでOK
-                    try:
-                        sub_png_opt = self._optimize_png_for_api(sub_png)
-                    except Exception:
-                        sub_png_opt = sub_png
-                    data2, cand2 = request_once(False, sub_png_opt)
-                    if not cand2:
-                        continue
-                    parts_out2 = (cand2.get("content") or {}).get("parts") or []
-                    raw2 = ""
-                    for p2 in parts_out2:
-                        if isinstance(p2, dict) and "text" in p2 and p2["text"]:
-                            raw2 += p2["text"]
-                    raw2 = (raw2 or "").strip()
-                    try:
-                        obj2 = json.loads(raw2) if raw2 else {}
-                        if isinstance(obj2, dict) and "ja" in obj2:
-                            j = (obj2.get("ja") or "").strip()
-                            if j:
-                                ja_all.append(j)
-                    except Exception:
-                        if raw2:
-                            ja_all.append(raw2)
-                if ja_all:
-                    self.last_source_text = ""
-                    return "\n".join(ja_all)
-            # ここまで来たら素直に停止理由を返す
-            return f"(モデルが出力を停止: finishReason={finish} details={str(cand)[:300]})"
+    # ---- Watch（変化検知で自動翻訳） ----
+    def _toggle_watch(self): self._set_watch(self._watcher is None)
 
-        # 本文取り出し
-        parts_out = (cand.get("content") or {}).get("parts") or []
-        raw = ""
-        for p in parts_out:
-            if isinstance(p, dict) and "text" in p and p["text"]:
-                raw += p["text"]
-        raw = (raw or "").strip()
+    def _set_watch(self, on: bool):
+        if on and self._watcher is None:
+            try:
+                self._watch_monitors = list(_capture_session().monitors)
+            except Exception as e:
+                self.sig_apply_text.emit(f"(自動翻訳を開始できません: {e})"); on = False
+            if on:
+                self._watch_refresh_region()
+                trim = max(BORDER_WIDTH_PX, HANDLE_SIZE) + 2
+                self._watcher = _RoiWatcher(lambda: self._watch_region, lambda: self.state.busy,
+                                            self.sig_watch_fire.emit, trim=trim)
+                self._watcher.start()
+                self.sig_apply_text.emit(f"(自動翻訳 ON: {OST_WATCH_HZ:g}Hz / 静止{OST_WATCH_STABLE}枚で翻訳)")
+        elif not on and self._watcher is not None:
+            self._watcher.stop(); self._watcher = None
+            self.sig_apply_text.emit("(自動翻訳 OFF)")
+        if self.ctrl_panel: self.ctrl_panel.set_watch_state(self._watcher is not None)
+        self.update()
 
-        # JSON parse
+    def _watch_refresh_region(self):
+        """UIスレッドで物理領域を計算してサンプラーへ渡す（選択/編集中は止める）"""
+        if (self.state.selecting or self._selecting_speaker_roi or self.edit_main or self.edit_speaker
+                or self._edit_handle or not self._watch_monitors):
+            self._watch_region = None; return
         try:
-            obj = json.loads(raw) if raw else {}
+            self._watch_region = self._physical_region(self._capture_rect(), self._watch_monitors)
         except Exception:
-            obj = {}
-
-        if request_source:
-            # {"source","ja"} 期待
-            src = ""
-            ja = ""
-            if isinstance(obj, dict):
-                src = obj.get("source") or ""
-                ja  = obj.get("ja") or ""
-            else:
-                # 後方互換：旧パーサで救済
-                src, ja = self._extract_source_ja(raw)
-            self.last_source_text = (src or "").strip()
-            ja = (ja or "").strip()
-            if ja: return ja
-            if src: return src
-            return "（文字が見つかりません）"
-        else:
-            # {"ja"} 期待
-            self.last_source_text = ""
-            if isinstance(obj, dict) and "ja" in obj:
-                ja = (obj.get("ja") or "").strip()
-                return ja if ja else "（文字が見つかりません）"
-            # JSONで無ければ raw テキストを返す
-            return raw if raw else "（文字が見つかりません）"
+            self._watch_region = None
 
+    @Slot()
+    def _on_watch_fire(self):
+        # 連結の組み立て中や翻訳中は見送る（次の変化で再判定）
+        if self.state.busy or self._exiting or self._concat_armed or self._hotkeys_off:
+            return
+        if DEBUG: print("[OST] watch: text area changed and settled -> translate")
+        self.trigger_translate()
 
     # ---- 調整 ----
     def _font_smaller(self): self.font_pt = max(8, self.font_pt - 1); self.update()
@@ -2528,6 +4849,7 @@ class Overlay(QWidget):
             self.state.dots = (self.state.dots + 1) % 4
         if POLL_ON and not self._hotkeys_off: self._poll_keys()
         self._auto_edit_hover()
+        if self._watcher: self._watch_refresh_region()
         # 終了キー（単一VK）
         if sys.platform == "win32" and self._exit_vk is not None:
             try:
@@ -2562,13 +4884,6 @@ class Overlay(QWidget):
             self._hk(fn)
 
     def _poll_keys(self):
-        # 応答中はキャンセル(Alt+X)以外のポーリングを無効化
-        if self.state.busy:
-            if sys.platform == 'win32' and not self._hotkeys_off:
-                alt = self._is_down('alt'); shift = self._is_down('shift'); ctrl = self._is_down('ctrl')
-                if (alt and not shift and not ctrl) and self._edge('alt+x', self._is_down('x')):
-                    self._fire_once('alt+x', self.trigger_cancel)
-            return
         if sys.platform != "win32": return
         if self._hotkeys_off: return
         alt = self._is_down("alt"); shift = self._is_down("shift"); ctrl = self._is_down("ctrl")
@@ -2585,6 +4900,7 @@ class Overlay(QWidget):
                 ("ctrl+shift+s","s", (shift and ctrl and not alt), self._clear_speaker),
                 ("alt+a","a", (alt and not shift), self._concat_append),
                 ("alt+d","d", (alt and not shift), self._concat_clear),
+                ("alt+w","w", (alt and not shift and not ctrl), self._toggle_watch),
                 ("alt+o","o", (alt and not shift and not ctrl), self._open_images_and_translate),
                 ("alt+shift+r","r", (alt and shift and not ctrl), self._retry_from_last_saved),
                 ("alt+x","x", (alt and not shift and not ctrl), self.trigger_cancel),
@@ -2630,6 +4946,19 @@ class Overlay(QWidget):
         except Exception: pass
         try: keyboard.unhook_all(); keyboard.clear_all_hotkeys()
         except Exception: pass
+        try:
+            if self._watcher: self._watcher.stop()
+        except Exception: pass
+        try: self.jobs.close()
+        except Exception: pass
+        try: self.engine.close()
+        except Exception: pass
+        if DEBUG: print("[OST] http", _abort_stats_line()); print("[OST] engine", self.engine.stats_line())
+        try: self._img_lane.shutdown(wait=False, cancel_futures=True)
+        except Exception: pass
+        try: _shutdown_image_pool()
+        except Exception: pass
+        _close_capture_session()
         try: self.timer.stop()
         except Exception: pass
         try: QCoreApplication.quit()
@@ -2637,7 +4966,1001 @@ class Overlay(QWidget):
         QTimer.singleShot(120, lambda: os._exit(0))
 
 
+# --- ベンチマーク（python ScreenTranslate.py --bench <名前> [画像...]） ---
+# 画像を渡さなければ合成の文字画像（台詞枠 L/RGB、全画面、縦長の連結）で測る。
+_BENCHES = {}
+
+
+def _bench(name):
+    def deco(fn):
+        _BENCHES[name] = fn
+        return fn
+    return deco
+
+
+def _bench_fixtures(paths) -> list:
+    if paths:
+        out = []
+        for p in paths:
+            im = Image.open(p); im.load()
+            out.append((os.path.basename(p), im if im.mode in ("L", "RGB") else im.convert("RGB")))
+        return out
+    rng = np.random.default_rng(7)
+    try:
+        font = ImageFont.load_default(size=28)
+    except Exception:
+        font = ImageFont.load_default()
+    line = "The quick brown fox jumps over the lazy dog. 0123456789 ?!"
+
+    def text_block(im, x0, y0, n, fill, step=42):
+        d = ImageDraw.Draw(im)
+        for i in range(n):
+            d.text((x0, y0 + i * step), line, font=font, fill=fill)
+        return im
+
+    dialog_l = text_block(Image.new("L", (1280, 320), 24), 40, 30, 6, 235)
+    grad = np.linspace(40, 120, 1280, dtype=np.float32)[None, :, None] * np.array([0.6, 0.8, 1.0], np.float32)
+    dialog_rgb = text_block(Image.fromarray(np.repeat(grad, 320, axis=0).astype(np.uint8), "RGB"), 40, 30, 6, (255, 240, 200))
+    scene = rng.integers(0, 256, (1080 // 8, 1920 // 8, 3), dtype=np.uint8)
+    scene = Image.fromarray(scene, "RGB").resize((1920, 1080), Image.BICUBIC)
+    scene.paste((16, 16, 32), (160, 760, 1760, 1040))
+    scene = text_block(scene, 200, 780, 6, (250, 250, 250))
+    concat = text_block(Image.new("L", (1280, 3000), 24), 40, 20, 70, 235)
+    screen4k = scene.resize((3840, 2160), Image.BICUBIC)
+    screen4k.paste((16, 16, 32), (320, 1560, 3520, 2080))
+    screen4k = text_block(screen4k, 360, 1600, 10, (250, 250, 250), step=46)
+    return [("dialog_L", dialog_l), ("dialog_rgb", dialog_rgb), ("scene_rgb", scene), ("concat_L", concat),
+            ("screen4k_rgb", screen4k)]
+
+
+def _bench_time(fn, *args, repeat: int = 3):
+    """(最後の戻り値, 最良ms)"""
+    best = None; out = None
+    for _ in range(repeat):
+        t0 = time.perf_counter(); out = fn(*args); dt = (time.perf_counter() - t0) * 1000
+        best = dt if best is None else min(best, dt)
+    return out, best
+
+
+@_bench("encode")
+def _bench_encode(paths):
+    # auto の候補 + 参考（従来の PNG 既定圧縮 / PNG最大圧縮 / 128色への非可逆パレット / JPEG）。
+    # 画像は送信時と同じく長辺 OST_MAX_WH に縮めてから測る（縦長はタイル分割されるのでそのまま）
+    encs = list(_LOSSLESS_ENCODERS) + [
+        ("png6",       "image/png", lambda im: _enc_png(im, 6)),
+        ("png9",       "image/png", lambda im: _enc_png(im, 9)),
+        ("palette128", "image/png", lambda im: _enc_palette(im, 128)),
+    ] + [(f"jpeg{q}", "image/jpeg", (lambda q: lambda im: _enc_jpeg(im, q))(q)) for q in (92, 85)]
+    lim = int(os.environ.get("OST_MAX_WH", "2048"))
+    for name, im in _bench_fixtures(paths):
+        if 0 < lim < max(im.size) and im.width >= im.height:
+            im = _resize_lanczos(im, (max(1, im.width * lim // max(im.size)), max(1, im.height * lim // max(im.size))))
+        print(f"[encode] {name} {im.width}x{im.height} {im.mode}  raw={len(im.tobytes()) // 1024}KB  LOSSY budget={OST_ENCODE_BUDGET // 1024}KB")
+        print(f"  {'format':<10}{'bytes':>10}{'base64':>10}{'ms':>9}")
+        for label, _mime, fn in encs:
+            data, ms = _bench_time(fn, im)
+            if data is None:
+                continue
+            print(f"  {label:<10}{len(data):>10}{(len(data) + 2) // 3 * 4:>10}{ms:>9.1f}")
+        (data, _mime, label), ms = _bench_time(_encode_for_api, im)
+        print(f"  -> auto: {label} {len(data)} bytes in {ms:.1f}ms")
+        (data, _mime, label), ms = _bench_time(_encode_for_api, im, OST_ENCODE_BUDGET, "auto", True)
+        print(f"  -> auto+OST_ENCODE_LOSSY=1: {label} {len(data)} bytes in {ms:.1f}ms")
+    return 0
+
+
+@_bench("preprocess")
+def _bench_preprocess(paths):
+    print(f"  {'image':<18}{'size':>11}{'legacy ms':>11}{'fused ms':>10}{'x':>6}{'max|d|':>8}{'diff%':>8}")
+    for name, im in _bench_fixtures(paths):
+        for tag, params in (("", _PRE_MAIN), ("/spk", _PRE_SPEAKER)):
+            old, t_old = _bench_time(_preprocess_legacy, im, params)
+            new, t_new = _bench_time(_preprocess_for_ocr, im, params)
+            d = np.abs(np.asarray(old, np.int16) - np.asarray(new, np.int16))
+            print(f"  {name + tag:<18}{im.width:>6}x{im.height:<4}{t_old:>11.1f}{t_new:>10.1f}{t_old / max(t_new, 1e-6):>6.1f}"
+                  f"{int(d.max()):>8}{(d > 0).mean() * 100:>8.2f}")
+    return 0
+
+
+@_bench("stitch")
+def _bench_stitch(paths):
+    # 縦に長いページをスクロールしながら撮った想定のフレームを _ConcatCanvas に積み、最古の破棄が起きた後も
+    # 連結結果が元ページの該当範囲（残っている最古フレームの上端〜最新フレームの下端）と一致するかを見る
+    rng = np.random.default_rng(3)
+    try:
+        font = ImageFont.load_default(size=20)
+    except Exception:
+        font = ImageFont.load_default()
+    page = Image.new("L", (480, 2400), 20); d = ImageDraw.Draw(page)
+    for y in range(8, page.height - 30, 30):
+        d.text((12, y), " ".join(f"{v:05d}" for v in rng.integers(0, 99999, 6)), font=font, fill=230)
+    view, step = 300, 150
+    tops = list(range(0, page.height - view + 1, step))
+    print(f"[stitch] page {page.width}x{page.height}, view {view}px, scroll {step}px")
+    print(f"  {'max_frames':<12}{'frames':>7}{'canvas rows':>13}{'expected':>18}{'match':>7}")
+    bad = 0
+    for max_frames in (2, 3, 8, len(tops)):
+        for n in (4, len(tops)):
+            canvas = _ConcatCanvas(mode="L", max_frames=max_frames, stitch=True)
+            for top in tops[:n]:
+                canvas.append(page.crop((0, top, page.width, top + view)))
+            lo = tops[max(0, n - max_frames)]; hi = tops[n - 1] + view
+            got = np.asarray(canvas.image())
+            ok = got.shape == (hi - lo, page.width) and np.array_equal(got, np.asarray(page)[lo:hi])
+            bad += not ok
+            print(f"  {max_frames:<12}{n:>7}{got.shape[0]:>13}{f'{lo}-{hi} ({hi - lo})':>18}{'ok' if ok else 'NG':>7}")
+    return 1 if bad else 0
+
+
+@_bench("capture")
+def _bench_capture(paths):
+    # 実画面が取れればグラブ込み、取れなければ BGRA → RGB の展開だけを合成バッファで比べる
+    from mss.screenshot import ScreenShot
+    sizes = ((2560, 1440), (3840, 2160))
+    try:
+        sct = _capture_session(); mon = sct.monitors[1 if len(sct.monitors) > 1 else 0]
+    except Exception as e:
+        sct = None; print(f"[capture] no display ({e}); conversion only")
+    print(f"  {'size':<11}{'legacy ms':>11}{'frame ms':>10}{'x':>6}")
+    for w, h in sizes:
+        if sct is not None:
+            w, h = min(w, mon["width"]), min(h, mon["height"])
+            region = {"left": mon["left"], "top": mon["top"], "width": w, "height": h}
+
+            def legacy():
+                with mss.mss() as s:
+                    shot = s.grab(region)
+                    return Image.frombytes("RGB", (shot.width, shot.height), shot.rgb)
+
+            def frame():
+                return _grab_frame(region).image()
+        else:
+            raw = bytearray(np.random.default_rng(1).integers(0, 256, w * h * 4, dtype=np.uint8).tobytes())
+            region = {"left": 0, "top": 0, "width": w, "height": h}
+
+            def legacy():
+                shot = ScreenShot(raw, region)  # .rgb はインスタンスごとにキャッシュされるため毎回作る
+                return Image.frombytes("RGB", (shot.width, shot.height), shot.rgb)
+
+            def frame():
+                return _Frame(ScreenShot(raw, region)).image()
+        a, t_old = _bench_time(legacy, repeat=5)
+        b, t_new = _bench_time(frame, repeat=5)
+        same = "" if a.tobytes() == b.tobytes() or sct is not None else "  MISMATCH"
+        print(f"  {w}x{h:<6}{t_old:>11.1f}{t_new:>10.1f}{t_old / max(t_new, 1e-6):>6.1f}{same}")
+    if sct is not None:
+        _, t_open = _bench_time(lambda: mss.mss().close(), repeat=5)
+        print(f"  mss open/close per grab (legacy only): {t_open:.1f}ms")
+    return 0
+
+
+@_bench("uistall")
+def _bench_uistall(paths):
+    # trigger_translate が UI スレッドを塞ぐ時間：従来（展開+前処理まで UI 側）と現行（ショット作成のみ）
+    from mss.screenshot import ScreenShot
+    print(f"  {'roi':<11}{'before ms':>11}{'after ms':>10}{'worker ms':>11}")
+    for w, h in ((1280, 320), (1920, 1080), (3840, 2160)):
+        raw = bytearray(np.random.default_rng(2).integers(0, 256, w * h * 4, dtype=np.uint8).tobytes())
+        region = {"left": 0, "top": 0, "width": w, "height": h}
+        shot = lambda: (_Frame(ScreenShot(raw, region)), None, _preprocess_for_ocr)
+        _, t_old = _bench_time(lambda: Overlay._develop_shot(shot()))
+        snap, t_new = _bench_time(shot)
+        _, t_work = _bench_time(Overlay._develop_shot, snap)
+        print(f"  {w}x{h:<6}{t_old:>11.1f}{t_new:>10.2f}{t_work:>11.1f}")
+    return 0
+
+
+@_bench("imgpool")
+def _bench_imgpool(paths):
+    # 画像段（前処理 → API 用縮小 → エンコード）を裏で回しながら、メインスレッドの 1ms タイマーの遅れを測る
+    global OST_IMAGE_PROCS
+    procs = OST_IMAGE_PROCS or max(1, min(4, (os.cpu_count() or 2) - 1))
+    fixtures = [(n, im) for n, im in _bench_fixtures(paths) if im.width * im.height >= _PROC_MIN_PIXELS] or _bench_fixtures(paths)
+
+    def stage(im):
+        im = _offload(_preprocess_for_ocr, im)
+        if max(im.size) > 2048:
+            s = 2048 / max(im.size)
+            im = _offload(_resize_lanczos, im, (int(im.width * s), int(im.height * s)))
+        return _offload(_encode_for_api, im)
+
+    def run(n_jobs: int):
+        done = threading.Event(); lates = []
+        def jobs():
+            with ThreadPoolExecutor(max_workers=procs) as ex:
+                list(ex.map(stage, [im for _ in range(n_jobs) for _n, im in fixtures]))
+            done.set()
+        t0 = time.perf_counter(); threading.Thread(target=jobs, daemon=True).start()
+        while not done.is_set():
+            t = time.perf_counter(); time.sleep(0.001)
+            lates.append((time.perf_counter() - t - 0.001) * 1000)
+        lates.sort()
+        return (time.perf_counter() - t0) * 1000, lates[int(len(lates) * 0.95)] if lates else 0.0, lates[-1] if lates else 0.0
+
+    saved = OST_IMAGE_PROCS
+    print(f"[imgpool] {len(fixtures)} images x 3 rounds, {procs} workers")
+    print(f"  {'mode':<9}{'wall ms':>9}{'tick p95':>10}{'tick max':>10}")
+    try:
+        for label, n in (("thread", 0), ("process", procs)):
+            OST_IMAGE_PROCS = n
+            if n:
+                _image_pool().submit(int).result()  # 子プロセスの起動（spawn + import）は計測から外す
+            wall, p95, worst = run(3)
+            print(f"  {label:<9}{wall:>9.0f}{p95:>10.2f}{worst:>10.2f}")
+    finally:
+        OST_IMAGE_PROCS = saved; _shutdown_image_pool()
+    return 0
+
+
+@_bench("abort")
+def _bench_abort(paths):
+    # 応答の遅いローカルサーバに投げて途中で取り消し、ワーカーが空くまでの時間を測る
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+    delay = 5.0
+
+    class H(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        def log_message(self, *a): pass
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length") or 0)); time.sleep(delay)
+            try:
+                self.send_response(200); self.send_header("Content-Length", "2"); self.end_headers(); self.wfile.write(b"{}")
+            except OSError:
+                pass
+
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), H); srv.daemon_threads = True
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{srv.server_port}/"
+    pool = _HttpPool(host=url)
+    print(f"[abort] server answers after {delay:.0f}s; cancel at 200ms")
+    for stream in (False, True):
+        evt = threading.Event(); out = {}
+        def call():
+            try:
+                with pool.abortable(evt):
+                    r = pool.post(url, data=b"{}", timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), stream=stream)
+                    r.content
+            except requests.RequestException as e:
+                out["err"] = type(e).__name__
+        t = threading.Thread(target=call); t.start(); time.sleep(0.2)
+        t0 = time.perf_counter(); evt.set(); _abort_requests(evt); t.join()
+        print(f"  stream={int(stream)}  freed in {(time.perf_counter() - t0) * 1000:.1f}ms ({out.get('err', 'no error')}) "
+              f"instead of ~{delay - 0.2:.1f}s")
+    print("  " + _abort_stats_line())
+    pool.close(); srv.shutdown()
+    return 0
+
+
+@_bench("hedge")
+def _bench_hedge(paths):
+    # 大半は速く、一部だけ極端に遅いローカルサーバで、ヘッジなし/ありの裾（p95/p99/最大）を比べる
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+    import random
+    global OST_HEDGE_PCT, OST_HEDGE_MIN_S
+    fast, slow, slow_ratio, n = 0.05, 1.5, 0.06, 200
+
+    class H(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        def log_message(self, *a): pass
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            time.sleep(slow if random.random() < slow_ratio else fast * random.uniform(0.8, 1.6))
+            try:
+                self.send_response(200); self.send_header("Content-Length", "2"); self.end_headers(); self.wfile.write(b"{}")
+            except OSError:
+                pass
+
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), H); srv.daemon_threads = True
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{srv.server_port}/"
+    pool = _HttpPool(host=url)
+    saved = OST_HEDGE_PCT, OST_HEDGE_MIN_S
+    print(f"[hedge] {n} requests; {slow_ratio:.0%} take {slow:.1f}s, the rest ~{fast * 1000:.0f}ms")
+    print(f"  {'hedge':<10}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}{'2nd sent':>10}{'2nd won':>9}")
+    try:
+        for label, pct in (("off", 0.0), (f"p{saved[0] or 95:g}", saved[0] or 95.0)):
+            OST_HEDGE_PCT, OST_HEDGE_MIN_S = pct, 0.0
+            random.seed(1); lat = _LatencyModel(); ts = []
+            for _ in range(n):
+                t0 = time.perf_counter()
+                pool.post_hedged(url, b"{}", {}, latency=lat).content
+                ts.append((time.perf_counter() - t0) * 1000)
+            ts.sort()
+            q = lambda p: ts[min(n - 1, int(n * p / 100))]
+            print(f"  {label:<10}{q(50):>9.0f}{q(95):>9.0f}{q(99):>9.0f}{ts[-1]:>9.0f}{lat.hedged:>10}{lat.hedge_wins:>9}")
+    finally:
+        OST_HEDGE_PCT, OST_HEDGE_MIN_S = saved
+        pool.close(); srv.shutdown()
+    return 0
+
+
+@_bench("ratelimit")
+def _bench_ratelimit(paths):
+    # 「1 秒あたり quota 件」を超えると 429 + Retry-After を返すローカルサーバに、8 並列で投げ続ける
+    # （分単位のクォータを秒に縮めて再現）。従来の固定バックオフ 2 回と、トークンバケット + 429 共通待ちを比べる
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+    quota, n, workers = 20, 120, 8
+    hits = deque(); lock = threading.Lock(); rejected = [0]
+
+    class H(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        def log_message(self, *a): pass
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            with lock:
+                now = time.monotonic()
+                while hits and now - hits[0] >= 1.0: hits.popleft()
+                over = len(hits) >= quota
+                if not over: hits.append(now)
+                else: rejected[0] += 1
+            time.sleep(0.03)
+            code, body = (429, b'{"error":{"code":429}}') if over else (200, b"{}")
+            self.send_response(code); self.send_header("Content-Length", str(len(body)))
+            if over: self.send_header("Retry-After", "1")
+            self.end_headers(); self.wfile.write(body)
+
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), H); srv.daemon_threads = True
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{srv.server_port}/"
+    pool = _HttpPool(host=url)
+
+    def legacy(_lim):
+        for i, back in enumerate([0.8, 2.0, None]):
+            r = pool.post(url, data=b"{}", timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
+            if r.status_code < 400: return True
+            if back is None: return False
+            time.sleep(back)
+
+    def limited(lim):
+        for attempt in range(OST_API_RETRIES + 1):
+            lim.acquire(1)
+            r = pool.post(url, data=b"{}", timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
+            if r.status_code < 400:
+                lim.succeeded(1); return True
+            lim.failed(r.status_code, _retry_after_seconds(r))
+            time.sleep(random.uniform(0, OST_BACKOFF_BASE))
+        return False
+
+    print(f"[ratelimit] quota {quota}/s, {n} requests from {workers} workers")
+    print(f"  {'client':<12}{'ok':>5}{'failed':>8}{'429s':>7}{'wall s':>8}{'req/s':>8}")
+    try:
+        for label, fn in (("fixed-2x", legacy), ("bucket", limited)):
+            time.sleep(1.1); hits.clear(); rejected[0] = 0
+            lim = _RateLimiter(rpm=quota, period=1.0)
+            t0 = time.perf_counter()
+            with ThreadPoolExecutor(workers) as ex:
+                res = list(ex.map(lambda _: fn(lim), range(n)))
+            wall = time.perf_counter() - t0; ok = sum(res)
+            print(f"  {label:<12}{ok:>5}{n - ok:>8}{rejected[0]:>7}{wall:>8.1f}{ok / wall:>8.1f}")
+    finally:
+        pool.close(); srv.shutdown()
+    return 0
+
+
+@_bench("keys")
+def _bench_keys(paths):
+    # キーごとに「1 秒あたり quota 件」の上限を持つローカルサーバに、1 キー / 3 キーのキープールで投げる
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+    quota, n, workers = 10, 90, 8
+    hits: Dict[str, deque] = {}; lock = threading.Lock(); rejected = [0]
+
+    class H(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        def log_message(self, *a): pass
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            with lock:
+                q = hits.setdefault(self.headers.get("x-goog-api-key", ""), deque()); now = time.monotonic()
+                while q and now - q[0] >= 1.0: q.popleft()
+                over = len(q) >= quota
+                if over: rejected[0] += 1
+                else: q.append(now)
+            time.sleep(0.03)
+            code, body = (429, b"{}") if over else (200, b'{"usageMetadata":{"totalTokenCount":1}}')
+            self.send_response(code); self.send_header("Content-Length", str(len(body)))
+            if over: self.send_header("Retry-After", "1")
+            self.end_headers(); self.wfile.write(body)
+
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), H); srv.daemon_threads = True
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{srv.server_port}/"
+    pool = _HttpPool(host=url)
+
+    def one(keys: _KeyPool):
+        for attempt in range(OST_API_RETRIES + 1):
+            k = keys.acquire(1)
+            r = pool.post(url, data=b"{}", headers={"x-goog-api-key": k.key}, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
+            keys.done(k, 1, r.status_code, _retry_after_seconds(r), 1)
+            if r.status_code < 400:
+                return True
+            time.sleep(random.uniform(0, OST_BACKOFF_BASE))
+        return False
+
+    print(f"[keys] per-key quota {quota}/s, {n} requests from {workers} workers")
+    print(f"  {'keys':<6}{'ok':>5}{'429s':>7}{'wall s':>8}{'req/s':>8}")
+    try:
+        for nk in (1, 3):
+            time.sleep(1.1); hits.clear(); rejected[0] = 0
+            keys = _KeyPool([f"bench-key-{i}" for i in range(nk)], rpm=quota, tpm=0, period=1.0)
+            t0 = time.perf_counter()
+            with ThreadPoolExecutor(workers) as ex:
+                ok = sum(ex.map(lambda _: one(keys), range(n)))
+            wall = time.perf_counter() - t0
+            print(f"  {nk:<6}{ok:>5}{rejected[0]:>7}{wall:>8.1f}{ok / wall:>8.1f}")
+            for part in keys.stats_line().split(" | "):
+                print("        " + part)
+    finally:
+        pool.close(); srv.shutdown()
+    return 0
+
+
+@_bench("engine")
+def _bench_engine(paths):
+    # TranslationEngine をそのまま（QApplication なし）ローカルの擬似 Gemini に向けて回す：縮小/タイル化/エンコード/
+    # キープール/HTTP/JSON 解析までの実経路を、並列度を変えて測る（応答は 50ms で固定）
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+    global API_ENDPOINT
+    reply = json.dumps({"candidates": [{"content": {"parts": [{"text": json.dumps({"source": "src", "ja": "訳"})}]},
+                                        "finishReason": "STOP"}], "usageMetadata": {"totalTokenCount": 1000}}).encode()
+
+    class H(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        def log_message(self, *a): pass
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length") or 0)); time.sleep(0.05)
+            self.send_response(200); self.send_header("Content-Length", str(len(reply))); self.end_headers()
+            self.wfile.write(reply)
+
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), H); srv.daemon_threads = True
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    saved = API_ENDPOINT
+    API_ENDPOINT = f"http://127.0.0.1:{srv.server_port}/v1beta/models/bench:generateContent"
+    fixtures = _bench_fixtures(paths); rounds = 4
+    print(f"[engine] {len(fixtures)} images x {rounds} rounds, server replies in 50ms, cache off")
+    print(f"  {'workers':<9}{'req/s':>8}{'p50 ms':>9}{'p95 ms':>9}")
+    try:
+        for workers in (1, 4, 8):
+            eng = TranslationEngine(keys=_KeyPool(["bench"]), http=_HttpPool(host=API_ENDPOINT), use_cache=False,
+                                    workers=workers)
+            items = [_ApiImage(im=im.copy()) for _ in range(rounds) for _name, im in fixtures]  # 毎回エンコードから
+            t0 = time.perf_counter()
+            futs = [eng.submit(img) for img in items]
+            ts = sorted(f.result().seconds * 1000 for f in futs)
+            wall = time.perf_counter() - t0
+            print(f"  {workers:<9}{len(ts) / wall:>8.1f}{ts[len(ts) // 2]:>9.0f}{ts[min(len(ts) - 1, int(len(ts) * 0.95))]:>9.0f}")
+            eng.close()
+    finally:
+        API_ENDPOINT = saved; srv.shutdown()
+    return 0
+
+
+@_bench("stream")
+def _bench_stream(paths):
+    # SSE を小分けに返すローカルの擬似 Gemini 相手に、ストリーミングの実経路を確かめる：最初の途中訳までの時間、
+    # 最終訳が generateContent と一致するか、途中で RECITATION が来たときの訳文のみでの再送、受信中の取り消し
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+    global API_ENDPOINT, API_STREAM_ENDPOINT, OST_RECITATION_JA_RETRY
+    src = "It was a bright cold day in April, and the clocks were striking thirteen."
+    ja = "四月の晴れた寒い日で、時計は十三時を打っていた。"
+    pieces, gap = 12, 0.08
+    state = {"recite": False, "req": []}
+
+    def split(text: str) -> list:
+        n = max(1, -(-len(text) // pieces))
+        return [text[i:i + n] for i in range(0, len(text), n)]
+
+    class H(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        def log_message(self, *a): pass
+        def chunk(self, b: bytes):
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(b), b)); self.wfile.flush()
+        def event(self, obj: dict):
+            self.chunk(b"data: " + json.dumps(obj, ensure_ascii=False).encode("utf-8") + b"\r\n\r\n")
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)))
+            with_src = "source" in body["generationConfig"]["responseSchema"]["properties"]
+            text = json.dumps({"source": src, "ja": ja} if with_src else {"ja": ja}, ensure_ascii=False)
+            stream = "streamGenerateContent" in self.path
+            state["req"].append(("stream" if stream else "generate", with_src))
+            usage = {"totalTokenCount": 1000}
+            if not stream:
+                time.sleep(gap * pieces)
+                reply = json.dumps({"candidates": [{"content": {"parts": [{"text": text}], "role": "model"},
+                                                    "finishReason": "STOP"}], "usageMetadata": usage}).encode()
+                self.send_response(200); self.send_header("Content-Length", str(len(reply))); self.end_headers()
+                self.wfile.write(reply)
+                return
+            self.send_response(200); self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked"); self.end_headers()
+            try:
+                parts = split(text)
+                if state["recite"] and with_src:
+                    parts = parts[:pieces // 3]
+                for k, p in enumerate(parts):
+                    time.sleep(gap)
+                    self.event({"candidates": [{"content": {"parts": [{"text": p}], "role": "model"}}]})
+                time.sleep(gap)
+                finish = "RECITATION" if state["recite"] and with_src else "STOP"
+                self.event({"candidates": [{"content": {"parts": [], "role": "model"}, "finishReason": finish}],
+                            "usageMetadata": usage})
+                self.chunk(b"")
+            except OSError:
+                pass
+
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), H); srv.daemon_threads = True
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    saved = (API_ENDPOINT, API_STREAM_ENDPOINT, OST_RECITATION_JA_RETRY)
+    base = f"http://127.0.0.1:{srv.server_port}/v1beta/models/bench"
+    API_ENDPOINT = base + ":generateContent"; API_STREAM_ENDPOINT = base + ":streamGenerateContent?alt=sse"
+    OST_RECITATION_JA_RETRY = True
+    img = _ApiImage(im=_bench_fixtures(paths)[0][1])
+    eng = TranslationEngine(keys=_KeyPool(["bench"]), http=_HttpPool(host=API_ENDPOINT), use_cache=False, workers=1)
+    print(f"[stream] server: {pieces} SSE events, {gap * 1000:.0f}ms apart (generateContent answers after the same total)")
+    ok = True
+
+    def run(stream: bool, cancel_after_first: bool = False):
+        evt = threading.Event(); first = threading.Event(); seen = []; out = {}
+        t0 = time.perf_counter()
+        def on_partial(text):
+            if not seen: out["first"] = time.perf_counter() - t0
+            seen.append(text); first.set()
+        def call():
+            try:
+                out["res"] = eng.translate(img, TranslateOptions(keep_source=True, stream=stream), cancel_evt=evt,
+                                           on_partial=on_partial)
+            except Exception as e:
+                out["err"] = f"{type(e).__name__}: {e}"
+            out["wall"] = time.perf_counter() - t0
+        t = threading.Thread(target=call); t.start()
+        if cancel_after_first and first.wait(5.0):
+            time.sleep(gap / 2)  # 次のイベント待ち（受信でブロック中）に取り消す
+            out["cancel_at"] = time.perf_counter() - t0
+            evt.set(); _abort_requests(evt)
+        t.join()
+        return out, seen
+
+    try:
+        base_out, _ = run(False)
+        st_out, partials = run(True)
+        same = "res" in base_out and "res" in st_out and st_out["res"].text == base_out["res"].text == ja \
+            and st_out["res"].source == base_out["res"].source == src
+        growing = all(b.startswith(a) for a, b in zip(partials, partials[1:]))
+        ok &= same and growing and bool(partials)
+        print(f"  generateContent        total {base_out['wall'] * 1000:7.0f}ms")
+        print(f"  streamGenerateContent  first partial {st_out.get('first', float('nan')) * 1000:5.0f}ms, "
+              f"total {st_out['wall'] * 1000:7.0f}ms, {len(partials)} partials (prefix-growing: {growing})")
+        print(f"  final text matches generateContent: {same}")
+
+        state["recite"] = True; state["req"].clear()
+        rc_out, rc_partials = run(True)
+        state["recite"] = False
+        rc_ok = "res" in rc_out and rc_out["res"].text == ja and state["req"] == [("stream", True), ("stream", False)]
+        ok &= rc_ok
+        print(f"  RECITATION mid-stream: requests {state['req']} -> "
+              f"{'ja-only retry ok' if rc_ok else rc_out.get('err') or rc_out['res'].text[:80]}"
+              f" ({len(rc_partials)} partials, {rc_out['wall'] * 1000:.0f}ms)")
+
+        state["req"].clear()
+        cx_out, cx_partials = run(True, cancel_after_first=True)
+        freed = (cx_out["wall"] - cx_out.get("cancel_at", cx_out["wall"])) * 1000
+        cx_ok = cx_out.get("err") == "RuntimeError: canceled" and len(state["req"]) == 1
+        ok &= cx_ok
+        print(f"  cancel during stream: freed in {freed:.1f}ms after cancel ({cx_out.get('err', 'no error')}), "
+              f"{len(cx_partials)} partial(s) before, requests {len(state['req'])}")
+        print("  " + eng.stats_line())
+    finally:
+        eng.close(); srv.shutdown()
+        API_ENDPOINT, API_STREAM_ENDPOINT, OST_RECITATION_JA_RETRY = saved
+    print("  OK" if ok else "  FAILED")
+    return 0 if ok else 1
+
+
+@_bench("pack")
+def _bench_pack(paths):
+    # 1 枚ずつ送る場合と、OST_PACK のように N 枚を 1 リクエストにまとめる場合の比較。擬似サーバーは
+    # 1 リクエスト 300ms + 1 画像 30ms で応答し、使用トークンを「プロンプト 700 + 画像ごと 260」で返す
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+    global API_ENDPOINT
+    seen = {"req": 0}
+
+    class H(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        def log_message(self, *a): pass
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)))
+            n = sum(1 for p in body["contents"][0]["parts"] if "inline_data" in p)
+            seen["req"] += 1; time.sleep(0.3 + 0.03 * n)
+            if body["generationConfig"]["responseSchema"].get("type") == "array":
+                text = json.dumps([{"index": k, "source": f"src{k}", "ja": f"訳{k}"} for k in range(1, n + 1)])
+            else:
+                text = json.dumps({"source": "src", "ja": "訳"})
+            reply = json.dumps({"candidates": [{"content": {"parts": [{"text": text}]}, "finishReason": "STOP"}],
+                                "usageMetadata": {"totalTokenCount": 700 + 260 * n}}).encode()
+            self.send_response(200); self.send_header("Content-Length", str(len(reply))); self.end_headers()
+            self.wfile.write(reply)
+
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), H); srv.daemon_threads = True
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    saved = API_ENDPOINT
+    API_ENDPOINT = f"http://127.0.0.1:{srv.server_port}/v1beta/models/bench:generateContent"
+    # エンコード済みの画像を使い回し、リクエスト数の差だけを見る（縦長のタイル対象は除く）
+    fixtures = [_ApiImage(im=im) for _name, im in _bench_fixtures(paths) if im.height <= 2048 or im.width >= im.height] * 4
+    for img in fixtures:
+        img.part()
+    print(f"[pack] {len(fixtures)} images (pre-encoded), 1 worker, server: 300ms/request + 30ms/image, cache off")
+    print(f"  {'mode':<12}{'requests':>9}{'wall s':>8}{'tokens':>8}")
+    try:
+        for label, n in (("single", 1), ("pack=4", 4), ("pack=8", 8)):
+            eng = TranslationEngine(keys=_KeyPool(["bench"]), http=_HttpPool(host=API_ENDPOINT), use_cache=False,
+                                    workers=1)
+            seen["req"] = 0; t0 = time.perf_counter()
+            if n == 1:
+                res = [eng.translate(img) for img in fixtures]
+            else:
+                res = eng.translate_many(fixtures, max_per_request=n)
+            wall = time.perf_counter() - t0
+            assert all(r.text for r in res)
+            print(f"  {label:<12}{seen['req']:>9}{wall:>8.2f}{sum(r.tokens for r in res):>8}")
+            eng.close()
+    finally:
+        API_ENDPOINT = saved; srv.shutdown()
+    return 0
+
+
+@_bench("batchfile")
+def _bench_batchfile(paths):
+    # Gemini Batch の書き出し → ローカルで作った代わりの出力ファイル → 取り込み、を通信なしで通す（一時ディレクトリ内）。
+    # 代わりの出力は最後から 2 行を error / RECITATION にする。取り込んだ分は translate() がキャッシュから返すことも確かめる
+    import tempfile
+    global API_ENDPOINT
+    fixtures = _bench_fixtures(paths)
+    cwd = os.getcwd(); saved = API_ENDPOINT
+    os.chdir(tempfile.mkdtemp(prefix="ost-batchfile-"))
+    API_ENDPOINT = "http://127.0.0.1:9/v1beta/models/offline:generateContent"  # ここへは送らない
+    try:
+        os.makedirs("shots")
+        for k, (_name, im) in enumerate(fixtures):
+            im.save(os.path.join("shots", f"{k:02d}.png"))
+        t0 = time.perf_counter()
+        _run_batch_export(["shots", "-o", "input.jsonl"])
+        t_export = time.perf_counter() - t0
+        with open("input.jsonl", "r", encoding="utf-8") as f:
+            reqs = [json.loads(line) for line in f]
+        with open("output.jsonl", "w", encoding="utf-8") as f:
+            for i, r in enumerate(reqs):
+                n = sum(1 for p in r["request"]["contents"][0]["parts"] if "inline_data" in p)
+                if i == len(reqs) - 2:
+                    line = {"key": r["key"], "error": {"code": 13, "message": "stand-in failure"}}
+                elif i == len(reqs) - 1:
+                    line = {"key": r["key"], "response": {"candidates": [{"finishReason": "RECITATION"}]}}
+                else:
+                    text = json.dumps({"source": f"src {i}", "ja": f"訳 {i}（{n} 枚）"}, ensure_ascii=False)
+                    line = {"key": r["key"], "response": {"candidates": [{"content": {"parts": [{"text": text}]},
+                            "finishReason": "STOP"}], "usageMetadata": {"totalTokenCount": 1000}}}
+                f.write(json.dumps(line, ensure_ascii=False) + "\n")
+        t0 = time.perf_counter()
+        _run_batch_import(["output.jsonl", "-m", "input.manifest.jsonl", "-o", "results.jsonl", "--annotate", "annotated"])
+        t_import = time.perf_counter() - t0
+        with open("results.jsonl", "r", encoding="utf-8") as f:
+            recs = [json.loads(line) for line in f]
+        ok = [r for r in recs if "error" not in r]
+        eng = TranslationEngine(keys=_KeyPool(["offline"]))
+        hits = sum(eng.translate(_batch_open(r["path"], OST_PREPROCESS)).cached for r in ok)
+        eng.close()
+        print(f"[batchfile] {len(fixtures)} images -> {len(reqs)} request lines "
+              f"({os.path.getsize('input.jsonl') / 1048576:.1f}MB) in {t_export:.2f}s; import {t_import:.2f}s")
+        print(f"  imported ok={len(ok)} failed={len(recs) - len(ok)} annotated={sum(1 for r in ok if r.get('annotated'))} "
+              f"cache hits afterwards={hits}/{len(ok)} (no HTTP)")
+    finally:
+        API_ENDPOINT = saved; os.chdir(cwd)
+    return 0
+
+
+def _run_bench(argv) -> int:
+    if not argv or argv[0] not in _BENCHES:
+        print("usage: ScreenTranslate.py --bench {" + ",".join(sorted(_BENCHES)) + "} [画像...]")
+        return 2
+    return _BENCHES[argv[0]](argv[1:]) or 0
+
+
+# --- バッチ（python ScreenTranslate.py --batch <ディレクトリ|glob|ファイル>... -o out.jsonl） ---
+# 1 ファイル = 1 リクエスト（--pack N で N 枚ずつ 1 リクエストにまとめる）。結果は終わった順に JSONL へ 1 行ずつ追記し、再実行では成功済み（パス+内容ハッシュ一致）を飛ばす。
+_BATCH_EXTS = (".png", ".jpg", ".jpeg", ".webp", ".bmp")
+
+
+def _batch_expand(specs, recursive: bool = False) -> list:
+    import glob
+    out = []
+    for spec in specs:
+        if os.path.isdir(spec):
+            pat = os.path.join(spec, "**", "*") if recursive else os.path.join(spec, "*")
+            out += [p for p in glob.glob(pat, recursive=recursive) if p.lower().endswith(_BATCH_EXTS)]
+        elif glob.has_magic(spec):
+            out += [p for p in glob.glob(spec, recursive=True) if os.path.isfile(p)]
+        elif os.path.isfile(spec):
+            out.append(spec)
+        else:
+            print(f"[batch] not found: {spec}", file=sys.stderr)
+    mtimes = {}
+    for p in dict.fromkeys(os.path.normpath(p) for p in out):
+        try:
+            mtimes[p] = os.path.getmtime(p)
+        except OSError as e:  # 列挙した直後に消えた/辿れないリンクなど
+            print(f"[batch] skipped: {p} ({e})", file=sys.stderr)
+    return sorted(mtimes, key=lambda p: (mtimes[p], p))  # 撮った順（古い→新しい）
+
+
+def _batch_done(out_path: str) -> Dict[str, str]:
+    """既存の JSONL から成功済みの {path: hash}（途中で切れた最終行は無視）"""
+    done = {}
+    if not os.path.exists(out_path):
+        return done
+    with open(out_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(rec, dict) and rec.get("path") and not rec.get("error"):
+                done[rec["path"]] = rec.get("hash", "")
+    return done
+
+
+def _batch_open(path: str, preprocess: bool) -> Image.Image:
+    """バッチ共通の読み込み（RGB 化 + 任意で OCR 前処理）。--batch / --batch-export / --batch-import で同じ画素にする"""
+    im = Image.open(path); im.load()
+    return _preprocess_for_ocr(im.convert("RGB")) if preprocess else im.convert("RGB")
+
+
+def _run_batch(argv) -> int:
+    import argparse
+    ap = argparse.ArgumentParser(prog="ScreenTranslate.py --batch",
+                                 description="スクリーンショットをまとめて翻訳し、1 ファイル 1 行の JSONL に書き出す")
+    ap.add_argument("inputs", nargs="+", help="ディレクトリ / glob（'shots/**/*.png'）/ ファイル")
+    ap.add_argument("-o", "--out", default="batch_results.jsonl", help="結果の JSONL（既定: %(default)s）")
+    ap.add_argument("-j", "--jobs", type=int, default=4, help="同時に処理するファイル数（既定: %(default)s）")
+    ap.add_argument("--rpm", type=int, default=OST_RPM, help="キーごとの 1 分あたりリクエスト上限（既定: OST_RPM）")
+    ap.add_argument("--tpm", type=int, default=OST_TPM, help="キーごとの 1 分あたりトークン上限（既定: OST_TPM）")
+    ap.add_argument("-r", "--recursive", action="store_true", help="ディレクトリを再帰的にたどる")
+    ap.add_argument("--no-resume", action="store_true", help="成功済みも含めて全件やり直す（JSONL は上書き）")
+    ap.add_argument("--annotate", metavar="DIR", help="訳文併記の PNG をこのディレクトリへ保存")
+    ap.add_argument("--speaker", default=DEFAULT_SPEAKER); ap.add_argument("--tone", default=DEFAULT_TONE)
+    ap.add_argument("--no-source", action="store_true", help="原文を受け取らない（訳文のみ）")
+    ap.add_argument("--preprocess", type=int, choices=(0, 1), default=int(OST_PREPROCESS),
+                    help="OCR 前処理（既定: OST_PREPROCESS）")
+    ap.add_argument("--pack", type=int, default=1, metavar="N",
+                    help="N 枚ずつ 1 リクエストにまとめて送る（既定: 1 = 1 枚ずつ。上限は OST_PACK_MAX_MB でも分割）")
+    args = ap.parse_args(argv)
+
+    paths = _batch_expand(args.inputs, args.recursive)
+    done = {} if args.no_resume else _batch_done(args.out)
+    engine = TranslationEngine(keys=_KeyPool.from_env(rpm=args.rpm, tpm=args.tpm), workers=args.jobs)
+    if not engine.keys.primary:
+        print("APIキー未設定：GEMINI_API_KEY / GOOGLE_API_KEY / GEMINI_API_KEYS を設定してください", file=sys.stderr)
+        return 2
+    engine.start()
+    opts = TranslateOptions(speaker=args.speaker, tone=args.tone, keep_source=not args.no_source, stream=False)
+    cancel = threading.Event(); wlock = threading.Lock()
+    counts = {"ok": 0, "failed": 0, "skipped": 0}
+
+    def load(path: str) -> tuple:
+        """(レコード, 画像 or None)。読めないファイル/画像はその場でエラーレコードにする"""
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError as e:  # 列挙後に消えた/権限がない（1 ファイルのために全体を止めない）
+            return {"path": path, "error": str(e)[:500], "latency_s": 0.0}, None
+        digest = hashlib.sha256(data).hexdigest()
+        if done.get(path) == digest:
+            return None, None
+        rec = {"path": path, "hash": digest}
+        try:
+            return rec, _batch_open(path, bool(args.preprocess))
+        except Exception as e:
+            rec.update(error=str(e)[:500], latency_s=0.0)
+            return rec, None
+
+    def finish(rec: dict, im, res: TranslationResult):
+        rec.update(source=res.source, ja=res.text, latency_s=round(res.seconds, 3), tokens=res.tokens,
+                   cached=res.cached)
+        if args.annotate:
+            stem = os.path.splitext(os.path.basename(rec["path"]))[0]
+            rec["annotated"] = engine.save_annotated(im, res.text, res.source, not args.no_source,
+                                                     out_path=os.path.join(args.annotate, f"{stem}_{rec['hash'][:8]}.png"))
+
+    def one(chunk: list) -> List[Optional[dict]]:
+        """chunk（--pack 枚）を訳してファイルごとのレコードを返す（None = 済みでスキップ）"""
+        loaded = [load(p) for p in chunk]
+        todo = [(rec, im) for rec, im in loaded if im is not None]
+        t0 = time.perf_counter()
+        try:
+            if len(todo) == 1 and args.pack <= 1:
+                finish(*todo[0], engine.translate(todo[0][1], opts, cancel_evt=cancel))
+            elif todo:
+                results = engine.translate_many([im for _, im in todo], opts, cancel_evt=cancel,
+                                                max_per_request=args.pack)
+                for (rec, im), res in zip(todo, results):
+                    finish(rec, im, res); rec["packed"] = len(todo)
+        except Exception as e:
+            if cancel.is_set():
+                return [None] * len(chunk)  # 中断分は書かない（再実行で拾う）
+            for rec, _ in todo:
+                if "ja" not in rec:
+                    rec.update(error=str(e)[:500], latency_s=round(time.perf_counter() - t0, 3))
+        return [rec for rec, _ in loaded]
+
+    if args.annotate:
+        os.makedirs(args.annotate, exist_ok=True)
+    print(f"[batch] {len(paths)} files, {sum(1 for p in paths if p in done)} already in {args.out}; "
+          f"jobs={args.jobs} pack={args.pack} rpm={args.rpm or '-'} tpm={args.tpm or '-'} keys={len(engine.keys)}", file=sys.stderr)
+    t_start = time.perf_counter(); n = 0
+    pool = ThreadPoolExecutor(max_workers=max(1, args.jobs), thread_name_prefix="ost-batch")
+    try:
+        with open(args.out, "w" if args.no_resume else "a", encoding="utf-8") as out:
+            step = max(1, args.pack)
+            futs = [pool.submit(one, paths[i:i + step]) for i in range(0, len(paths), step)]
+            from concurrent.futures import as_completed
+            for fut in as_completed(futs):
+                for rec in fut.result():
+                    n += 1
+                    if rec is None:
+                        counts["skipped"] += 1; continue
+                    with wlock:
+                        out.write(json.dumps(rec, ensure_ascii=False) + "\n"); out.flush()  # 1 件ごとにチェックポイント
+                    counts["failed" if "error" in rec else "ok"] += 1
+                    status = f"error: {rec['error'][:80]}" if "error" in rec else f"{rec['latency_s']:.1f}s {rec['tokens']}tok"
+                    print(f"[batch] {n}/{len(paths)} {rec['path']}  {status}", file=sys.stderr)
+    except KeyboardInterrupt:
+        cancel.set(); _abort_requests(cancel)
+        pool.shutdown(wait=False, cancel_futures=True)
+        print(f"[batch] interrupted; rerun the same command to resume ({args.out})", file=sys.stderr)
+        return 130
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True); engine.close()
+    wall = time.perf_counter() - t_start
+    print(f"[batch] ok={counts['ok']} failed={counts['failed']} skipped={counts['skipped']} in {wall:.1f}s "
+          f"({counts['ok'] / wall if wall else 0:.2f} files/s)", file=sys.stderr)
+    print(f"[batch] {engine.stats_line()}", file=sys.stderr)
+    return 1 if counts["failed"] else 0
+
+
+# --- Gemini Batch（--batch-export で Batch API の入力 JSONL を作り、処理後の出力 JSONL を --batch-import で取り込む） ---
+# 料金が安く、対話的な翻訳とクォータを取り合わない。ここではファイルの作成/取り込みだけで、アップロードとジョブ管理は
+# AI Studio / Files API 側で行う。行のキーは翻訳キャッシュのキーで、どの画像かは隣の .manifest.jsonl に残す。
+def _batch_manifest_path(requests_path: str) -> str:
+    return os.path.splitext(requests_path)[0] + ".manifest.jsonl"
+
+
+def _run_batch_export(argv) -> int:
+    import argparse
+    ap = argparse.ArgumentParser(prog="ScreenTranslate.py --batch-export",
+                                 description="スクリーンショットを Gemini Batch API の入力 JSONL（{key, request}）に書き出す")
+    ap.add_argument("inputs", nargs="+", help="ディレクトリ / glob（'shots/**/*.png'）/ ファイル")
+    ap.add_argument("-o", "--out", default="gemini_batch_input.jsonl", help="入力 JSONL（既定: %(default)s）")
+    ap.add_argument("-j", "--jobs", type=int, default=4, help="同時にエンコードするファイル数（既定: %(default)s）")
+    ap.add_argument("-r", "--recursive", action="store_true", help="ディレクトリを再帰的にたどる")
+    ap.add_argument("--all", action="store_true", help="翻訳キャッシュにあるものも書き出す")
+    ap.add_argument("--speaker", default=DEFAULT_SPEAKER); ap.add_argument("--tone", default=DEFAULT_TONE)
+    ap.add_argument("--no-source", action="store_true", help="原文を受け取らない（訳文のみ）")
+    ap.add_argument("--preprocess", type=int, choices=(0, 1), default=int(OST_PREPROCESS),
+                    help="OCR 前処理（既定: OST_PREPROCESS）")
+    args = ap.parse_args(argv)
+
+    paths = _batch_expand(args.inputs, args.recursive)
+    engine = TranslationEngine()  # 送信しないのでキーは要らない（キャッシュだけ見る）
+    opts = TranslateOptions(speaker=args.speaker, tone=args.tone, keep_source=not args.no_source, stream=False)
+    counts = {"requests": 0, "cached": 0, "duplicate": 0, "failed": 0}
+
+    def prep(path: str):
+        try:
+            with open(path, "rb") as f:
+                digest = hashlib.sha256(f.read()).hexdigest()
+            key, req = engine.batch_request(_batch_open(path, bool(args.preprocess)), opts)
+            return path, digest, key, req, None
+        except Exception as e:
+            return path, "", "", None, e
+
+    seen = set(); step = max(1, args.jobs) * 4  # 画像入りの request を溜め込まないよう少しずつ
+    manifest = _batch_manifest_path(args.out)
+    pool = ThreadPoolExecutor(max_workers=max(1, args.jobs), thread_name_prefix="ost-export")
+    try:
+        with open(args.out, "w", encoding="utf-8") as out, open(manifest, "w", encoding="utf-8") as man:
+            for i in range(0, len(paths), step):
+                for path, digest, key, req, err in pool.map(prep, paths[i:i + step]):
+                    if err is not None:
+                        counts["failed"] += 1
+                        print(f"[export] skip {path}: {err}", file=sys.stderr); continue
+                    if key in seen:
+                        counts["duplicate"] += 1  # 同じ内容は 1 行だけ送り、取り込み時に両方へ配る
+                    elif not args.all and engine.tcache is not None and engine.tcache.get(key) is not None:
+                        counts["cached"] += 1; continue
+                    else:
+                        seen.add(key); counts["requests"] += 1
+                        out.write(json.dumps({"key": key, "request": req}, ensure_ascii=False) + "\n")
+                    man.write(json.dumps({"key": key, "path": path, "hash": digest, "keep_source": opts.keep_source,
+                                          "preprocess": bool(args.preprocess)}, ensure_ascii=False) + "\n")
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True); engine.close()
+    size = os.path.getsize(args.out)
+    print(f"[export] {counts['requests']} requests -> {args.out} ({size / 1048576:.1f}MB), manifest {manifest}; "
+          f"cached={counts['cached']} duplicate={counts['duplicate']} failed={counts['failed']}", file=sys.stderr)
+    if size > 2 * 1024 ** 3:
+        print("[export] warning: Batch API の入力ファイルは 2GB まで。入力を分けて書き出してください", file=sys.stderr)
+    return 1 if counts["failed"] else 0
+
+
+def _run_batch_import(argv) -> int:
+    import argparse
+    ap = argparse.ArgumentParser(prog="ScreenTranslate.py --batch-import",
+                                 description="Gemini Batch API の出力 JSONL を取り込み、翻訳キャッシュと結果 JSONL（--batch と同じ形式）に入れる")
+    ap.add_argument("output", help="Batch API の出力 JSONL（{key, response} / {key, error}）")
+    ap.add_argument("-m", "--manifest", default=_batch_manifest_path("gemini_batch_input.jsonl"),
+                    help="--batch-export が書いたマニフェスト（既定: %(default)s）")
+    ap.add_argument("-o", "--out", default="batch_results.jsonl", help="結果の JSONL（追記。既定: %(default)s）")
+    ap.add_argument("--annotate", metavar="DIR", help="訳文併記の PNG をこのディレクトリへ保存")
+    args = ap.parse_args(argv)
+
+    entries: Dict[str, list] = {}
+    with open(args.manifest, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                ent = json.loads(line)
+            except ValueError:
+                continue
+            entries.setdefault(ent["key"], []).append(ent)
+    if args.annotate:
+        os.makedirs(args.annotate, exist_ok=True)
+    engine = TranslationEngine()
+    counts = {"ok": 0, "failed": 0, "unknown": 0}
+    try:
+        with open(args.output, "r", encoding="utf-8") as src, open(args.out, "a", encoding="utf-8") as out:
+            for line in src:
+                try:
+                    obj = json.loads(line)
+                except ValueError:
+                    continue
+                ents = entries.pop(obj.get("key"), None)
+                if not ents:
+                    counts["unknown"] += 1; continue
+                for ent in ents:
+                    rec = {"path": ent["path"], "hash": ent["hash"]}
+                    try:
+                        if obj.get("response") is None:
+                            raise RuntimeError(json.dumps(obj.get("error") or obj.get("status") or obj, ensure_ascii=False)[:500])
+                        res = engine.batch_result(obj["key"], obj["response"], ent.get("keep_source", KEEP_SOURCE))
+                        rec.update(source=res.source, ja=res.text, tokens=res.tokens, cached=False, batch=True)
+                        if args.annotate:
+                            # 書き出し後に差し替わった画像には付けない（訳が別の画像のものになる）
+                            with open(ent["path"], "rb") as f:
+                                if hashlib.sha256(f.read()).hexdigest() == ent["hash"]:
+                                    stem = os.path.splitext(os.path.basename(ent["path"]))[0]
+                                    rec["annotated"] = engine.save_annotated(
+                                        _batch_open(ent["path"], ent.get("preprocess", False)), res.text, res.source,
+                                        ent.get("keep_source", KEEP_SOURCE),
+                                        out_path=os.path.join(args.annotate, f"{stem}_{ent['hash'][:8]}.png"))
+                    except Exception as e:
+                        rec["error"] = str(e)[:500]
+                    out.write(json.dumps(rec, ensure_ascii=False) + "\n")
+                    counts["failed" if "error" in rec else "ok"] += 1
+    finally:
+        engine.close()
+    missing = sum(len(v) for v in entries.values())
+    print(f"[import] ok={counts['ok']} failed={counts['failed']} missing={missing} unknown-keys={counts['unknown']} "
+          f"-> {args.out}", file=sys.stderr)
+    if counts["failed"] or missing:
+        print(f"[import] 失敗/未処理の分は --batch ... -o {args.out} で続きから訳せます（成功済みは飛ばされます）", file=sys.stderr)
+    return 1 if counts["failed"] else 0
+
+
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--bench":
+        sys.exit(_run_bench(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == "--batch":
+        sys.exit(_run_batch(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == "--batch-export":
+        sys.exit(_run_batch_export(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == "--batch-import":
+        sys.exit(_run_batch_import(sys.argv[2:]))
     app = QApplication(sys.argv); app.setApplicationDisplayName("ScreenTranslate (Gemini) v1")
     w = Overlay(); sys.exit(app.exec())
 
@@ -2825,75 +6148,28 @@ class _LassoOverlay(Overlay):
             return
         super()._auto_edit_hover()
 
-    def _grab_roi_png_ui_thread(self) -> bytes:
-        if self.use_free_roi and len(self.free_path) >= 3:
-            return self._grab_free_polygon_png_ui_thread()
-        return super()._grab_roi_png_ui_thread()
+    def _free_roi_active(self) -> bool:
+        return self.use_free_roi and len(self.free_path) >= 3
 
-    def _grab_free_polygon_png_ui_thread(self) -> bytes:
+    def _main_capture_plan(self) -> tuple:
+        if not self._free_roi_active():
+            return super()._main_capture_plan()
+        # 多角形は撮影時点の ROI/頂点で物理座標にしておく（展開はワーカー側）
         roi_box = QRect(self.state.roi)
-        old_opacity = None; panel_old_opacity = None; msg_old_opacity = None
-        if OST_HIDE_ON_CAPTURE or getattr(self, "msg_outside", False):
-            old_opacity = self.windowOpacity(); self.setWindowOpacity(0.0)
-            if self.ctrl_panel and self.ctrl_panel.isVisible():
-                panel_old_opacity = self.ctrl_panel.windowOpacity(); self.ctrl_panel.setWindowOpacity(0.0)
-            if self.msg_panel and self.msg_panel.isVisible():
-                msg_old_opacity = self.msg_panel.windowOpacity(); self.msg_panel.setWindowOpacity(0.0)
-            from PySide6.QtGui import QGuiApplication
-            from PySide6.QtCore import QThread
-            QGuiApplication.processEvents(); QThread.msleep(16)
-
-        try:
-            with mss.mss() as sct:
-                if OST_PRIMARY_ONLY:
-                    ps = QGuiApplication.primaryScreen(); ps_geo = ps.geometry()
-                    idx = max(1, min(OST_MON_INDEX, len(sct.monitors) - 1))
-                    mon = sct.monitors[idx]
-                    sx = mon["width"]/ps_geo.width(); sy = mon["height"]/ps_geo.height()
-                    region = {
-                        "left":   mon["left"] + int(roi_box.left()   * sx),
-                        "top":    mon["top"]  + int(roi_box.top()    * sy),
-                        "width":  max(1, int(roi_box.width()  * sx)),
-                        "height": max(1, int(roi_box.height() * sy)),
-                    }
-                    off_x, off_y = roi_box.left(), roi_box.top()
-                else:
-                    global_center = self.mapToGlobal(roi_box.center())
-                    scale = self._screen_scale_for_point(global_center)
-                    region = {
-                        "left":   int(roi_box.left()   * scale),
-                        "top":    int(roi_box.top()    * scale),
-                        "width":  max(1, int(roi_box.width()  * scale)),
-                        "height": max(1, int(roi_box.height() * scale)),
-                    }
-                    sx = sy = scale; off_x, off_y = roi_box.left(), roi_box.top()
-
-                shot = sct.grab(region)
-                base = Image.frombytes("RGB", (shot.width, shot.height), shot.rgb)
-
-            pts = [(int((pt.x()-off_x)*sx), int((pt.y()-off_y)*sy)) for pt in self.free_path]
-            mask = Image.new("L", (base.width, base.height), 0)
-            d = ImageDraw.Draw(mask); d.polygon(pts, fill=255)
-            mask = mask.filter(ImageFilter.GaussianBlur(0.8))  # ← 追加
-            result = Image.new("RGB", base.size, (24, 24, 24)); result.paste(base, (0,0), mask)
-
-        finally:
-            if old_opacity is not None: self.setWindowOpacity(old_opacity)
-            if panel_old_opacity is not None and self.ctrl_panel: self.ctrl_panel.setWindowOpacity(panel_old_opacity)
-            if msg_old_opacity is not None and self.msg_panel: self.msg_panel.setWindowOpacity(msg_old_opacity)
-            from PySide6.QtGui import QGuiApplication; QGuiApplication.processEvents()
-
-        if OST_PREPROCESS:
-            result = result.convert("L")
-            result = ImageEnhance.Brightness(result).enhance(1.12)
-            result = ImageEnhance.Contrast(result).enhance(1.32)
-            result = ImageEnhance.Sharpness(result).enhance(1.1)
-
-        if OST_SAVE_CAPTURE or DEBUG:
-            os.makedirs("captures", exist_ok=True)
-            result.save(os.path.join("captures", "last_main.png"), "PNG")
-
-        buf = io.BytesIO(); result.save(buf, format="PNG"); return buf.getvalue()
+        sx, sy, _ox, _oy = self._physical_scale(roi_box, _capture_session().monitors)
+        off_x, off_y = roi_box.left(), roi_box.top()
+        pts = [(int((pt.x()-off_x)*sx), int((pt.y()-off_y)*sy)) for pt in self.free_path]
+        finish = super()._finish_main_capture
+        return roi_box, lambda img: finish(_offload(_LassoOverlay._mask_free_polygon, img, pts))
+
+    @staticmethod
+    def _mask_free_polygon(base: Image.Image, pts: list) -> Image.Image:
+        """ROI 外接矩形のキャプチャに自由選択の多角形マスクをかける（外側は暗色で塗る）"""
+        mask = Image.new("L", (base.width, base.height), 0)
+        d = ImageDraw.Draw(mask); d.polygon(pts, fill=255)
+        mask = mask.filter(ImageFilter.GaussianBlur(0.8))  # ← 追加
+        result = Image.new("RGB", base.size, (24, 24, 24)); result.paste(base, (0,0), mask)
+        return result
 
 # 置換：以降で使われる Overlay をラッソ対応版に差し替える
 Overlay = _LassoOverlay